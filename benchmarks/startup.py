@@ -0,0 +1,79 @@
+"""
+Measure the cold start time of the package and the command line interface.
+
+Each case is run in a fresh interpreter a number of times, and the fastest and
+median times are reported. Run from the root of the repository:
+
+    python benchmarks/startup.py [--runs N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HTML = """<h1>Startup</h1>
+<p>A short paragraph with <em>some</em> <a href="gopher://example.com/">links</a>.</p>
+"""
+
+MARKDOWN = """# Startup
+
+A short paragraph with *some* [links](gopher://example.com/).
+
+    :::python
+    print("Hello")
+"""
+
+
+def _time(command, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (str(ROOT), env.get('PYTHONPATH')) if p
+    )
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings), statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup time")
+    parser.add_argument("-n", "--runs", type=int, default=20, help="runs per case")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        html_path = Path(directory, 'startup.html')
+        html_path.write_text(HTML)
+        md_path = Path(directory, 'startup.md')
+        md_path.write_text(MARKDOWN)
+        out_path = str(Path(directory, 'out.txt'))
+
+        cases = [
+            ("interpreter", [sys.executable, '-c', 'pass']),
+            ("import gopher_render", [sys.executable, '-c', 'import gopher_render']),
+            ("cli html", [sys.executable, '-m', 'gopher_render', str(html_path), out_path]),
+            ("cli markdown", [sys.executable, '-m', 'gopher_render', str(md_path), out_path]),
+        ]
+        for name, command in cases:
+            fastest, median = _time(command, args.runs)
+            print("{:<24}{:>10.1f} ms min{:>10.1f} ms median".format(
+                name, fastest * 1000, median * 1000
+            ))
+
+
+if __name__ == "__main__":
+    main()
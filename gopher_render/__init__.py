@@ -1,6 +1,17 @@
-from ._parser import GopherHTMLParser
-# This is to allow poetry to run the main function
-# as a script. Not ideal really
-# TODO: It is unclear why, but running the script using the entrypoint
-# specified in the setup.py relies on main being imported here.
-from .cli import main
+from ._parser import GopherHTMLParser, RenderConfig, render_file, render_targets, render_widths
+from ._parser import ResourceLimitExceeded, NodeLimitExceeded, DepthLimitExceeded
+from ._parser import OutputLimitExceeded, TimeLimitExceeded
+
+
+def __getattr__(name):
+    # This is to allow poetry to run the main function as a script. The
+    # command line interface is only imported when it is asked for, as it
+    # brings in modules that plain library use does not need.
+    if name == 'main':
+        from .cli import main
+        return main
+    # Similarly, asyncio is only imported for asynchronous rendering.
+    if name in ('render_async', 'render_cooperative', 'RenderExecutor'):
+        from . import _async
+        return getattr(_async, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
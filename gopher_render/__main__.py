@@ -1,4 +1,4 @@
+from .cli import main
 
 if __name__ == "__main__":
-    from .cli import main
     main()
@@ -0,0 +1,388 @@
+"""
+Helpers for ANSI SGR (Select Graphic Rendition) escape sequences.
+
+Themed code blocks surround every token with its own pair of escape sequences,
+even when neighbouring tokens share a style. The minimiser here tracks the
+graphic state the escape sequences set up, and only emits the transitions that
+are actually required before each piece of visible text.
+
+This module also maps colours down to the 256 and 16 colour palettes, for
+clients that cannot display 24-bit colour.
+"""
+
+import re
+from bisect import bisect_left
+
+
+_sgr_regex = re.compile(r"\x1b\[([;\d]*)m")
+
+# A possibly incomplete escape sequence at the end of a chunk of input.
+_partial_sgr_regex = re.compile(r"\x1b(\[[;\d]*)?\Z")
+
+# Each attribute tracked, in the order their codes are emitted, with the code
+# that returns it to its default state.
+_slots = (
+    ('intensity', '22'),
+    ('italic', '23'),
+    ('underline', '24'),
+    ('blink', '25'),
+    ('invert', '27'),
+    ('conceal', '28'),
+    ('crossed_out', '29'),
+    ('font', '10'),
+    ('foreground', '39'),
+    ('background', '49'),
+    ('frame', '54'),
+    ('overline', '55'),
+)
+
+# Attributes that make a difference to how whitespace is displayed. Changes to
+# any other attribute can be deferred past whitespace.
+_whitespace_slots = ('underline', 'invert', 'crossed_out', 'background', 'frame', 'overline')
+
+# Codes that set an attribute, and codes that return one to its default.
+_set_codes = {
+    1: 'intensity', 2: 'intensity',
+    3: 'italic', 20: 'italic',
+    4: 'underline', 21: 'underline',
+    5: 'blink', 6: 'blink',
+    7: 'invert',
+    8: 'conceal',
+    9: 'crossed_out',
+    51: 'frame', 52: 'frame',
+    53: 'overline',
+}
+_reset_codes = {
+    22: 'intensity',
+    23: 'italic',
+    24: 'underline',
+    25: 'blink',
+    27: 'invert',
+    28: 'conceal',
+    29: 'crossed_out',
+    10: 'font',
+    39: 'foreground',
+    49: 'background',
+    54: 'frame',
+    55: 'overline',
+}
+
+# Codes that are followed by a 256 colour or 24-bit colour, and the attribute
+# they set. Underline colours are not tracked.
+_extended_colour_slots = {
+    38: 'foreground',
+    48: 'background',
+    58: None,
+}
+
+_text_regex = re.compile(r"\n|[^\S\n]+|[^\s]+")
+
+
+def _apply_parameters(state, parameters):
+    """
+    Update the state with the parameters of a single SGR escape sequence.
+
+    Returns whether every code was understood, and whether the sequence reset
+    all attributes. Codes that are not understood are skipped. If the
+    parameters cannot be parsed at all, the state is left unchanged.
+    """
+    try:
+        codes = [int(p) if p else 0 for p in parameters.split(';')]
+    except ValueError:
+        return False, False
+    updated = dict(state)
+    understood = True
+    reset = False
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code == 0:
+            updated.clear()
+            reset = True
+        elif code in _set_codes:
+            updated[_set_codes[code]] = str(code)
+        elif code in _reset_codes:
+            updated.pop(_reset_codes[code], None)
+        elif 11 <= code <= 19:
+            updated['font'] = str(code)
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            updated['foreground'] = str(code)
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            updated['background'] = str(code)
+        elif code in _extended_colour_slots:
+            # The colour parameters that follow have to be skipped even for
+            # an underline colour, which is not tracked, so that they are not
+            # taken for codes of their own.
+            if codes[i + 1:i + 2] == [5] and len(codes) > i + 2:
+                length = 3
+            elif codes[i + 1:i + 2] == [2] and len(codes) > i + 4:
+                length = 5
+            else:
+                return False, False
+            slot = _extended_colour_slots[code]
+            if slot is None:
+                understood = False
+            else:
+                updated[slot] = ';'.join(str(c) for c in codes[i:i + length])
+            i += length
+            continue
+        else:
+            understood = False
+        i += 1
+    state.clear()
+    state.update(updated)
+    return understood, reset
+
+
+def _sequence(parameters):
+    return "\x1b[{}m".format(';'.join(parameters))
+
+
+class EscapeSequenceMinimiser(object):
+    """
+    A streaming state machine that rewrites text containing SGR escape
+    sequences to use as few of them as possible without changing how the text
+    is displayed.
+
+    Redundant sequences are dropped, adjacent runs with the same style are
+    merged, changes that do not affect whitespace are deferred until the next
+    visible character, and several changes are combined into a single
+    sequence, or a reset where that is shorter.
+
+    Every line is left in the state the original text had at its end, so lines
+    can still be displayed independently of each other.
+    """
+
+    def __init__(self):
+        self._emitted = {}
+        self._pending = {}
+        self._buffer = ""
+        # Whether the terminal may have attributes set that are not tracked,
+        # which a reset would clear as well.
+        self._untracked = False
+
+    def _transition(self, slots=None):
+        """
+        Return the escape sequence required to bring the emitted state in line
+        with the pending one, optionally only for some of the attributes.
+        """
+        emitted = self._emitted
+        pending = self._pending
+        parameters = []
+        for slot, reset in _slots:
+            if slots is not None and slot not in slots:
+                continue
+            target = pending.get(slot)
+            if emitted.get(slot) != target:
+                parameters.append(target if target is not None else reset)
+                if target is None:
+                    del emitted[slot]
+                else:
+                    emitted[slot] = target
+        if not parameters:
+            return ""
+        if slots is None and not self._untracked:
+            # Compare against resetting everything and then setting only
+            # what is required.
+            reset_parameters = ['0'] + [
+                pending[slot] for slot, reset in _slots if slot in pending
+            ]
+            if len(';'.join(reset_parameters)) < len(';'.join(parameters)):
+                parameters = reset_parameters
+        return _sequence(parameters)
+
+    def _write_text(self, text, out):
+        for match in _text_regex.finditer(text):
+            chunk = match.group(0)
+            if chunk == '\n' or not chunk.isspace():
+                out.append(self._transition())
+            else:
+                out.append(self._transition(_whitespace_slots))
+            out.append(chunk)
+
+    def feed(self, text):
+        """
+        Process some text, returning as much of the output as can be
+        determined so far.
+        """
+        text = self._buffer + text
+        self._buffer = ""
+        partial = _partial_sgr_regex.search(text)
+        if partial:
+            self._buffer = partial.group(0)
+            text = text[:partial.start()]
+
+        out = []
+        position = 0
+        for match in _sgr_regex.finditer(text):
+            self._write_text(text[position:match.start()], out)
+            updated = dict(self._pending)
+            understood, resets_all = _apply_parameters(updated, match.group(1))
+            if not understood or (resets_all and self._untracked):
+                # Pass anything not understood through untouched, with the
+                # state up to date beforehand. The codes that are understood
+                # still take effect on the terminal. Resets are passed through
+                # too while untracked attributes may be set.
+                out.append(self._transition())
+                out.append(match.group(0))
+                self._emitted = dict(updated)
+                self._untracked = not understood
+            self._pending = updated
+            position = match.end()
+        self._write_text(text[position:], out)
+        return "".join(out)
+
+    def close(self):
+        """
+        Return the remainder of the output, leaving the final state as it was
+        at the end of the original text.
+        """
+        out = [self._transition(), self._buffer]
+        self._buffer = ""
+        return "".join(out)
+
+
+def minimise_escape_sequences(text):
+    """
+    Rewrite the text to use as few ANSI SGR escape sequences as possible.
+    """
+    minimiser = EscapeSequenceMinimiser()
+    return minimiser.feed(text) + minimiser.close()
+
+
+# Colour depth reduction
+
+COLOUR_DEPTH_TRUECOLOR = 'truecolor'
+
+_colour_depths = {
+    None: COLOUR_DEPTH_TRUECOLOR,
+    COLOUR_DEPTH_TRUECOLOR: COLOUR_DEPTH_TRUECOLOR,
+    24: COLOUR_DEPTH_TRUECOLOR,
+    256: 256,
+    16: 16,
+}
+
+
+def normalise_colour_depth(depth):
+    """
+    Return the canonical form of a colour depth: 'truecolor', 256 or 16.
+    """
+    try:
+        return _colour_depths[depth]
+    except (KeyError, TypeError):
+        raise ValueError("Unsupported colour depth: {}".format(depth))
+
+
+# The 16 system colours, using the values xterm uses by default.
+_system_colours = (
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+    (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+)
+
+_cube_levels = (0, 95, 135, 175, 215, 255)
+_grey_levels = tuple(8 + 10 * i for i in range(24))
+
+
+def _nearest_table(levels):
+    """
+    Return the index of the nearest level for every possible channel value,
+    preferring the lower level when two are equally close.
+    """
+    midpoints = [(a + b) / 2 for a, b in zip(levels, levels[1:])]
+    return tuple(bisect_left(midpoints, v) for v in range(256))
+
+
+# The nearest level of the 6x6x6 colour cube, and of the greyscale ramp, for
+# every possible channel value.
+_cube_table = _nearest_table(_cube_levels)
+_grey_table = _nearest_table(_grey_levels)
+
+
+def _palette_colour(index):
+    """
+    Return the (r, g, b) value of a colour in the 256 colour palette.
+    """
+    if index < 16:
+        return _system_colours[index]
+    if index < 232:
+        index -= 16
+        return (
+            _cube_levels[index // 36],
+            _cube_levels[(index // 6) % 6],
+            _cube_levels[index % 6],
+        )
+    return (_grey_levels[index - 232],) * 3
+
+
+def _distance(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+def nearest_256(rgb):
+    """
+    Return the index of the closest colour to rgb in the 256 colour palette.
+
+    The system colours are not considered, since terminals commonly let them
+    be redefined.
+    """
+    r, g, b = rgb
+    cube = (_cube_table[r], _cube_table[g], _cube_table[b])
+    cube_index = 16 + 36 * cube[0] + 6 * cube[1] + cube[2]
+    grey_index = 232 + _grey_table[(r + g + b) // 3]
+    if _distance(rgb, _palette_colour(grey_index)) < _distance(rgb, _palette_colour(cube_index)):
+        return grey_index
+    return cube_index
+
+
+# The 16 colour table is indexed by the top four bits of each channel, and
+# built on first use.
+_SIXTEEN_BITS = 4
+_sixteen_table = None
+
+
+def _build_sixteen_table():
+    shift = 8 - _SIXTEEN_BITS
+    size = 1 << _SIXTEEN_BITS
+    centres = [(i << shift) + (1 << (shift - 1)) for i in range(size)]
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        grid = numpy.array(centres, dtype=numpy.int32)
+        colours = numpy.stack(
+            numpy.meshgrid(grid, grid, grid, indexing='ij'),
+            axis=-1,
+        ).reshape(-1, 1, 3)
+        palette = numpy.array(_system_colours, dtype=numpy.int32).reshape(1, -1, 3)
+        distances = ((colours - palette) ** 2).sum(axis=-1)
+        return tuple(int(i) for i in distances.argmin(axis=1))
+
+    table = []
+    for r in centres:
+        for g in centres:
+            for b in centres:
+                table.append(min(
+                    range(len(_system_colours)),
+                    key=lambda i: _distance((r, g, b), _system_colours[i])
+                ))
+    return tuple(table)
+
+
+def nearest_16(rgb):
+    """
+    Return the index of the closest of the 16 system colours to rgb.
+    """
+    global _sixteen_table
+    if _sixteen_table is None:
+        _sixteen_table = _build_sixteen_table()
+    shift = 8 - _SIXTEEN_BITS
+    r, g, b = rgb
+    return _sixteen_table[
+        ((r >> shift) << (2 * _SIXTEEN_BITS)) |
+        ((g >> shift) << _SIXTEEN_BITS) |
+        (b >> shift)
+    ]
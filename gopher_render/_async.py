@@ -0,0 +1,216 @@
+"""
+Rendering from asyncio code without blocking the event loop.
+
+Parsing and rendering are entirely CPU bound, so they are run on an executor.
+Each worker process keeps the configurations it has been sent, so that their
+renderer maps are only compiled once. A `RenderExecutor` goes further and
+sends its configuration to each worker process once when it starts, so that
+only the source has to be sent with each job.
+
+Work that has already started on a worker cannot be interrupted from outside.
+A render with a timeout is given what remains of it as the parser's time
+limit, so it stops itself while parsing or rendering once the time is up, on
+any executor. A cancelled render can only be told to stop when it runs in a
+thread of this process, and then stops between chunks of the source and
+before rendering the parsed document. On other executors it carries on until
+it finishes or its time runs out.
+"""
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+
+# The amount of source fed to the parser between checks.
+_CHUNK_SIZE = 64 * 1024
+
+# The number of configurations each worker keeps compiled.
+_MAX_CONFIGS = 8
+
+_configs = OrderedDict()
+_configs_lock = threading.Lock()
+
+# The configuration sent to a worker process by a RenderExecutor.
+_installed_config = None
+
+
+class RenderCancelled(Exception):
+    """
+    Raised on a worker when it notices that the render it is working on is no
+    longer wanted.
+    """
+    pass
+
+
+def _as_config(config):
+    from ._parser import RenderConfig
+    if isinstance(config, RenderConfig):
+        return config
+    return RenderConfig(**config)
+
+
+def _get_config(config):
+    """
+    Return the worker's copy of a configuration. Configurations sent to
+    another process arrive as new objects, and this allows their compiled
+    renderer maps to be reused.
+    """
+    config = _as_config(config)
+    with _configs_lock:
+        try:
+            existing = _configs[config]
+            _configs.move_to_end(config)
+            return existing
+        except KeyError:
+            pass
+        _configs[config] = config
+        if len(_configs) > _MAX_CONFIGS:
+            _configs.popitem(last=False)
+    return config
+
+
+def _check(deadline, cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise RenderCancelled()
+    if deadline is not None and time.monotonic() > deadline:
+        raise RenderCancelled()
+
+
+def _render(source, config, markdown_options, deadline, cancelled=None):
+    from ._parser import TimeLimitExceeded
+    config = _get_config(config)
+    limited = False
+    if deadline is not None:
+        # The parser's own time limit stops the render part way through
+        remaining = max(deadline - time.monotonic(), 0)
+        if config.time_limit is None or remaining < config.time_limit:
+            config = config.replace(time_limit=remaining)
+            limited = True
+    parser = config.session()
+    try:
+        if markdown_options is not None:
+            _check(deadline, cancelled)
+            parser.feed_markdown(source, **markdown_options)
+        else:
+            for start in range(0, len(source), _CHUNK_SIZE):
+                _check(deadline, cancelled)
+                parser.feed(source[start:start + _CHUNK_SIZE])
+        _check(deadline, cancelled)
+        parser.close()
+    except TimeLimitExceeded:
+        if limited:
+            raise RenderCancelled()
+        raise
+    if limited and isinstance(parser.truncated, TimeLimitExceeded):
+        # The document was cut short by the timeout rather than its own limit
+        raise RenderCancelled()
+    return parser.parsed
+
+
+def _install_config(config):
+    global _installed_config
+    _installed_config = _get_config(config)
+    # Compile the renderer maps up front, while the worker would otherwise
+    # be idle
+    _installed_config.renderer_maps
+
+
+def _render_installed(source, markdown_options, deadline):
+    return _render(source, _installed_config, markdown_options, deadline)
+
+
+class RenderExecutor(concurrent.futures.ProcessPoolExecutor):
+    """
+    A process pool whose workers are given a configuration as they start.
+    Renders with that configuration only send the source to the workers.
+
+    Workers are started with the spawn method, so they do not inherit any
+    open files or connections of the event loop.
+    """
+
+    def __init__(self, config, max_workers=None):
+        config = _as_config(config)
+        self.config = config
+        super().__init__(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_install_config,
+            initargs=(config,),
+        )
+
+
+async def render_async(source, config, executor=None, *, markdown_options=None, timeout=None):
+    """
+    Render a document on an executor, returning the rendered text.
+
+    `config` is a `RenderConfig`, or a dictionary of arguments for one. If
+    `markdown_options` is provided, the source is Markdown, and is converted
+    with those options. Without an executor, the event loop's default
+    executor is used.
+
+    If the time limit expires, `asyncio.TimeoutError` is raised, and the
+    worker stops rendering soon after. A cancelled render is only stopped
+    early on a thread executor; see the module documentation.
+    """
+    loop = asyncio.get_running_loop()
+    config = _as_config(config)
+    # The monotonic clock is unaffected by changes to the system time, and is
+    # shared by every process on the machine, so worker processes can compare
+    # against the deadline too.
+    deadline = None if timeout is None else time.monotonic() + timeout
+    cancelled = None
+    if isinstance(executor, RenderExecutor) and executor.config == config:
+        future = loop.run_in_executor(
+            executor,
+            _render_installed,
+            source,
+            markdown_options,
+            deadline,
+        )
+    else:
+        if not isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            # Workers in this process can be told to stop straight away
+            cancelled = threading.Event()
+        future = loop.run_in_executor(
+            executor,
+            _render,
+            source,
+            config,
+            markdown_options,
+            deadline,
+            cancelled,
+        )
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except RenderCancelled:
+        # The worker noticed the deadline before the event loop did
+        raise asyncio.TimeoutError()
+    except BaseException:
+        if cancelled is not None:
+            cancelled.set()
+        raise
+
+
+async def render_cooperative(source, config, *, markdown_options=None, max_nodes=100):
+    """
+    Render a document on the event loop itself, giving control back to the
+    loop after every chunk of the source is parsed and every `max_nodes` nodes
+    are rendered.
+
+    This lets many documents be rendered side by side without a thread or
+    process for each, so a small document is not held up until a large one
+    that arrived first has finished.
+    """
+    parser = _get_config(config).session()
+    if markdown_options is not None:
+        parser.feed_markdown(source, **markdown_options)
+    else:
+        for start in range(0, len(source), _CHUNK_SIZE):
+            parser.feed(source[start:start + _CHUNK_SIZE])
+            await asyncio.sleep(0)
+    for _ in parser.close_incremental(max_nodes):
+        await asyncio.sleep(0)
+    return parser.parsed
@@ -0,0 +1,203 @@
+"""
+Minimum raggedness line breaking.
+
+The greedy wrapping done by the `textwrap` module fills each line as much as
+possible, which can leave some lines very loose once they are justified. The
+functions here instead choose the breaks that minimise the sum of the squared
+slack of every line except the last.
+
+The naive dynamic program for this is quadratic in the number of words. The
+cost of a line is a convex function of its length, so the line costs satisfy
+the quadrangle inequality and a candidate break that beats an earlier one for
+some line end will keep beating it for every later line end. That allows the
+candidates to be kept in a monotone queue, with a binary search to find where
+each new candidate takes over, for O(n log n) overall.
+"""
+
+from collections import deque
+from textwrap import TextWrapper
+
+from ._textwrap import _len, cached_layout
+
+
+def _split_long_words(words, width):
+    """
+    Split any words that are wider than the available width into pieces that
+    fit. The pieces of a word are separated by zero width gaps.
+
+    Words containing ANSI escape sequences are left alone, because splitting
+    them could break an escape sequence apart.
+    """
+    pieces = []
+    joined = []
+    for word in words:
+        if len(word) > width and _len(word) == len(word):
+            chunks = [word[i:i + width] for i in range(0, len(word), width)]
+            pieces.extend(chunks)
+            joined.extend([True] * (len(chunks) - 1))
+            joined.append(False)
+        else:
+            pieces.append(word)
+            joined.append(False)
+    return pieces, joined
+
+
+def _find_breaks(widths, gaps, width, first_line_adjustment=0):
+    """
+    Determine the optimal break points for a sequence of words.
+
+    `widths` are the display widths of the words, and `gaps` the width of the
+    space following each word. Returns the indices of the words that start
+    each line.
+    """
+    count = len(widths)
+    offsets = [0] * (count + 1)
+    for k in range(count):
+        offsets[k + 1] = offsets[k] + widths[k] + gaps[k]
+    # Lines starting at the first word have a different width available if
+    # the initial and subsequent indents differ. The line starts are then no
+    # longer monotone, which the queue below relies on, so the first word is
+    # kept out of the queue and compared against it separately.
+    starts = offsets[:]
+    starts[0] -= first_line_adjustment
+
+    # Overfull lines are only chosen if there is no alternative, so their
+    # penalty has to outweigh any amount of slack on the other lines. It
+    # grows linearly with the overflow to keep the cost function convex.
+    overflow_penalty = (count + 1) * (width + 1) ** 2
+
+    costs = [0] * (count + 1)
+    previous = [0] * (count + 1)
+
+    def length(i, j):
+        return offsets[j] - gaps[j - 1] - starts[i]
+
+    def cost(i, j):
+        slack = width - length(i, j)
+        if slack >= 0:
+            return costs[i] + slack * slack
+        return costs[i] - slack * overflow_penalty
+
+    # Each entry is a candidate line start and the first line end for which
+    # it is the best candidate.
+    queue = deque()
+    for j in range(1, count):
+        while len(queue) > 1 and queue[1][1] <= j:
+            queue.popleft()
+        best = 0
+        if queue and cost(queue[0][0], j) <= cost(0, j):
+            best = queue[0][0]
+        costs[j] = cost(best, j)
+        previous[j] = best
+
+        # Candidates at the back of the queue that j beats from the first
+        # line end it could serve will never be needed again.
+        while queue:
+            candidate, start = queue[-1]
+            if cost(j, max(start, j + 1)) <= cost(candidate, max(start, j + 1)):
+                queue.pop()
+            else:
+                break
+        if not queue:
+            queue.append((j, j + 1))
+            continue
+
+        candidate, start = queue[-1]
+        low = max(start, j + 1) + 1
+        high = count + 1
+        while low < high:
+            middle = (low + high) // 2
+            if cost(j, middle) <= cost(candidate, middle):
+                high = middle
+            else:
+                low = middle + 1
+        if low <= count:
+            queue.append((j, low))
+
+    # The last line has no cost as long as it fits, so it is chosen separately.
+    def last_cost(i):
+        slack = width - length(i, count)
+        return costs[i] if slack >= 0 else costs[i] - slack * overflow_penalty
+
+    best = count - 1
+    best_cost = last_cost(best)
+    for i in range(count - 2, 0, -1):
+        if width < length(i, count):
+            break
+        if last_cost(i) < best_cost:
+            best = i
+            best_cost = last_cost(i)
+    if last_cost(0) < best_cost:
+        best = 0
+
+    breaks = []
+    j = count
+    i = best
+    while j > 0:
+        breaks.append(i)
+        j = i
+        i = previous[j]
+    breaks.reverse()
+    return breaks
+
+
+def _measure_words(text):
+    """
+    Split text into words, returning them with their display widths and the
+    length of the longest.
+    """
+    words = text.split()
+    return words, [_len(w) for w in words], max(map(len, words), default=0)
+
+
+def optimal_wrap(
+    text,
+    width=70,
+    initial_indent='',
+    subsequent_indent='',
+    fix_sentence_endings=False,
+    break_long_words=True,
+    **kwargs
+):
+    """
+    Wrap text to the specified width, choosing line breaks to minimise the
+    raggedness of the resulting paragraph.
+
+    This accepts the same keyword arguments as `textwrap.wrap`, though only
+    the ones that affect the choice of breaks are honoured.
+    """
+    if width <= 0:
+        raise ValueError("invalid width %r (must be > 0)" % width)
+    words, widths, longest = cached_layout(('optimal', text), lambda: _measure_words(text))
+    if not words:
+        return []
+
+    available = width - len(subsequent_indent)
+    first_line_adjustment = len(initial_indent) - len(subsequent_indent)
+    joined = [False] * len(words)
+    if break_long_words and available > 0 and longest > available:
+        words, joined = _split_long_words(words, available)
+        widths = [_len(w) for w in words]
+    gaps = []
+    for word, is_joined in zip(words, joined):
+        if is_joined:
+            gaps.append(0)
+        elif fix_sentence_endings and TextWrapper.sentence_end_re.search(word):
+            gaps.append(2)
+        else:
+            gaps.append(1)
+
+    breaks = _find_breaks(widths, gaps, max(available, 1), first_line_adjustment)
+    breaks.append(len(words))
+
+    lines = []
+    for line_number in range(len(breaks) - 1):
+        start, end = breaks[line_number], breaks[line_number + 1]
+        parts = []
+        for k in range(start, end - 1):
+            parts.append(words[k])
+            parts.append(' ' * gaps[k])
+        parts.append(words[end - 1])
+        indent = initial_indent if line_number == 0 else subsequent_indent
+        lines.append(indent + ''.join(parts))
+    return lines
@@ -0,0 +1,237 @@
+"""
+Direct conversion of Python-Markdown's element tree into the parse tree.
+
+Converting Markdown to HTML and then parsing that HTML again means serializing
+the whole document only to tokenize it straight away. The extension here
+instead hooks in after Markdown's own tree processors have run, and passes the
+elements directly to a GopherHTMLParser as if they had just been parsed.
+
+Raw HTML from the source document is still stored in Markdown's stash as text,
+so that is parsed as normal where it occurs.
+
+Markdown is an optional dependency, so this module should only be imported if
+it is available.
+"""
+
+import html
+import re
+from html.parser import HTMLParser
+from xml.etree import ElementTree as etree
+
+import markdown
+from markdown import util
+from markdown.extensions import Extension
+from markdown import postprocessors
+from markdown.postprocessors import RawHtmlPostprocessor
+from markdown.treeprocessors import Treeprocessor
+
+
+# Postprocessors that only affect text containing Markdown's placeholders.
+_placeholder_postprocessors = tuple(
+    getattr(postprocessors, name)
+    for name in ('AndSubstitutePostprocessor', 'UnescapePostprocessor')
+    if isinstance(getattr(postprocessors, name, None), type)
+)
+
+# Matches the tag at the start of stashed HTML. Markdown only makes its own
+# pattern available from version 3.3.
+_block_level_regex = getattr(
+    RawHtmlPostprocessor,
+    'BLOCK_LEVEL_REGEX',
+    re.compile(r'^\<\/?([^ >]+)')
+)
+
+# An ampersand that does not start an entity.
+_amp_regex = re.compile(r'&(?!(?:\#[0-9]+|\#x[0-9a-f]+|[0-9a-z]+);)', re.I)
+
+
+def _escape_text(text):
+    """
+    Escape text the way Markdown's serializer does, leaving anything that
+    looks like an entity alone.
+    """
+    if '&' in text:
+        text = _amp_regex.sub('&amp;', text)
+    return text.replace('<', '&lt;').replace('>', '&gt;')
+
+
+class _FragmentParser(HTMLParser):
+    """
+    Parses a fragment of raw HTML, passing the results on to another parser.
+    """
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self._target = target
+
+    def handle_starttag(self, tag, attrs):
+        self._target.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._target.handle_endtag(tag)
+
+    def handle_data(self, data):
+        self._target.handle_data(data)
+
+
+class GopherTreeprocessor(Treeprocessor):
+    """
+    Feeds the finished element tree to a parser, and then empties it so that
+    Markdown has nothing left to serialize.
+    """
+
+    def __init__(self, md, parser):
+        super().__init__(md)
+        self._parser = parser
+
+    def run(self, root):
+        # Raw HTML is restored to the document by a postprocessor, which will
+        # never see it. Everything else the postprocessors do still has to be
+        # applied to the text.
+        self._postprocessors = [
+            pp for pp in self.md.postprocessors
+            if not isinstance(pp, RawHtmlPostprocessor)
+        ]
+        self._text_unchanged = all(
+            isinstance(pp, _placeholder_postprocessors)
+            for pp in self._postprocessors
+        )
+        if root.text:
+            self._feed_text(root.text)
+        for child in root:
+            self._feed_element(child)
+        root.clear()
+
+    def _postprocess(self, text):
+        """
+        Apply the postprocessors to a string of HTML.
+        """
+        for pp in self._postprocessors:
+            text = pp.run(text)
+        return text
+
+    def _text(self, text):
+        """
+        Return the text as it would be after serialization, postprocessing
+        and parsing the resulting HTML.
+        """
+        if self._text_unchanged and util.STX not in text and '&' not in text:
+            return text
+        # The serializer leaves anything that looks like an entity alone, so
+        # that Markdown can place entities in the tree.
+        return html.unescape(
+            self._postprocess(_escape_text(text))
+        )
+
+    def _stashed(self, index):
+        return self.md.htmlStash.rawHtmlBlocks[index]
+
+    def _is_block_level(self, raw):
+        m = _block_level_regex.match(raw)
+        if m:
+            if m.group(1)[0] in ('!', '?', '@', '%'):
+                return True
+            return self.md.is_block_level(m.group(1))
+        return False
+
+    def _raw_to_string(self, raw):
+        """
+        Return stashed HTML as a string, including any HTML it refers to.
+        """
+        if isinstance(raw, etree.Element):
+            raw = self.md.serializer(raw)
+        else:
+            raw = str(raw)
+        return util.HTML_PLACEHOLDER_RE.sub(
+            lambda m: self._raw_to_string(self._stashed(int(m.group(1)))),
+            raw
+        )
+
+    def _feed_raw(self, raw):
+        if isinstance(raw, etree.Element):
+            # Markdown inside HTML is stashed as elements
+            self._feed_element(raw)
+            return
+        fragment = _FragmentParser(self._parser)
+        fragment.feed(self._postprocess(self._raw_to_string(raw)))
+        fragment.close()
+
+    def _feed_text(self, text):
+        position = 0
+        for match in util.HTML_PLACEHOLDER_RE.finditer(text):
+            if match.start() > position:
+                self._parser.handle_data(self._text(text[position:match.start()]))
+            self._feed_raw(self._stashed(int(match.group(1))))
+            position = match.end()
+        if position < len(text):
+            self._parser.handle_data(self._text(text[position:]))
+
+    def _feed_element(self, element):
+        parser = self._parser
+        if isinstance(element.tag, str):
+            placeholder = None
+            if element.tag == 'p' and len(element) == 0 and element.text:
+                placeholder = util.HTML_PLACEHOLDER_RE.fullmatch(element.text)
+            raw = self._stashed(int(placeholder.group(1))) if placeholder else None
+            if raw is not None and not isinstance(raw, etree.Element) and self._is_block_level(str(raw)):
+                # Block level HTML replaces the paragraph Markdown put it in
+                self._feed_raw(raw)
+            else:
+                parser.handle_starttag(
+                    element.tag,
+                    [(k, self._text(v)) for k, v in element.items()]
+                )
+                if element.text:
+                    self._feed_text(element.text)
+                for child in element:
+                    self._feed_element(child)
+                parser.handle_endtag(element.tag)
+        # Comments and processing instructions are ignored, as they would be
+        # by the parser.
+        if element.tail:
+            self._feed_text(element.tail)
+
+
+class GopherExtension(Extension):
+    """
+    Markdown extension that parses the document directly into a
+    GopherHTMLParser instead of producing HTML.
+    """
+
+    def __init__(self, parser, **kwargs):
+        self._parser = parser
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # Run after every other tree processor
+        md.treeprocessors.register(
+            GopherTreeprocessor(md, self._parser),
+            'gopher',
+            -100
+        )
+
+
+def markdown_converter(parser, extensions=None, **kwargs):
+    """
+    Create a Markdown instance that feeds the documents it converts to the
+    parser. It can be reused for several documents, as long as it is reset
+    along with the parser between them.
+
+    Any additional arguments are passed to `markdown.Markdown`.
+    """
+    extensions = list(extensions or [])
+    extensions.append(GopherExtension(parser))
+    return markdown.Markdown(extensions=extensions, **kwargs)
+
+
+def feed_markdown(parser, source, extensions=None, **kwargs):
+    """
+    Convert Markdown source and feed the result to the parser.
+
+    Any additional arguments are passed to `markdown.Markdown`. The Markdown
+    instance is returned so that any metadata extracted by extensions can be
+    accessed.
+    """
+    md = markdown_converter(parser, extensions=extensions, **kwargs)
+    md.convert(source)
+    return md
@@ -0,0 +1,260 @@
+"""
+Paginated output, for documents too long for clients to load in one go.
+
+The rendered document is split into pages of a fixed number of lines. Each
+page is rendered on its own, from only the top level nodes whose output falls
+on it, with a footer of the links used on it and navigation to the pages
+either side. Finding where a page starts means knowing the height of every
+node before it, so the heights are kept in an index as nodes are rendered.
+The index can be saved and given back with the same document and
+configuration, so that later pages are rendered without rendering everything
+before them.
+"""
+
+from ._stream import OutputWriter
+
+
+# The lines added to the end of each page, by output format. The selector is
+# given by the `selector` template passed to `paginate`.
+_NAVIGATION_TEMPLATES = dict(
+    text=dict(
+        page="Page {page}",
+        previous="Previous page: {selector}",
+        next="Next page: {selector}",
+    ),
+    gophermap=dict(
+        page="Page {page}",
+        previous="1Previous page\t{selector}\t{host}\t{port}",
+        next="1Next page\t{selector}\t{host}\t{port}",
+    ),
+)
+
+
+class Pages(object):
+    """
+    The pages of a parsed document. Pages are numbered from 1 and rendered
+    when they are asked for with `page()`, or by iterating. `len()` gives the
+    number of pages, but has to measure the whole document.
+
+    Created by `GopherHTMLParser.paginate`.
+    """
+
+    def __init__(self, parser, page_lines, selector=None, index=None):
+        if page_lines < 1:
+            raise ValueError("page_lines must be at least 1")
+        if parser._output_format == 'gophermap' and selector is None:
+            raise ValueError("A selector is required for gophermap pages")
+        self._parser = parser
+        self._nodes = parser.tree.children
+        self._page_lines = page_lines
+        self._selector = selector
+        self._assigned = set()
+        self._links = None
+        # The line each node starts on, and whether it starts at the
+        # beginning of that line, for the nodes measured so far and the
+        # position after the last of them.
+        self._starts = [0]
+        self._line_begins = [True]
+        if index is not None:
+            for start, line_begins in index[1:]:
+                self._starts.append(start)
+                self._line_begins.append(line_begins)
+            if len(self._starts) > len(self._nodes) + 1:
+                raise ValueError("The index is for a different document")
+
+    @property
+    def index(self):
+        """
+        The heights of the nodes measured so far, which can be passed to
+        `paginate` to paginate the same document with the same configuration
+        again.
+        """
+        return list(zip(self._starts, self._line_begins))
+
+    def _render_node(self, position):
+        """
+        Render a top level node and return its output, without the margins
+        of the document.
+        """
+        parser = self._parser
+        node = self._nodes[position]
+        output = []
+        # A writer that changes nothing, only so the output can be collected
+        parser._writer = OutputWriter(output.append, optimise=False)
+        try:
+            for _ in parser._render_nodes(
+                [node], None, assign=position not in self._assigned
+            ):
+                pass
+            parser._writer.close()
+        finally:
+            parser._writer = None
+        self._assigned.add(position)
+        return "".join(output)
+
+    def _measure(self, rendered, until_line):
+        """
+        Render nodes until the index covers `until_line`, or the whole
+        document. Their output is kept in `rendered`.
+        """
+        while not self._measured_all() and self._starts[-1] <= until_line:
+            position = len(self._starts) - 1
+            text = self._render_node(position)
+            rendered[position] = text
+            self._starts.append(self._starts[-1] + text.count("\n"))
+            if text:
+                self._line_begins.append(text.endswith("\n"))
+            else:
+                self._line_begins.append(self._line_begins[-1])
+
+    def _measured_all(self):
+        return len(self._starts) == len(self._nodes) + 1
+
+    def _line_count(self):
+        """
+        The number of lines in the document, once it has all been measured.
+        A last line that is empty doesn't count.
+        """
+        if self._line_begins[-1]:
+            return self._starts[-1]
+        return self._starts[-1] + 1
+
+    def __len__(self):
+        self._measure({}, float('inf'))
+        return max(1, -(-self._line_count() // self._page_lines))
+
+    def __iter__(self):
+        number = 1
+        while True:
+            try:
+                yield self.page(number)
+            except IndexError:
+                return
+            number += 1
+
+    def page(self, number):
+        """
+        Render a page, given its number.
+        """
+        if number < 1:
+            raise IndexError("Pages are numbered from 1")
+        first = (number - 1) * self._page_lines
+        end = first + self._page_lines
+        rendered = {}
+        # Measuring one line past the page tells whether there is another
+        self._measure(rendered, end)
+        measured = len(self._starts) - 1
+        if self._measured_all():
+            if number > 1 and first >= self._line_count():
+                raise IndexError("The document has no page {}".format(number))
+            has_next = end < self._line_count()
+        else:
+            # There are more lines than were needed for this page
+            has_next = True
+
+        # Start from a node that begins on a line of its own, so that the
+        # first line is complete.
+        start = 0
+        for position in range(measured):
+            if self._starts[position] > first:
+                break
+            if self._line_begins[position]:
+                start = position
+        stop = start
+        while stop < measured and self._starts[stop] < end:
+            stop += 1
+
+        text = "".join(
+            rendered[p] if p in rendered else self._render_node(p)
+            for p in range(start, stop)
+        )
+        lines = text.split("\n")
+        if stop == len(self._nodes) and self._line_begins[-1]:
+            # The document ends with a line break, not an empty line
+            lines.pop()
+        offset = first - self._starts[start]
+        lines = lines[offset:offset + self._page_lines]
+
+        parser = self._parser
+        parser._stopped = False
+        output = []
+        writer = parser._create_writer(output.append)
+        writer.write("\n".join(lines))
+        links = self._page_links(start, stop, first, end)
+        if links and not parser._stopped:
+            writer.write("\n\n")
+            writer.write("".join(l.link_render(parser._box) for l in links))
+        writer.write("\n\n" + self._navigation(number, has_next) + "\n")
+        writer.close()
+        return "".join(output)
+
+    def _overlaps(self, position, first, end):
+        """
+        Return whether the output of a node is on any of the lines from
+        `first` up to `end`.
+        """
+        if self._starts[position] >= end:
+            return False
+        last = self._starts[position + 1]
+        if self._line_begins[position + 1]:
+            # It ends with a line break, so it finished on the line before
+            last -= 1
+        return last >= first
+
+    def _page_links(self, start, stop, first, end):
+        """
+        The links to list in the footer of a page: those in the nodes on
+        it, in order of their reference numbers.
+        """
+        parser = self._parser
+        if parser._link_placement != 'footer':
+            return []
+        if self._links is None:
+            self._links = self._links_by_node()
+        links = {}
+        for position in range(start, stop):
+            if not self._overlaps(position, first, end):
+                continue
+            for link, first_link in self._links.get(position, ()):
+                if not parser._inside_ignored(link):
+                    links.setdefault(id(first_link), link)
+        return sorted(
+            links.values(),
+            key=lambda l: l._context['link_reference']
+        )
+
+    def _links_by_node(self):
+        """
+        Map the position of each top level node to the footer links in it,
+        each with the link whose reference it shares.
+        """
+        tree = self._parser.tree
+        positions = {id(node): p for p, node in enumerate(self._nodes)}
+        links = {}
+        for first_link in self._parser._footer_pending_links:
+            for link in [first_link] + first_link._duplicates:
+                node = link
+                while node.parent is not None and node.parent is not tree:
+                    node = node.parent
+                position = positions.get(id(node))
+                if position is not None:
+                    links.setdefault(position, []).append((link, first_link))
+        return links
+
+    def _navigation(self, number, has_next):
+        parser = self._parser
+        templates = _NAVIGATION_TEMPLATES[parser._output_format]
+        lines = [templates['page'].format(page=number)]
+        if self._selector is not None:
+            context = dict(host=parser._gopher_host, port=parser._gopher_port)
+            if number > 1:
+                lines.append(templates['previous'].format(
+                    selector=self._selector.format(page=number - 1),
+                    **context
+                ))
+            if has_next:
+                lines.append(templates['next'].format(
+                    selector=self._selector.format(page=number + 1),
+                    **context
+                ))
+        return "\n".join(lines)
@@ -1,16 +1,22 @@
+import copy
+import functools
+import itertools
+import mmap
 import re
+import threading
+import time
 from html.parser import HTMLParser
+from types import MappingProxyType
 from urllib.parse import urlparse
 from collections import namedtuple
-import cssselect
 
-from ._selectors import tag_matches, Specificity
-
-from .rendering import full_justify
+from ._ansi import normalise_colour_depth
+from ._stream import DEFAULT_CHUNK_SIZE, OutputWriter, decode_chunks
+from ._textwrap import shared_layout
 
 from .rendering import Box, BoxSide
 from .rendering import Renderer, InlineRenderer, BlockRenderer
-from .rendering import HeaderRenderer, MarkdownHeaderRenderer
+from .rendering import MarkdownHeaderRenderer
 from .rendering import ParagraphRenderer, BlockQuoteRenderer
 from .rendering import CodeRenderer, PreRenderer
 from .rendering import EmRenderer, StrongRenderer
@@ -20,7 +26,36 @@ from .rendering import LinkRenderer, ExtractedLinkRenderer
 from .rendering import ImageRenderer, ExtractedImageLinkRenderer
 from .rendering import ListRenderer, ListItemRenderer, OrderedListItemRenderer
 from .rendering import DefinitionListRenderer, DefinitionListTermHeaderRenderer, DefinitionListItemRenderer
-from .rendering import AnsiEscapeCodeRenderer
+from .rendering import TableRenderer, TableCaptionRenderer, TableRowRenderer
+from .rendering import TableCellRenderer, TableHeaderCellRenderer
+from .rendering import adapt_renderer, _strip_table_marks
+
+
+class ResourceLimitExceeded(Exception):
+    """
+    Raised when a document exceeds one of the resource limits in its
+    configuration. The limit is available as `limit`.
+    """
+
+    def __init__(self, message, limit):
+        super().__init__(message)
+        self.limit = limit
+
+
+class NodeLimitExceeded(ResourceLimitExceeded):
+    pass
+
+
+class DepthLimitExceeded(ResourceLimitExceeded):
+    pass
+
+
+class OutputLimitExceeded(ResourceLimitExceeded):
+    pass
+
+
+class TimeLimitExceeded(ResourceLimitExceeded):
+    pass
 
 
 # TODO: Maybe this class should do more actual parsing? Or just rename to Tag
@@ -42,6 +77,10 @@ class TagParser(object):
         self.renderer_settings = None
         self._context = context
         self._pending_links = []
+        # When streaming, whether the children are written as they are
+        # completed, and how many of them have been.
+        self._streams = False
+        self._streamed = 0
 
     def tag_children(self):
         """
@@ -65,7 +104,16 @@ class TagParser(object):
         except TypeError:
             self.renderer = renderer
 
-    def render(self, box):
+    def begin_render(self, box):
+        """
+        Create the renderer instance for the tag. Returns the instance and the
+        box that the children should be rendered in.
+        """
+        renderer = self.renderer
+        if not isinstance(renderer, type):
+            # Stateless renderers are shared, so there's no instance
+            return None, renderer.box(self, self.renderer_settings, box)
+
         render_context = dict(
             parent_box=box,
         )
@@ -81,13 +129,13 @@ class TagParser(object):
             # If the renderer doesn't provide a box then the parent's gets
             # passed through.
             pass
+        return render_inst, box
 
-        rendered_children = []
-        for c in self.children:
-            rendered_children.append(
-                c.render(box)
-            )
-
+    def finish_render(self, render_inst, box, rendered_children):
+        """
+        Render the tag, given the renderer instance and box returned by
+        `begin_render` and the rendered children.
+        """
         if len(self._pending_links):
             rendered_children.append('\n')
         for l in self._pending_links:
@@ -95,10 +143,93 @@ class TagParser(object):
                 l.link_render(box)
             )
 
+        if render_inst is None:
+            return self.renderer.render(
+                self,
+                self.renderer_settings,
+                box,
+                "".join(rendered_children)
+            )
         return render_inst.render(
             "".join(rendered_children)
         )
 
+    def render(self, box):
+        render_inst, box = self.begin_render(box)
+
+        rendered_children = []
+        for c in self.children:
+            rendered_children.append(
+                c.render(box)
+            )
+
+        return self.finish_render(render_inst, box, rendered_children)
+
+
+# TODO: This needs a lot more work to be comprehensive
+def _guess_type(path):
+    p = path.rpartition('.')
+    if p[0] == "":
+        # No file extension, so gopher menu?
+        return 1
+    elif p[2] in ("html", "htm"):
+        return 'h'
+    elif p[2] == 'gif':
+        return 'g'
+    elif p[2] in ('jpg', 'jpeg', 'png', 'bmp', 'tiff'):
+        return 'I'
+    elif p[2] in ('txt', 'csv', 'tsv', 'md'):
+        return 0
+    else:
+        # Default to binary for all other files
+        return 9
+
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_href(href, host, port):
+    """
+    Parse the href of a link and return a mapping containing the elements of
+    a gophermap link. Relative links, and links that have to go through a
+    web proxy, are on the given host and port.
+
+    The results are cached, as the same hrefs tend to appear many times in
+    a document, and in many documents.
+    """
+    parsed = urlparse(href)
+    if parsed.scheme in ("http", "https"):
+        link = dict(
+            type='h',
+            selector="URL:{}".format(href),
+            host=host,
+            port=port,
+        )
+    elif parsed.scheme == 'gopher':
+        # Absolute gopher url
+        link = dict(
+            type=_guess_type(parsed.path),
+            selector=parsed.path,
+            host=parsed.hostname,
+            port=parsed.port,
+        )
+    elif parsed.scheme == '':
+        # Relative URL - interpret as a relative gopher link
+        link = dict(
+            type=_guess_type(parsed.path),
+            selector=parsed.path,
+            host=host,
+            port=port,
+        )
+    else:
+        # Unknown protocol: try it as a web link
+        link = dict(
+            type='h',
+            selector="URL:{}".format(href),
+            host=host,
+            port=port,
+        )
+    # The result is shared, so it can't be changed
+    return MappingProxyType(link)
+
 
 class LinkParser(TagParser):
 
@@ -116,73 +247,53 @@ class LinkParser(TagParser):
             **context
         )
         self.link_renderer = None
+        self.link_renderer_settings = None
+        self._gopher_link = None
+        # Later links to the same href, if links are being deduplicated
+        self._duplicates = []
         if tag == 'a':
             # If set, this will be used as the link description
-            self.title = self.attrs.get('title', None)
-            self.href = self.attrs.get('href', None)
-            self.gopher_link = self._parse_href()
+            self.title = self._attribute('title')
+            self.href = self._attribute('href')
         elif tag == 'img':
             # If set, this will be used as the link description
-            self.title = self.attrs.get('alt', None)
-            self.href = self.attrs.get('src', None)
-            self.gopher_link = self._parse_href()
-
-    # TODO: This needs a lot more work to be comprehensive
-    def _guess_type(self, path):
-        p = path.rpartition('.')
-        if p[0] == "":
-            # No file extension, so gopher menu?
-            return 1
-        elif p[2] in ("html", "htm"):
-            return 'h'
-        elif p[2] == 'gif':
-            return 'g'
-        elif p[2] in ('jpg', 'jpeg', 'png', 'bmp', 'tiff'):
-            return 'I'
-        elif p[2] in ('txt', 'csv', 'tsv', 'md'):
-            return 0
-        else:
-            # Default to binary for all other files
-            return 9
-
-
-    def _parse_href(self):
+            self.title = self._attribute('alt')
+            self.href = self._attribute('src')
+
+    def _attribute(self, name):
+        # Attributes of links are rendered along with the text
+        value = self.attrs.get(name, None)
+        if value:
+            value = _strip_table_marks(value)
+        return value
+
+    @property
+    def gopher_link(self):
         """
-        Parse the href of the link and return a dictionary containing the
-        elements of a gophermap link
+        The elements of a gophermap link for the href. These are only worked
+        out when a renderer needs them, and are shared by every link with the
+        same href.
         """
-        parsed = urlparse(self.href)
-        if parsed.scheme in ("http", "https"):
-            return dict(
-                type='h',
-                selector="URL:{}".format(self.href),
-                host=self._context['gopher_host'],
-                port=self._context['gopher_port'],
-            )
-        elif parsed.scheme == 'gopher':
-            # Absolute gopher url
-            return dict(
-                type=self._guess_type(parsed.path),
-                selector=parsed.path,
-                host=parsed.hostname,
-                port=parsed.port,
-            )
-        elif parsed.scheme == '':
-            # Relative URL - interpret as a relative gopher link
-            return dict(
-                type=self._guess_type(parsed.path),
-                selector=parsed.path,
-                host=self._context['gopher_host'],
-                port=self._context['gopher_port'],
-            )
-        else:
-            # Unknown protocol: try it as a web link
-            return dict(
-                type='h',
-                selector="URL:{}".format(self.href),
-                host=self._context['gopher_host'],
-                port=self._context['gopher_port'],
+        if self._gopher_link is None:
+            self._gopher_link = _resolve_href(
+                self.href,
+                self._context['gopher_host'],
+                self._context['gopher_port'],
             )
+        return self._gopher_link
+
+    def retarget(self, **context):
+        """
+        Replace the context the link was created with, so that it can be
+        rendered for another configuration.
+        """
+        old_context = self._context
+        self._context = context
+        if (
+            context['gopher_host'] != old_context['gopher_host']
+            or context['gopher_port'] != old_context['gopher_port']
+        ):
+            self._gopher_link = None
 
     def assign_renderer(self, renderer):
         try:
@@ -197,35 +308,49 @@ class LinkParser(TagParser):
         except TypeError:
             self.link_renderer = renderer[1]
 
+    def _placement(self):
+        return self._context['image_placement'] if self.tag == 'img' else self._context['link_placement']
+
     # For links, this generally renders the contents of the tag in its
     # original location, unless 'link_placement' is 'inline', in which case
     # link rendering occurs in the original location.
-    def render(self, box):
-        placement = self._context['image_placement'] if self.tag == 'img' else self._context['link_placement']
-        if placement != 'inline':
-            return super().render(box)
-        return self.link_render(box)
-
-    def link_render(self, box):
-        """
-        Render an extracted link.
-        """
-        render_context = dict(
-            href=self.href,
-            title=self.title,
-            gopher_link=self.gopher_link,
-            parent_box=box
+    def begin_render(self, box):
+        if self._placement() != 'inline':
+            return super().begin_render(box)
+        return self._begin_link_render(box)
+
+    def finish_render(self, render_inst, box, rendered_children):
+        if self._placement() != 'inline':
+            return super().finish_render(render_inst, box, rendered_children)
+        if render_inst is None:
+            return self.renderer.render(
+                self,
+                self.renderer_settings,
+                box,
+                "".join(rendered_children)
+            )
+        return render_inst.render(
+            "".join(rendered_children)
         )
-        render_context.update(self._context)
 
-        placement = render_context['image_placement'] if self.tag == 'img' else render_context['link_placement']
-        if placement == "inline":
+    def _begin_link_render(self, box):
+        if self._placement() == "inline":
             renderer = self.renderer
             renderer_settings = self.renderer_settings
         else:
             renderer = self.link_renderer
             renderer_settings = self.link_renderer_settings
 
+        if not isinstance(renderer, type):
+            return None, renderer.box(self, renderer_settings, box)
+
+        render_context = dict(
+            href=self.href,
+            title=self.title,
+            gopher_link=self.gopher_link,
+            parent_box=box
+        )
+        render_context.update(self._context)
         render_inst = renderer(self, **render_context)
         if renderer_settings is not None:
             render_context['settings'] = renderer_settings
@@ -236,6 +361,13 @@ class LinkParser(TagParser):
             # If the renderer doesn't provide a box then the parent's gets
             # passed through.
             pass
+        return render_inst, box
+
+    def link_render(self, box):
+        """
+        Render an extracted link.
+        """
+        render_inst, box = self._begin_link_render(box)
 
         rendered_children = []
         for c in self.children:
@@ -243,11 +375,21 @@ class LinkParser(TagParser):
                 c.render(box)
             )
 
+        if render_inst is None:
+            return self.link_renderer.render(
+                self,
+                self.link_renderer_settings,
+                box,
+                "".join(rendered_children)
+            )
         return render_inst.render(
             "".join(rendered_children)
         )
 
 
+_whitespace_regex = re.compile(r'\s*\n\s*|[ \t]+')
+
+
 class DataParser(TagParser):
     def __init__(self, parent, data, **context):
         super().__init__(None, parent, None, **context)
@@ -259,17 +401,10 @@ class DataParser(TagParser):
             # This produces different results than how browsers handle whitespace.
             # However, the paragraph renderer will also strip whitespace from the
             # start and end of its content, minimising the impact of this.
-            data_split = data.split('\n')
-            if len(data_split) > 1:
-                data_stripped = []
-                data_stripped.append(data_split[0].rstrip())
-                if len(data_split) > 2:
-                    data_stripped.extend([l.strip() for l in data_split[1:-1]])
-                data_stripped.append(data_split[-1].lstrip())
-                data_split = data_stripped
-            data = ' '.join(data_split)
-            data = re.sub('[ \t]+', ' ', data)
-        self.data = data
+            # Any run of whitespace that includes a line break, and any run of
+            # spaces and tabs, becomes a single space.
+            data = _whitespace_regex.sub(' ', data)
+        self.data = _strip_table_marks(data)
         self.closed = True
 
     def render(self, box):
@@ -286,6 +421,13 @@ class DocumentParser(object):
     """
     def __init__(self):
         self.children = []
+        # The parser whose configuration the links in the tree were last set
+        # up for, and the renderer maps used to assign renderers to it.
+        self.owner = None
+        self.renderer_maps = None
+        # The renderer maps of the parser that left out the content of
+        # elements whose renderers would ignore it, if any.
+        self.pruned_by = None
 
     def tag_children(self):
         """
@@ -302,49 +444,380 @@ class DocumentParser(object):
 
 RendererMapping = namedtuple('RendererMapping', 'selector, renderer')
 
+# Pseudo-classes that depend on what comes after an element in the document,
+# so can't be matched until the document has been parsed.
+_forward_pseudo_class_regex = re.compile(r':(last-|only-|nth-last-|empty)')
+
+
+def _subject_element(selector):
+    """
+    Return the element name the subject of a selector must have, or None if
+    it could be any element.
+    """
+    from cssselect.parser import CombinedSelector
+    tree = selector.parsed_tree
+    while not hasattr(tree, 'element'):
+        if isinstance(tree, CombinedSelector):
+            # The subject is on the right of a combinator. Negations also
+            # have a subselector, but it is what the subject must not match.
+            tree = tree.subselector
+        elif hasattr(tree, 'selector'):
+            tree = tree.selector
+        else:
+            return None
+    if tree.element in (None, '*'):
+        return None
+    return tree.element.lower()
+
+
+def _ignores_content(renderer):
+    try:
+        renderer = renderer[0]
+    except TypeError:
+        pass
+    return getattr(renderer, 'ignores_content', False)
+
+
+def _skips_content(tag):
+    """
+    Return whether the content of a tag can be skipped, because its renderer
+    ignores it. The content of links is still needed to render them
+    elsewhere.
+    """
+    return _ignores_content(tag.renderer) and not isinstance(tag, LinkParser)
+
+
+def _inline_runs(block, out_of_time=None):
+    """
+    Flatten the content of a block into a list of (text, prefix, suffix)
+    runs, where the prefix and suffix are the markup that the inline elements
+    around the text add. Returns the runs, the number of nodes in the
+    content and whether it was cut short, or None if any of the nodes has to
+    be rendered on its own: because it has a renderer class or a renderer
+    that does more than add markup around its content, or because links are
+    rendered after it.
+
+    If `out_of_time` is given, it is called after each node, as it would be
+    if the nodes were rendered one by one, and the content is cut short
+    once it returns True.
+    """
+    runs = []
+    prefix = []
+    steps = 0
+    stopped = False
+    # Each entry is an iterator over the children of an element and the
+    # suffix to add once they're done.
+    stack = [(iter(block.children), None)]
+    while stack:
+        children, suffix = stack[-1]
+        # Once cut short, the open elements are finished with what they have
+        node = None if stopped else next(children, None)
+        if node is None:
+            stack.pop()
+            if suffix:
+                if prefix or not runs:
+                    runs.append(("", "".join(prefix), suffix))
+                    prefix = []
+                else:
+                    text, run_prefix, run_suffix = runs[-1]
+                    runs[-1] = (text, run_prefix, run_suffix + suffix)
+            continue
+        steps += 1
+        if node.tag is None:
+            runs.append((node.data, "".join(prefix), ""))
+            prefix = []
+        else:
+            renderer = node.renderer
+            if isinstance(renderer, type) or len(node._pending_links) or _skips_content(node):
+                return None
+            affixes = renderer.inline_affixes(node, node.renderer_settings)
+            if affixes is None:
+                return None
+            if affixes[0]:
+                prefix.append(affixes[0])
+            stack.append((iter(node.children), affixes[1]))
+        if out_of_time is not None and out_of_time():
+            stopped = True
+    if prefix:
+        runs.append(("", "".join(prefix), ""))
+    return runs, steps, stopped
+
+
+def _join_runs(runs):
+    return "".join([
+        part for text, prefix, suffix in runs for part in (prefix, text, suffix)
+    ])
+
+
+# Elements that can only contain other elements, so any text directly inside
+# them that is only whitespace is just formatting.
+_BLOCK_ONLY_TAGS = frozenset((
+    'ul', 'ol', 'dl', 'blockquote',
+    'table', 'thead', 'tbody', 'tfoot', 'tr',
+))
+
 
 class RendererMap(object):
     """
     Provides a mapping of CSS selectors to Renderer specifications.
+
+    The settings resolved for each distinct combination of matching selectors
+    are cached and prepared by the renderer only once, so every element that
+    matches the same rules shares the same settings dictionary. These must
+    therefore be treated as read-only. Any options provided are passed on to
+    the renderers when they prepare their settings.
     """
 
-    def __init__(self, renderer_dict):
+    def __init__(self, renderer_dict, **options):
+        # cssselect is only needed once there are selectors to parse, so it
+        # is not imported along with the package.
+        import cssselect
+        from ._selectors import tag_matches, Specificity, CLASS_SPECIFICITY
+        self._tag_matches = tag_matches
+        self._specificity = Specificity
+        self._class_specificity = CLASS_SPECIFICITY
         self._map = []
+        self._resolved = {}
+        # The same, with renderer classes replaced by their stateless
+        # equivalents
+        self._resolved_stateless = {}
+        self._options = options
+        # Rules consisting only of class selectors, as in the code themes,
+        # are looked up by class name rather than matched against every tag.
+        self._class_index = {}
+        self._general = []
+        # Rules that only match elements with a particular name, by the name
+        self._element_index = {}
+        # The names of elements that a rule could give a renderer that
+        # ignores their content, with None for any element.
+        self._ignoring_elements = set()
+        # Whether the renderer for an element can be found as soon as its
+        # start tag is parsed.
+        self.resolves_while_parsing = True
         for key in renderer_dict:
             selector = cssselect.parse(key)
+            index = len(self._map)
             self._map.append(RendererMapping(selector, renderer_dict[key]))
+            if self._split_renderer(renderer_dict[key])[0] is not None:
+                if _forward_pseudo_class_regex.search(key):
+                    self.resolves_while_parsing = False
+                if _ignores_content(renderer_dict[key]):
+                    self._ignoring_elements.update(_subject_element(s) for s in selector)
+            class_names = self._simple_class_names(selector)
+            if class_names is None:
+                elements = set(_subject_element(s) for s in selector)
+                if None in elements:
+                    self._general.append(index)
+                else:
+                    for element in elements:
+                        self._element_index.setdefault(element, []).append(index)
+            else:
+                for class_name in class_names:
+                    self._class_index.setdefault(class_name, []).append(index)
+        # Prepare the settings for every rule that specifies a renderer up
+        # front, since elements commonly match a single rule.
+        for index, mapping in enumerate(self._map):
+            if self._split_renderer(mapping.renderer)[0] is not None:
+                self._resolve((index,))
+
+    @staticmethod
+    def _simple_class_names(selector):
+        """
+        If every selector in the group is a lone class selector, return the
+        class names. Otherwise return None.
+        """
+        from cssselect.parser import Class, Element
+        class_names = []
+        for s in selector:
+            tree = s.parsed_tree
+            if s.pseudo_element is not None or not isinstance(tree, Class):
+                return None
+            inner = tree.selector
+            if not isinstance(inner, Element) or inner.element is not None or inner.namespace is not None:
+                return None
+            class_names.append(tree.class_name)
+        return class_names
+
+    @staticmethod
+    def _split_renderer(renderer):
+        try:
+            return renderer[0], renderer[1]
+        except TypeError:
+            return renderer, None
+
+    def _resolve(self, indices):
+        """
+        Combine the renderers and settings of the mappings at the given
+        indices, which must be sorted from least to most specific.
+        """
+        try:
+            return self._resolved[indices]
+        except KeyError:
+            pass
+        renderer = None
+        renderer_settings = {}
+        for index in indices:
+            r, s = self._split_renderer(self._map[index].renderer)
+            if r is not None:
+                renderer = r
+            if s is not None:
+                renderer_settings.update(s)
+        if renderer:
+            if not isinstance(renderer, type):
+                # Functions are wrapped, since they can't prepare settings
+                renderer = adapt_renderer(renderer)
+            resolved = (renderer, renderer.prepare_settings(renderer_settings, **self._options))
+        else:
+            resolved = None
+        self._resolved[indices] = resolved
+        return resolved
+
+    def _resolve_stateless(self, indices):
+        """
+        Return the result of `_resolve` for the indices, with a renderer class
+        replaced by its stateless equivalent and settings if it has one.
+        """
+        try:
+            return self._resolved_stateless[indices]
+        except KeyError:
+            pass
+        resolved = self._resolve(indices)
+        if resolved is not None and isinstance(resolved[0], type):
+            renderer, settings = resolved
+            adapter = renderer.stateless() if issubclass(renderer, Renderer) else None
+            if adapter is not None:
+                resolved = (adapter, adapter.complete_settings(settings))
+        self._resolved_stateless[indices] = resolved
+        return resolved
+
+    def may_ignore_content(self, element):
+        """
+        Return whether any rule could give an element with the given name a
+        renderer that ignores its content.
+        """
+        return element in self._ignoring_elements or None in self._ignoring_elements
 
     def get_for_tag(self, tag):
+        """
+        Return the renderer and settings for a tag, with the renderer as it
+        was configured, or None if no rule gives it a renderer.
+        """
+        return self._resolve(self._matching_indices(tag))
+
+    def get_stateless_for_tag(self, tag):
+        """
+        Return the renderer and settings to render a tag with. This is the
+        same as `get_for_tag`, except that a renderer class is replaced by
+        its stateless equivalent if it has one, so that no instance is
+        created for each element.
+        """
+        return self._resolve_stateless(self._matching_indices(tag))
+
+    def _matching_indices(self, tag):
+        """
+        Return the indices of the rules that match a tag, from least to most
+        specific.
+        """
+        tag_matches = self._tag_matches
         all_matches = []
-        for mapping in self._map:
-            match, specificity = tag_matches(tag, mapping.selector)
+        for index in itertools.chain(
+            self._general,
+            self._element_index.get(tag.tag, ())
+        ):
+            match, specificity = tag_matches(tag, self._map[index].selector)
             if match:
                 all_matches.append(
                     (
-                        Specificity(specificity),
-                        mapping
+                        self._specificity(specificity),
+                        index
                     )
                 )
-        all_matches.sort(key=lambda m: m[0])
-        renderer = None
-        renderer_settings = {}
-        for s, mapping in all_matches:
-            try:
-                r = mapping.renderer[0]
-                s = mapping.renderer[1]
-            except TypeError:
-                r = mapping.renderer
-                s = None
-            if r is not None:
-                renderer = r
-            if s is not None:
-                renderer_settings.update(s)
-        if not renderer:
-            return None
-        return (renderer, renderer_settings)
+        if self._class_index and tag.classes:
+            matched = set()
+            for class_name in tag.classes:
+                for index in self._class_index.get(class_name, ()):
+                    if index not in matched:
+                        matched.add(index)
+                        all_matches.append((self._class_specificity, index))
+        # Ties in specificity are resolved by the order of the rules
+        all_matches.sort(key=lambda m: (m[0], m[1]))
+        return tuple(index for s, index in all_matches)
+
+
+def _freeze(value):
+    """
+    Return a hashable equivalent of a configuration value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(
+            ((k, _freeze(v)) for k, v in value.items()),
+            key=lambda item: item[0]
+        ))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+# Renderer maps shared between configurations, by their arguments.
+_renderer_maps = {}
+_renderer_maps_lock = threading.Lock()
+_MAX_SHARED_RENDERER_MAPS = 32
+
+
+def _shared_renderer_maps(renderers, extracted_link_renderers, colour_depth):
+    try:
+        key = _freeze((dict(renderers), dict(extracted_link_renderers), colour_depth))
+        hash(key)
+    except TypeError:
+        # Settings that can't be compared can't be shared
+        key = None
+    with _renderer_maps_lock:
+        maps = _renderer_maps.get(key)
+        if maps is None:
+            maps = (
+                RendererMap(renderers, colour_depth=colour_depth),
+                RendererMap(extracted_link_renderers),
+            )
+            if key is not None:
+                if len(_renderer_maps) >= _MAX_SHARED_RENDERER_MAPS:
+                    del _renderer_maps[next(iter(_renderer_maps))]
+                _renderer_maps[key] = maps
+    return maps
 
 
-class GopherHTMLParser(HTMLParser):
+def _rebuild_config(cls, arguments):
+    return cls(**arguments)
+
+
+class RenderConfig(object):
+    """
+    Everything about how documents are rendered, separate from the state of
+    any particular document.
+
+    A configuration is immutable, hashable and picklable, so it can be shared
+    between threads and sent to other processes. The renderer maps are
+    compiled the first time a session is created, and pickling sends only the
+    arguments, so they are compiled again where the configuration is used.
+    The maps cache the settings they resolve, which is safe to do from
+    several threads at once.
+
+    Documents are rendered by sessions created with `session()`.
+
+    If `deduplicate_links` is set, links to the same href share a reference
+    number, and are only listed once in the footer, or once after each block
+    if `link_placement` is 'after_block'.
+
+    Limits can be placed on the resources used by each document, for
+    rendering untrusted HTML: `max_nodes` elements and text nodes,
+    `max_depth` levels of nesting, `max_output` bytes of UTF-8 encoded output
+    and `time_limit` seconds spent parsing and rendering. If `on_limit` is
+    'raise', exceeding one raises the corresponding `ResourceLimitExceeded`
+    exception. If it is 'truncate', the document is cut off at that point
+    instead, and the exception is kept in the parser's `truncated` attribute.
+    """
+
     def __init__(
         self,
         width=67,
@@ -354,33 +827,39 @@ class GopherHTMLParser(HTMLParser):
         output_format='text',
         link_placement='footer',
         image_placement='inline',
+        deduplicate_links=False,
         gopher_host="",
         gopher_port=70,
         optimise=True,
+        minimise_ansi=False,
+        colour_depth=None,
+        max_nodes=None,
+        max_depth=None,
+        max_output=None,
+        time_limit=None,
+        on_limit='raise',
     ):
         if output_format == 'gophermap' and link_placement == 'inline':
             raise ValueError("Links cannot be inlined in gophermap output")
         if output_format == 'gophermap' and gopher_host == '':
             raise ValueError("gopher_host is required for gophermap output")
-        super().__init__(convert_charrefs=True)
-        self._parsed = []
-        self.parsed = ""
-        self._tag_stack = []
-        self.tree = DocumentParser()
-        #self._width = width
-        if box:
-            self._box = box
-        else:
+        normalise_colour_depth(colour_depth)
+        if on_limit not in ('raise', 'truncate'):
+            raise ValueError("on_limit must be 'raise' or 'truncate'")
+        if box is None:
             # TODO: Maybe a default top margin as well?
-            self._box = Box(
+            box = Box(
                 width=67
             )
-        self._output_format = output_format
-        self._link_placement = link_placement
-        self._image_placement = image_placement
-        self._gopher_host = gopher_host
-        self._gopher_port = gopher_port
-        self.renderers = {
+        # The box is copied so that changes to the original have no effect
+        box_arguments = dict(
+            width=box.width,
+            margin=tuple(box.margin),
+            padding=tuple(box.padding),
+            border=tuple(box.border),
+            line_template=box.line_template,
+        )
+        all_renderers = {
             # Default renderer. A * could also be used to match any element.
             '': Renderer,
 
@@ -426,6 +905,13 @@ class GopherHTMLParser(HTMLParser):
                 margin=[0,0,0,0]
             )),
 
+            # Tables
+            'table': TableRenderer,
+            'caption': TableCaptionRenderer,
+            'tr': TableRowRenderer,
+            'td': TableCellRenderer,
+            'th': TableHeaderCellRenderer,
+
             # Inline elements
             'code': CodeRenderer,
             'a': LinkRenderer,
@@ -440,20 +926,214 @@ class GopherHTMLParser(HTMLParser):
             'del': StrikethroughRenderer,
             'span': InlineRenderer,
         }
-        self.renderers.update(renderers)
-        self.extracted_link_renderers = {
+        all_renderers.update(renderers)
+        all_extracted_link_renderers = {
             'a': ExtractedLinkRenderer,
             'img': ExtractedImageLinkRenderer,
         }
-        self.extracted_link_renderers.update(extracted_link_renderers)
-        self._default_renderer = self.renderers['']
-        del self.renderers['']
-        self._renderer_map = RendererMap(self.renderers)
-        self._extracted_link_renderer_map = RendererMap(self.extracted_link_renderers)
-        self._next_link_number = 1
-        self._footer_pending_links = []
-        self._in_pre = False
-        self._optimise = optimise
+        all_extracted_link_renderers.update(extracted_link_renderers)
+
+        arguments = dict(
+            width=width,
+            box=box_arguments,
+            renderers=copy.deepcopy(renderers),
+            extracted_link_renderers=copy.deepcopy(extracted_link_renderers),
+            output_format=output_format,
+            link_placement=link_placement,
+            image_placement=image_placement,
+            deduplicate_links=deduplicate_links,
+            gopher_host=gopher_host,
+            gopher_port=gopher_port,
+            optimise=optimise,
+            minimise_ansi=minimise_ansi,
+            colour_depth=colour_depth,
+            max_nodes=max_nodes,
+            max_depth=max_depth,
+            max_output=max_output,
+            time_limit=time_limit,
+            on_limit=on_limit,
+        )
+        default_renderer = all_renderers.pop('')
+        values = dict(
+            arguments,
+            renderers=MappingProxyType(copy.deepcopy(all_renderers)),
+            extracted_link_renderers=MappingProxyType(copy.deepcopy(all_extracted_link_renderers)),
+            default_renderer=default_renderer,
+            _arguments=arguments,
+            _hash=None,
+            _maps=None,
+            _lock=threading.Lock(),
+        )
+        del values['box']
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RenderConfig is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("RenderConfig is immutable")
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(_freeze(self._arguments)))
+        return self._hash
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return _freeze(self._arguments) == _freeze(other._arguments)
+
+    def __reduce__(self):
+        return (_rebuild_config, (type(self), dict(self._arguments, box=self.box)))
+
+    def __repr__(self):
+        return "{}(output_format={!r}, link_placement={!r}, image_placement={!r})".format(
+            type(self).__name__,
+            self.output_format,
+            self.link_placement,
+            self.image_placement,
+        )
+
+    @property
+    def box(self):
+        """
+        A new copy of the box documents are rendered in.
+        """
+        box_arguments = self._arguments['box']
+        return Box(
+            width=box_arguments['width'],
+            margin=list(box_arguments['margin']),
+            padding=list(box_arguments['padding']),
+            border=list(box_arguments['border']),
+            line_template=box_arguments['line_template'],
+        )
+
+    def replace(self, **changes):
+        """
+        Return a new configuration with some of the arguments changed.
+        """
+        arguments = dict(self._arguments, **changes)
+        if 'box' not in changes:
+            arguments['box'] = self.box
+        return type(self)(**arguments)
+
+    @property
+    def renderer_maps(self):
+        """
+        The compiled renderer map and extracted link renderer map. These are
+        shared by all configurations with the same renderers and colour
+        depth, so the selectors they resolve are too.
+        """
+        maps = self._maps
+        if maps is None:
+            with self._lock:
+                maps = self._maps
+                if maps is None:
+                    maps = _shared_renderer_maps(
+                        self.renderers,
+                        self.extracted_link_renderers,
+                        self.colour_depth,
+                    )
+                    object.__setattr__(self, '_maps', maps)
+        return maps
+
+    def session(self):
+        """
+        Create a parser to render a single document with this configuration.
+        """
+        return GopherHTMLParser(config=self)
+
+
+class _WriterSink(object):
+    """
+    Stands in for a list of rendered output, writing anything appended.
+    """
+
+    def __init__(self, writer):
+        self.append = writer.write
+
+
+class GopherHTMLParser(HTMLParser):
+    """
+    Parses HTML and renders it as text or a gophermap.
+
+    The parser can either be given a `RenderConfig`, or the same arguments as
+    `RenderConfig`, to create one. The parser holds the state of the document
+    being rendered, so it should only be used from one thread at a time, but
+    it can be reset to render another document.
+    """
+
+    def __init__(
+        self,
+        width=67,
+        box=None,
+        renderers={},
+        extracted_link_renderers={},
+        output_format='text',
+        link_placement='footer',
+        image_placement='inline',
+        deduplicate_links=False,
+        gopher_host="",
+        gopher_port=70,
+        optimise=True,
+        minimise_ansi=False,
+        colour_depth=None,
+        max_nodes=None,
+        max_depth=None,
+        max_output=None,
+        time_limit=None,
+        on_limit='raise',
+        config=None,
+    ):
+        if config is None:
+            config = RenderConfig(
+                width=width,
+                box=box,
+                renderers=renderers,
+                extracted_link_renderers=extracted_link_renderers,
+                output_format=output_format,
+                link_placement=link_placement,
+                image_placement=image_placement,
+                deduplicate_links=deduplicate_links,
+                gopher_host=gopher_host,
+                gopher_port=gopher_port,
+                optimise=optimise,
+                minimise_ansi=minimise_ansi,
+                colour_depth=colour_depth,
+                max_nodes=max_nodes,
+                max_depth=max_depth,
+                max_output=max_output,
+                time_limit=time_limit,
+                on_limit=on_limit,
+            )
+        self.config = config
+        super().__init__(convert_charrefs=True)
+        #self._width = width
+        self._box = config.box
+        self._output_format = config.output_format
+        self._link_placement = config.link_placement
+        self._image_placement = config.image_placement
+        self._deduplicate_links = config.deduplicate_links
+        self._gopher_host = config.gopher_host
+        self._gopher_port = config.gopher_port
+        self.renderers = config.renderers
+        self.extracted_link_renderers = config.extracted_link_renderers
+        self._default_renderer = adapt_renderer(config.default_renderer)
+        if not isinstance(self._default_renderer, type):
+            self._default_renderer = (
+                self._default_renderer,
+                self._default_renderer.prepare_settings({}),
+            )
+        self._renderer_map, self._extracted_link_renderer_map = config.renderer_maps
+        self._optimise = config.optimise
+        self._minimise_ansi = config.minimise_ansi
+        self._max_nodes = config.max_nodes
+        self._max_depth = config.max_depth
+        self._max_output = config.max_output
+        self._time_limit = config.time_limit
+        self._truncate = config.on_limit == 'truncate'
+        self._prune = True
 
     def _get_top(self):
         t = None
@@ -463,15 +1143,22 @@ class GopherHTMLParser(HTMLParser):
                 t = None
         return t
 
-    def _get_renderer(self, tag):
-        renderer = self._renderer_map.get_for_tag(tag)
+    def _get_renderer(self, tag, stateless=False):
+        if stateless:
+            renderer = self._renderer_map.get_stateless_for_tag(tag)
+        else:
+            renderer = self._renderer_map.get_for_tag(tag)
         if not renderer:
             renderer = self._default_renderer
         return renderer
 
-    def _get_extracted_link_renderer(self, tag):
+    def _get_extracted_link_renderer(self, tag, stateless=False):
+        renderer_map = self._extracted_link_renderer_map
         try:
-            renderer = self._extracted_link_renderer_map.get_for_tag(tag)
+            if stateless:
+                renderer = renderer_map.get_stateless_for_tag(tag)
+            else:
+                renderer = renderer_map.get_for_tag(tag)
         except KeyError:
             renderer = None
         if not renderer:
@@ -479,7 +1166,76 @@ class GopherHTMLParser(HTMLParser):
             renderer = self.extracted_link_renderers['a']
         return renderer
 
+    def _limit_exceeded(self, error):
+        """
+        Raise the error, or if documents are to be truncated, keep it and
+        ignore the rest of the document.
+        """
+        if not self._truncate:
+            raise error
+        if self.truncated is None:
+            self.truncated = error
+
+    def _time_exceeded(self):
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self._time_limit
+            return False
+        if time.monotonic() > self._deadline:
+            self._limit_exceeded(TimeLimitExceeded(
+                "Document took more than {} seconds".format(self._time_limit),
+                self._time_limit
+            ))
+            return True
+        return False
+
+    def _accept_node(self, depth=0):
+        """
+        Count a new node against the limits, returning False if it should be
+        ignored.
+        """
+        if self.truncated is not None:
+            return False
+        self._node_count += 1
+        if self._max_nodes is not None and self._node_count > self._max_nodes:
+            self._limit_exceeded(NodeLimitExceeded(
+                "Document has more than {} nodes".format(self._max_nodes),
+                self._max_nodes
+            ))
+            return False
+        if self._max_depth is not None and depth > self._max_depth:
+            self._limit_exceeded(DepthLimitExceeded(
+                "Document is nested more than {} levels deep".format(self._max_depth),
+                self._max_depth
+            ))
+            return False
+        if self._time_limit is not None and self._time_exceeded():
+            return False
+        return True
+
+    def _prunes_content(self, tag):
+        """
+        Return whether the content of a tag that has just been started should
+        be skipped, because its renderer will ignore it.
+        """
+        if not (self._prune and self._renderer_map.resolves_while_parsing):
+            return False
+        if isinstance(tag, LinkParser):
+            return False
+        if not (
+            self._renderer_map.may_ignore_content(tag.tag)
+            or _ignores_content(self._default_renderer)
+        ):
+            return False
+        return _ignores_content(self._get_renderer(tag))
+
     def handle_starttag(self, tag, attrs):
+        if self._ignoring is not None:
+            if tag not in ('br', 'img'):
+                self._ignoring.append(tag)
+            return
+        self._flush_data()
+        if not self._accept_node(len(self._tag_stack) + 1):
+            return
         parent = self._get_top() or self.tree
         t = None
         if tag == 'pre':
@@ -489,34 +1245,99 @@ class GopherHTMLParser(HTMLParser):
                 tag,
                 parent,
                 attrs,
-                output_format=self._output_format,
-                link_placement=self._link_placement,
-                image_placement=self._image_placement,
-                link_reference=self._next_link_number,
-                gopher_host=self._gopher_host,
-                gopher_port=self._gopher_port,
+                **self._link_context()
             )
-            placement = self._image_placement if tag == 'img' else self._link_placement
-            if placement == 'footer':
-                self._footer_pending_links.append(t)
-            elif placement == 'after_block':
-                parent.add_pending_link(t)
-            if placement != 'inline':
-                self._next_link_number += 1
+            self._place_link(t)
         else:
             t = TagParser(
                 tag,
                 parent,
                 attrs,
             )
-        if not t.closed:
-            self._tag_stack.append(t)
         if parent:
             parent.children.append(t)
         else:
             self.tree.append(t)
+        if not t.closed:
+            if self._prunes_content(t):
+                # Skip everything up to the matching end tag
+                t.closed = True
+                self._ignoring = [tag]
+                self.tree.pruned_by = self.config.renderer_maps
+            else:
+                self._tag_stack.append(t)
+        if self._writer is not None and (parent is self.tree or parent._streams):
+            t._streams = not t.closed and self._passes_content_through(t)
+            self._stream_completed()
+
+    def _link_context(self):
+        return dict(
+            output_format=self._output_format,
+            link_placement=self._link_placement,
+            image_placement=self._image_placement,
+            link_reference=self._next_link_number,
+            gopher_host=self._gopher_host,
+            gopher_port=self._gopher_port,
+        )
+
+    def _place_link(self, link):
+        placement = self._image_placement if link.tag == 'img' else self._link_placement
+        if placement == 'inline':
+            return
+        if self._deduplicate_links and link.href is not None:
+            if placement == 'footer':
+                first = self._footer_references.get(link.href)
+            else:
+                first = next(
+                    (l for l in link.parent._pending_links if l.href == link.href),
+                    None
+                )
+            if first is not None:
+                first._duplicates.append(link)
+                link._context['link_reference'] = first._context['link_reference']
+                return
+            if placement == 'footer':
+                self._footer_references[link.href] = link
+        if placement == 'footer':
+            self._footer_pending_links.append(link)
+        else:
+            link.parent.add_pending_link(link)
+        self._next_link_number += 1
+
+    def _adopt_tree(self, tree):
+        """
+        Take over a tree, setting up its links for this parser's
+        configuration.
+        """
+        self.tree = tree
+        self._next_link_number = 1
+        self._footer_pending_links = []
+        self._footer_references = {}
+        # Links are numbered in document order, the order they were created
+        stack = list(reversed(tree.children))
+        while stack:
+            node = stack.pop()
+            node._pending_links = []
+            if isinstance(node, LinkParser):
+                node._duplicates = []
+                node.retarget(**self._link_context())
+                self._place_link(node)
+            stack.extend(reversed(node.children))
+        tree.owner = self
 
     def handle_endtag(self, tag):
+        if self._ignoring is not None:
+            # End tags are matched as they would be if the content was parsed
+            if self._ignoring[-1] == tag:
+                self._ignoring.pop()
+                if not self._ignoring:
+                    self._ignoring = None
+                    if tag == 'pre':
+                        self._in_pre = False
+            return
+        self._flush_data()
+        if self.truncated is not None:
+            return
         if tag in ('br', 'img'):
             # br and img tags are inherently self-closing, so if we encounter an end tag
             # we can just ignore it. I believe <br/> produces endtag calls.
@@ -538,15 +1359,30 @@ class GopherHTMLParser(HTMLParser):
             self._tag_stack.pop()
 
     def handle_data(self, data):
-        # Ignore any whitespace data on its own, unless in a pre tag
-        # Pretty printed html includes a lot of this.
-        # Removing ths because it removes significant whitespace between
-        # adjacent tags... But I'm not convinced that pretty printing whitespace
-        # won't be an issue.
-        # if not self._in_pre:
-        #     if len(data) == 0 or data.isspace():
-        #         return
+        # The parser can report a single run of text in several pieces, so
+        # the text is only added to the tree once the next tag is reached.
+        if self.truncated is None and self._ignoring is None:
+            self._pending_data.append(data)
+
+    def _flush_data(self):
+        if not self._pending_data:
+            return
+        data = "".join(self._pending_data)
+        self._pending_data = []
         parent = self._get_top()
+        # Ignore any whitespace data on its own where it can only be
+        # formatting. Pretty printed html includes a lot of this. It can't be
+        # dropped elsewhere, because whitespace between adjacent inline tags
+        # is significant.
+        if (
+            not self._in_pre
+            and parent is not None
+            and parent.tag in _BLOCK_ONLY_TAGS
+            and data.isspace()
+        ):
+            return
+        if not self._accept_node():
+            return
         d = DataParser(parent, data, in_pre=self._in_pre)
         if parent:
             parent.children.append(d)
@@ -555,41 +1391,153 @@ class GopherHTMLParser(HTMLParser):
             # This probably indicates badly formed HTML.
             self.tree.append(d)
 
-    def _indent_body(self):
-        box = self._box
-        parsed = "".join(self._parsed)
-        lines = parsed.splitlines(keepends=True)
-        return "".join([
-            "{}{}".format(' ' * self._box.margin[BoxSide.LEFT], l)
-            for l in lines
-        ])
-
-    def _assign_renderers(self, tags):
-        for tag in tags:
-            renderer = self._get_renderer(tag)
-            if tag.tag in ('a', 'img'):
-                tag.assign_renderer((
-                        renderer,
-                        self._get_extracted_link_renderer(tag)
-                    )
+    def feed_markdown(self, source, extensions=None, **kwargs):
+        """
+        Convert Markdown source and feed it to the parser directly, without
+        producing and then parsing HTML.
+
+        Any additional arguments are passed to `markdown.Markdown`, and the
+        Markdown instance is returned. This requires the markdown package.
+        """
+        from ._markdown import feed_markdown
+        return feed_markdown(self, source, extensions=extensions, **kwargs)
+
+    def feed_stream(self, fp, encoding=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Feed the contents of a file-like object to the parser a chunk at a
+        time.
+
+        Binary files are decoded with the encoding given, or else the one
+        indicated by a byte order mark or `<meta>` tag, or UTF-8.
+        """
+        chunks = iter(lambda: fp.read(chunk_size), fp.read(0))
+        first = next(chunks, None)
+        if first is None:
+            return
+        chunks = itertools.chain((first,), chunks)
+        if isinstance(first, bytes):
+            chunks = decode_chunks(chunks, encoding)
+        for chunk in chunks:
+            self.feed(chunk)
+
+    def feed_file(self, path, encoding=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Feed the contents of a file to the parser a chunk at a time, mapping
+        it into memory where possible rather than reading it.
+
+        The encoding is determined as for `feed_stream`.
+        """
+        with open(path, 'rb') as in_file:
+            try:
+                mapped = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Empty files and some special files can't be mapped
+                self.feed_stream(in_file, encoding, chunk_size)
+                return
+            with mapped:
+                chunks = (
+                    mapped[i:i + chunk_size]
+                    for i in range(0, len(mapped), chunk_size)
                 )
-            else:
-                tag.assign_renderer(renderer)
+                for chunk in decode_chunks(chunks, encoding):
+                    self.feed(chunk)
+
+    def stream_to(self, out):
+        """
+        Write the rendered document to a file-like object as it is parsed,
+        instead of keeping it in `parsed`. This must be called before any of
+        the document is fed to the parser.
+
+        Each top level element is rendered and discarded as soon as the next
+        one starts, so the whole document is never held in memory. The same
+        goes for the children of elements whose renderers output their
+        content unchanged, such as html and body with the default renderers,
+        unless any selectors depend on the elements that follow. Footer
+        links are written when the parser is closed. Selectors for top level
+        elements can only take into account the elements parsed before the
+        next one starts, so the likes of `:nth-last-child` should not be used
+        for them.
+        """
+        self._writer = self._create_writer(out.write)
+
+    def _create_writer(self, write):
+        # TODO: Some variation here within our box model:
+        # Gophermap links should definitely not be indented, but this naively
+        # indents everything. If link placement is footer this should be easy
+        # enough to avoid, but for inter-block links it will be troublesome.
+        # Could perhaps identify the points where links need to be inserted
+        # and indent everything around them separately.
+        # Addition of padding and border to box model complicate this even further
+        return OutputWriter(
+            write,
+            margin_top=self._box.margin[BoxSide.TOP],
+            margin_bottom=self._box.margin[BoxSide.BOTTOM],
+            indent=' ' * self._box.margin[BoxSide.LEFT],
+            optimise=self._optimise,
+            minimise_ansi=self._minimise_ansi,
+            max_output=self._max_output,
+            exceeded=self._output_exceeded,
+        )
 
-            self._assign_renderers(tag.children)
+    def _passes_content_through(self, tag):
+        """
+        Return whether the renderer of a tag that has just been started
+        outputs its content unchanged, as the default renderer does for the
+        likes of html and body, so its children can be streamed on their own.
+        """
+        if not self._renderer_map.resolves_while_parsing:
+            return False
+        if isinstance(tag, LinkParser):
+            return False
+        renderer = self._get_renderer(tag)
+        try:
+            renderer = renderer[0]
+        except TypeError:
+            pass
+        return getattr(renderer, 'renderer_class', renderer) is Renderer
 
-    def _optimise_parsed(self):
+    def _stream_completed(self):
         """
-        Remove extraeous whitespace to the right of the text.
+        Render and discard the top level nodes before the last one, then the
+        children before the last one of each open element that passes its
+        content through, from the outermost in.
         """
-        parsed = self.parsed
-        split = parsed.split('\n')
-        optimised = [l.rstrip() for l in split]
-        return '\n'.join(optimised)
+        nodes = self.tree.children[self._rendered:-1]
+        self._rendered += len(nodes)
+        self._stream_nodes(nodes)
+        container = self.tree.children[-1] if self.tree.children else None
+        while isinstance(container, TagParser) and container._streams and not container.closed:
+            nodes = container.children[container._streamed:-1]
+            container._streamed += len(nodes)
+            self._stream_nodes(nodes)
+            container = container.children[-1] if container.children else None
+
+    def _stream_nodes(self, nodes):
+        if not nodes:
+            return
+        for _ in self._render_nodes(nodes, None):
+            pass
+        for node in nodes:
+            # Links may still be needed for the footer
+            if not isinstance(node, LinkParser):
+                node.children = []
+
+    def _assign_renderer(self, tag):
+        # Renderer classes are swapped for their stateless equivalents to
+        # render with.
+        renderer = self._get_renderer(tag, stateless=True)
+        if tag.tag in ('a', 'img'):
+            tag.assign_renderer((
+                    renderer,
+                    self._get_extracted_link_renderer(tag, stateless=True)
+                )
+            )
+        else:
+            tag.assign_renderer(renderer)
 
-    def close(self):
+    def _finish_parsing(self):
         super().close()
-        # Compile the parsed string
+        self._flush_data()
         # Anything being left in _tag_stack probably indicates an unclosed tag...
         # Pop everything off anyway and add any root tags to the tree.
         while len(self._tag_stack) > 0:
@@ -597,38 +1545,323 @@ class GopherHTMLParser(HTMLParser):
             if t.parent is None:
                 self.tree.append(t)
 
-        # Walk the tree and assign renderers.
-        self._assign_renderers(self.tree.children)
+    def dump_tree(self):
+        """
+        Finish parsing the document and return its parse tree serialized as
+        bytes, which `feed_tree` can load into a parser with any
+        configuration. The document can still be rendered afterwards.
 
-        for t in self.tree.children:
-            self._parsed.append(t.render(self._box))
+        The content of elements that this parser's renderers ignore is not
+        included, so the tree should be rendered with the same renderers.
 
-        if self._link_placement == 'footer' and len(self._footer_pending_links) > 0:
-            self._parsed.append("\n")
-            for l in self._footer_pending_links:
-                self._parsed.append(l.link_render(self._box))
+        If the output is being streamed, the tree no longer holds the elements
+        that have already been rendered, so it should be dumped before
+        streaming instead.
+        """
+        from ._tree import dump_tree
+        self._finish_parsing()
+        return dump_tree(self.tree)
 
-        # TODO: Some variation here within our box model:
-        # Gophermap links should definitely not be indented, but this naively
-        # indents everything. If link placement is footer this should be easy
-        # enough to avoid, but for inter-block links it will be troublesome.
-        # Could perhaps identify the points where links need to be inserted
-        # and indent everything around them separately.
-        # Addition of padding and border to box model complicate this even further
-        indented = self._indent_body()
-        self.parsed = "{}{}{}".format(
-            "\n" * self._box.margin[BoxSide.TOP],
-            indented,
-            "\n" * self._box.margin[BoxSide.BOTTOM]
+    def feed_tree(self, data):
+        """
+        Feed a parse tree serialized by `dump_tree` to the parser, instead of
+        parsing the HTML it came from again.
+
+        Trees can only be loaded by the version of Python that serialized
+        them, and should only be loaded from a trusted source.
+        """
+        from ._tree import load_events, replay
+        replay(self, load_events(data))
+
+    def paginate(self, page_lines, selector=None, index=None):
+        """
+        Finish parsing the document and return its `Pages`, each of
+        `page_lines` lines of the rendered document followed by a footer of
+        the links on it, if links are placed in the footer, and navigation.
+
+        `selector` is a template for the selector of a page, given its number
+        as `page`, such as "/long-document/{page}". The navigation links to
+        the pages either side if it is given, and it is required for
+        gophermaps.
+
+        Pages are only rendered when they are asked for, but where a page
+        starts depends on the height of everything before it, which is
+        measured by rendering it. The heights are kept in the `index` of the
+        pages, which can be given here to paginate the same document with the
+        same configuration again without measuring it.
+
+        A document whose output is being streamed can't be paginated.
+        """
+        from ._pages import Pages
+        if self._writer is not None:
+            raise ValueError("The output of the document is being streamed")
+        self._finish_parsing()
+        if self.tree.owner is not self:
+            self._adopt_tree(self.tree)
+        return Pages(self, page_lines, selector, index)
+
+    def render_as(self, config):
+        """
+        Finish parsing the document and render it with another configuration,
+        returning the result. This can be done for any number of
+        configurations, and this parser can still render the document itself
+        afterwards, so a document only has to be parsed once to produce
+        several outputs.
+
+        Renderers are only assigned to the elements again if the renderers
+        or colour depth differ from the last configuration the document was
+        rendered with. If the parser left out the content of elements that
+        its renderers ignore, the configuration must have the same renderers.
+        The node and depth limits of this parser's
+        configuration apply to the parsing, and the others of the given
+        configuration to the rendering.
+
+        If the output of this parser is being streamed, the elements that
+        have already been rendered are no longer available for this.
+        """
+        self._finish_parsing()
+        pruned_by = self.tree.pruned_by
+        if pruned_by is not None and pruned_by != config.renderer_maps:
+            raise ValueError(
+                "The document was parsed without the content of elements that "
+                "its renderers ignore, so it can only be rendered again with "
+                "the same renderers"
+            )
+        target = config.session()
+        target._adopt_tree(self.tree)
+        target.close()
+        return target.parsed
+
+    def close(self):
+        for _ in self.close_incremental(None):
+            pass
+
+    def close_incremental(self, max_nodes=100):
+        """
+        Finish parsing and render the document as a generator, which yields
+        every time another `max_nodes` nodes have been processed. The number
+        of nodes processed so far is yielded.
+
+        This allows a host to do other work while a large document renders,
+        rather than blocking for the entire time `close()` would. Once the
+        generator is exhausted, the result is available in `parsed` as usual,
+        unless it has been streamed (see `stream_to`). If `max_nodes` is None,
+        it never yields.
+        """
+        self._finish_parsing()
+        if self.tree.owner is not self:
+            # The tree has been rendered with another configuration
+            self._adopt_tree(self.tree)
+
+        batch = self._writer is None
+        if batch:
+            output = []
+            self._writer = self._create_writer(output.append)
+
+        maps = (self._renderer_map, self._extracted_link_renderer_map)
+        yield from self._render_nodes(
+            self.tree.children[self._rendered:],
+            max_nodes,
+            assign=self.tree.renderer_maps != maps
         )
-        if self._optimise:
-            self.parsed = self._optimise_parsed()
+        self._rendered = len(self.tree.children)
+        self.tree.renderer_maps = maps
+
+        # If a link was ignored but one of its duplicates wasn't, that is
+        # listed in its place, as it has the same reference.
+        footer_links = []
+        for l in self._footer_pending_links:
+            l = next(
+                (d for d in [l] + l._duplicates if not self._inside_ignored(d)),
+                None
+            )
+            if l is not None:
+                footer_links.append(l)
+        if not self._stopped and self._link_placement == 'footer' and len(footer_links) > 0:
+            self._writer.write("\n")
+            for l in footer_links:
+                self._writer.write(l.link_render(self._box))
+                self._steps += 1
+                if max_nodes and self._steps % max_nodes == 0:
+                    yield self._steps
+
+        self._writer.close()
+        if batch:
+            self.parsed = "".join(output)
+            self._writer = None
+
+    def _render_nodes(self, nodes, max_nodes, assign=True):
+        """
+        Assign renderers to and render the nodes and their descendants,
+        writing the output. This is a generator that yields the number of
+        steps taken so far after every `max_nodes` steps.
+        """
+        # Walk the tree and assign renderers.
+        stack = list(reversed(nodes)) if assign else []
+        while stack:
+            tag = stack.pop()
+            self._assign_renderer(tag)
+            if not _skips_content(tag):
+                stack.extend(reversed(tag.children))
+            self._steps += 1
+            if max_nodes and self._steps % max_nodes == 0:
+                yield self._steps
+
+        # Render the tree depth first, without recursion. Each frame holds a
+        # tag, its renderer instance, the box for its children, an iterator
+        # over its children and their rendered output. The output of the top
+        # level nodes goes straight to the writer.
+        writer = self._writer
+        top_level = _WriterSink(writer)
+        stack = [(None, None, self._box, iter(nodes), top_level)]
+        while stack:
+            tag, render_inst, box, children, rendered_children = stack[-1]
+            # Once a limit is reached, the remaining children are skipped and
+            # the tags that are open are finished with what they have.
+            self._stopped = self._stopped or writer.stopped
+            child = None if self._stopped else next(children, None)
+            if child is None:
+                stack.pop()
+                if tag is not None:
+                    stack[-1][4].append(
+                        tag.finish_render(render_inst, box, rendered_children)
+                    )
+                continue
+            if child.tag is None:
+                rendered_children.append(child.render(box))
+            else:
+                child_inst, child_box = child.begin_render(box)
+                # Content that would be ignored is never rendered
+                skipped = _skips_content(child)
+                inline = None
+                if isinstance(child_inst, BlockRenderer) and not skipped:
+                    inline = _inline_runs(
+                        child,
+                        self._time_exceeded if self._time_limit is not None else None
+                    )
+                if inline is not None:
+                    runs, steps, stopped = inline
+                    if stopped:
+                        self._stopped = True
+                    rendered_children.append(child.finish_render(
+                        child_inst,
+                        child_box,
+                        [_join_runs(runs)]
+                    ))
+                    # The content counts as steps like it would if it had
+                    # been rendered node by node.
+                    first = self._steps + 1
+                    self._steps += steps
+                    if max_nodes:
+                        first = -(-first // max_nodes) * max_nodes
+                        for count in range(first, self._steps + 1, max_nodes):
+                            yield count
+                else:
+                    if skipped:
+                        grandchildren = ()
+                    elif child._streamed:
+                        # The children before these have already been written
+                        grandchildren = child.children[child._streamed:]
+                    else:
+                        grandchildren = child.children
+                    stack.append((child, child_inst, child_box, iter(grandchildren), []))
+            self._steps += 1
+            if self._time_limit is not None and self._time_exceeded():
+                self._stopped = True
+            if max_nodes and self._steps % max_nodes == 0:
+                yield self._steps
+
+    @staticmethod
+    def _inside_ignored(tag):
+        """
+        Return whether a tag is inside an element whose renderer ignored it.
+        """
+        parent = tag.parent
+        while isinstance(parent, TagParser):
+            if _skips_content(parent):
+                return True
+            parent = parent.parent
+        return False
+
+    def _output_exceeded(self):
+        self._limit_exceeded(OutputLimitExceeded(
+            "Document output is more than {} bytes".format(self._max_output),
+            self._max_output
+        ))
 
     def reset(self):
+        """
+        Discard the current document so that the parser can be reused for
+        another. The renderer maps, and any settings they have resolved, are
+        kept.
+        """
         super().reset()
-        self._parsed = []
         self.parsed = ""
+        self._writer = None
+        self._rendered = 0
+        self._steps = 0
+        self._stopped = False
         self._tag_stack = []
         self.tree = DocumentParser()
+        self.tree.owner = self
         self._next_link_number = 1
         self._footer_pending_links = []
+        self._footer_references = {}
+        self._in_pre = False
+        self._ignoring = None
+        self._pending_data = []
+        self._node_count = 0
+        self._deadline = None
+        self.truncated = None
+
+
+def render_targets(source, configs):
+    """
+    Parse an HTML document once and render it with each of the
+    configurations, returning a list of the results.
+    """
+    configs = list(configs)
+    if not configs:
+        return []
+    parser = configs[0].session()
+    # Content can only be left out if every target would ignore it
+    parser._prune = all(c.renderer_maps is parser.config.renderer_maps for c in configs)
+    parser.feed(source)
+    parser.close()
+    return [parser.parsed] + [parser.render_as(config) for config in configs[1:]]
+
+
+def render_widths(source, widths, config=None):
+    """
+    Parse an HTML document once and render it at each of the widths, with
+    the configuration otherwise unchanged, returning a list of the results.
+
+    Besides parsing, anything about wrapping a paragraph that doesn't depend
+    on the width, such as splitting it into words and measuring them, is
+    only done once for all of the widths.
+    """
+    config = config or RenderConfig()
+    configs = []
+    for width in widths:
+        box = config.box
+        box.width = width
+        configs.append(config.replace(box=box))
+    with shared_layout():
+        return render_targets(source, configs)
+
+
+def render_file(path, config=None, out=None, encoding=None):
+    """
+    Render an HTML file, reading it a chunk at a time.
+
+    If `out` is given the output is written to it as the document is parsed,
+    and None is returned. Otherwise the rendered text is returned.
+    """
+    parser = (config or RenderConfig()).session()
+    if out is not None:
+        parser.stream_to(out)
+    parser.feed_file(path, encoding=encoding)
+    parser.close()
+    if out is None:
+        return parser.parsed
+    return None
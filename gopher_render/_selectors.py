@@ -203,16 +203,22 @@ def _nth_last_child_matches(tag, selector):
     return tag_children[-n] is tag and _selector_matches(tag, selector.selector)
 
 
+def _first_tag(children):
+    # Only as far as the first tag is searched, rather than collecting every
+    # tag among the children, which would make matching the children of an
+    # element with many of them quadratic.
+    return next((c for c in children if c.tag is not None), None)
+
+
 def _first_child_matches(tag, selector):
     if not hasattr(tag, 'parent') or tag.parent is None:
         return False
     if hasattr(tag, 'data'):
         return False
-    tag_children = tag.parent.tag_children()
-    if len(tag_children) == 0:
-        # wat
-        return False
-    return tag_children[0] is tag and _selector_matches(tag, selector.selector)
+    return (
+        _selector_matches(tag, selector.selector)
+        and _first_tag(tag.parent.children) is tag
+    )
 
 
 def _last_child_matches(tag, selector):
@@ -220,11 +226,10 @@ def _last_child_matches(tag, selector):
         return False
     if hasattr(tag, 'data'):
         return False
-    tag_children = tag.parent.tag_children()
-    if len(tag_children) == 0:
-        # wat
-        return False
-    return tag_children[-1] is tag and _selector_matches(tag, selector.selector)
+    return (
+        _selector_matches(tag, selector.selector)
+        and _first_tag(reversed(tag.parent.children)) is tag
+    )
 
 
 _pseudoclasses = {
@@ -416,3 +421,7 @@ class Specificity(object):
 
     def __ge__(self, other):
         return _compare_specificity(self.specificity, other.specificity) >= 0
+
+
+# The specificity of a lone class selector, shared by every match of one
+CLASS_SPECIFICITY = Specificity((0, 1, 0))
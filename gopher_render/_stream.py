@@ -0,0 +1,162 @@
+"""
+Streaming input and output for the parser.
+
+Sources can be read a chunk at a time, through an incremental decoder, so that
+a large document never has to be held in memory as a single string. The
+encoding is taken from a byte order mark or a `<meta>` tag if it is not
+known.
+
+Output can likewise be written out a line at a time as it is rendered.
+"""
+
+import codecs
+import re
+
+from ._ansi import EscapeSequenceMinimiser
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Ends any style left open when output is cut off.
+_RESET = "\x1b[0m"
+
+# UTF-32 is checked first because its little-endian BOM begins with the
+# UTF-16 one.
+_boms = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Covers both <meta charset="..."> and the http-equiv form, which has the
+# charset in its content attribute.
+_meta_charset_regex = re.compile(
+    rb"""<meta[^>]*?charset\s*=\s*["']?\s*([-\w.:]+)""",
+    re.IGNORECASE
+)
+
+# How far into the document to look for a <meta> tag, as browsers do.
+_SNIFF_LENGTH = 1024
+
+
+def sniff_encoding(data, default='utf-8'):
+    """
+    Determine the encoding of a document from its first bytes.
+    """
+    for bom, encoding in _boms:
+        if data.startswith(bom):
+            return encoding
+    match = _meta_charset_regex.search(data[:_SNIFF_LENGTH])
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return default
+
+
+def decode_chunks(chunks, encoding=None):
+    """
+    Decode an iterable of byte strings, yielding text. If no encoding is
+    given, it is sniffed from the first chunk.
+    """
+    decoder = None
+    for chunk in chunks:
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(
+                encoding or sniff_encoding(chunk)
+            )(errors='replace')
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    if decoder is not None:
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+
+class OutputWriter(object):
+    """
+    Applies the final processing to the rendered document a line at a time,
+    passing the result to a write function as it goes: the left margin is
+    added to every line, trailing whitespace is removed if optimising, and
+    escape sequences are minimised if required.
+
+    If the output would exceed `max_output` bytes, `exceeded` is called, and
+    the output is cut off after the last complete line that fits. If the
+    output contains escape sequences, it then ends with a reset, so that no
+    style is left open.
+    """
+
+    def __init__(
+        self,
+        write,
+        margin_top=0,
+        margin_bottom=0,
+        indent="",
+        optimise=True,
+        minimise_ansi=False,
+        max_output=None,
+        exceeded=None,
+    ):
+        self._write = write
+        self._margin_bottom = margin_bottom
+        self._indent = indent
+        self._optimise = optimise
+        self._minimiser = EscapeSequenceMinimiser() if minimise_ansi else None
+        self._max_output = max_output
+        self._exceeded = exceeded
+        self._buffer = ""
+        self._styled = False
+        self.size = 0
+        self.stopped = False
+        self._emit("\n" * margin_top)
+
+    def _line(self, line):
+        line = self._indent + line
+        if self._optimise:
+            line = line.rstrip()
+        return line
+
+    def _emit(self, text):
+        if self._minimiser is not None:
+            text = self._minimiser.feed(text)
+        if not text:
+            return
+        if self._max_output is not None:
+            encoded = text.encode('utf-8')
+            if self.size + len(encoded) > self._max_output:
+                self.stopped = True
+                self._exceeded()
+                self._styled = self._styled or "\x1b" in text
+                # Leave room for the reset where possible
+                reset = _RESET if self._styled else ""
+                encoded = encoded[:max(self._max_output - self.size - len(reset), 0)]
+                text = encoded[:encoded.rfind(b"\n") + 1].decode('utf-8') + reset
+                self.size += len(text.encode('utf-8'))
+                self._write(text)
+                return
+            self.size += len(encoded)
+            self._styled = self._styled or "\x1b" in text
+        self._write(text)
+
+    def write(self, text):
+        if self.stopped:
+            return
+        lines = (self._buffer + text).split('\n')
+        self._buffer = lines.pop()
+        if lines:
+            self._emit("".join(self._line(l) + "\n" for l in lines))
+
+    def close(self):
+        if self.stopped:
+            return
+        tail = self._line(self._buffer) if self._buffer else ""
+        self._buffer = ""
+        self._emit(tail + "\n" * self._margin_bottom)
+        if self._minimiser is not None and not self.stopped:
+            remainder = self._minimiser.close()
+            self._minimiser = None
+            self._emit(remainder)
@@ -9,6 +9,8 @@ Written by Greg Ward <gward@python.net>
 """
 
 from textwrap import TextWrapper
+import contextlib
+import contextvars
 import re
 
 _escape_regex = regex = re.compile(
@@ -21,7 +23,7 @@ _escape_regex = regex = re.compile(
 )
 
 def _len(obj):
-    if not isinstance(obj, str):
+    if not isinstance(obj, str) or '\x1b' not in obj:
         return len(obj)
     actual = _escape_regex.sub("", obj)
     return len(actual)
@@ -33,12 +35,17 @@ class AnsiAwareTextWrapper(TextWrapper):
     the length of wrapped lines.
     """
 
+    # Measures the display width of a chunk. This is replaced with a lookup
+    # when the widths of the chunks are already known.
+    _measure = staticmethod(_len)
+
     def _wrap_chunks(self, chunks):
         """
         An exact reimplementation of the method from the base class, but using
         a custom length function to take ANSI escape sequences into account,
         since they are invisible in the output on target platforms.
         """
+        _len = self._measure
         lines = []
         if self.width <= 0:
             raise ValueError("invalid width %r (must be > 0)" % self.width)
@@ -130,9 +137,71 @@ class AnsiAwareTextWrapper(TextWrapper):
         return lines
 
 
+# The layouts shared by everything wrapped in the current context, if any.
+_layouts = contextvars.ContextVar('layouts', default=None)
+
+
+@contextlib.contextmanager
+def shared_layout():
+    """
+    Within the block, the parts of wrapping a text that don't depend on the
+    width, such as splitting it into words and measuring them, are worked out
+    once for each distinct text and options and reused. This makes wrapping
+    the same document to several widths much cheaper than doing it from
+    scratch each time.
+    """
+    token = _layouts.set({})
+    try:
+        yield
+    finally:
+        _layouts.reset(token)
+
+
+def cached_layout(key, compute):
+    """
+    Return the layout for a key from the shared layouts, computing and
+    keeping it if necessary. Without shared layouts it is always computed.
+    """
+    layouts = _layouts.get()
+    if layouts is None:
+        return compute()
+    try:
+        return layouts[key]
+    except KeyError:
+        layout = layouts[key] = compute()
+        return layout
+
+
+def _chunks(wrapper, text):
+    """
+    Split text into the chunks a wrapper arranges into lines, as its `wrap`
+    method does, along with their display widths if they contain escape
+    sequences.
+    """
+    chunks = wrapper._split_chunks(text)
+    if wrapper.fix_sentence_endings:
+        wrapper._fix_sentence_endings(chunks)
+    if not isinstance(wrapper, AnsiAwareTextWrapper):
+        return chunks, None
+    return chunks, {chunk: _len(chunk) for chunk in chunks}
+
+
 def wrap(text, width=70, **kwargs):
     """A reimplementation of the textwrap.wrap function to use the custom
     TextWrapper type.
+
+    Text without any escape sequences is wrapped by the standard TextWrapper,
+    which gives the same result without measuring every chunk for them.
     """
-    w = AnsiAwareTextWrapper(width=width, **kwargs)
-    return w.wrap(text)
+    if '\x1b' in text:
+        w = AnsiAwareTextWrapper(width=width, **kwargs)
+    else:
+        w = TextWrapper(width=width, **kwargs)
+    if _layouts.get() is None:
+        return w.wrap(text)
+    key = ('wrap', text, tuple(sorted(kwargs.items())))
+    chunks, widths = cached_layout(key, lambda: _chunks(w, text))
+    if widths is not None:
+        # Chunks split off long words still have to be measured
+        w._measure = lambda chunk: widths.get(chunk) or _len(chunk)
+    return w._wrap_chunks(list(chunks))
@@ -0,0 +1,88 @@
+"""
+Serialization of parse trees, so that a document can be rendered again, with
+a different configuration, without parsing its HTML again.
+
+The tree is stored as the flat sequence of parser events that would produce
+it: a `(tag, attributes)` tuple for each start tag, a string for each run of
+text and None for each end tag. This is independent of the configuration,
+unlike the tree itself, and replaying it only builds the tree, skipping the
+tokenization of the HTML entirely. The events are written with `marshal`,
+which is the fastest way to store this kind of data that the standard library
+offers.
+"""
+
+import marshal
+
+
+_MAGIC = b"GRT\x01"
+
+# Marshal's format can change between versions of Python, so trees are only
+# loaded by the same version they were written with.
+_HEADER = _MAGIC + bytes((marshal.version,))
+
+_VOID_TAGS = ('br', 'img')
+
+
+def _attributes(tag):
+    attrs = []
+    for name, value in tag.attrs.items():
+        if name == 'class':
+            # The classes are split up when the tag is created
+            value = " ".join(value)
+        attrs.append((name, value))
+    return tuple(attrs)
+
+
+def dump_tree(root):
+    """
+    Serialize a parse tree, given its root, to bytes.
+    """
+    events = []
+    # The tree is walked without recursion, as documents can be nested much
+    # more deeply than the recursion limit.
+    stack = [iter(root.children)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            if stack:
+                events.append(None)
+            continue
+        if node.tag is None:
+            events.append(node.data)
+            continue
+        events.append((node.tag, _attributes(node)))
+        if node.tag not in _VOID_TAGS:
+            stack.append(iter(node.children))
+    return _HEADER + marshal.dumps(events)
+
+
+def load_events(data):
+    """
+    Return the events for a tree serialized by `dump_tree`.
+
+    Like `marshal` itself, this is not safe to use on data from an untrusted
+    source.
+    """
+    if not data.startswith(_MAGIC):
+        raise ValueError("Data is not a serialized parse tree")
+    if not data.startswith(_HEADER):
+        raise ValueError("Parse tree was serialized by a different version of Python")
+    return marshal.loads(memoryview(data)[len(_HEADER):])
+
+
+def replay(parser, events):
+    """
+    Pass the events to a parser as if it had just parsed them.
+    """
+    stack = []
+    for event in events:
+        if event is None:
+            parser.handle_endtag(stack.pop())
+        elif isinstance(event, str):
+            parser.handle_data(event)
+        else:
+            tag, attrs = event
+            parser.handle_starttag(tag, list(attrs))
+            if tag not in _VOID_TAGS:
+                stack.append(tag)
@@ -1,34 +1,101 @@
 import argparse
+import sys
 from pathlib import Path
-# TODO: Optional modules should be optional!
-import markdown
-from markdown.extensions import codehilite
-import pygments
-from . import GopherHTMLParser
-from .rendering import Box
-from .code_themes.monokai import renderers as monokai
-from .code_themes.iced_gopher import renderers as ansi
-from .code_themes.autumn import renderers as autumn
-
-def _parse_arguments():
+from . import code_themes
+
+def _parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Convert Markdown or HTML to plain text or gophermaps")
     parser.add_argument("source", type=str, action="store", help="source file")
     parser.add_argument("destination", type=str, action="store", help="destination file")
     parser.add_argument("-d", "--dump", action="store_true", dest="dump", help="Dump the html to the console before parsing it")
-    args = parser.parse_args()
+    parser.add_argument("-c", "--colour-depth", choices=["truecolor", "256", "16"], default="truecolor", dest="colour_depth", help="Colour depth supported by the target clients")
+    parser.add_argument("-t", "--theme", choices=code_themes.themes, default="iced_gopher", dest="theme", help="Theme for highlighted code")
+    parser.add_argument("-s", "--socket", type=str, default=None, dest="socket", help="Socket of the render daemon to use, if it is running")
+    parser.add_argument("--no-daemon", action="store_false", dest="use_daemon", help="Always render in this process")
+    parser.add_argument("--daemon-timeout", type=float, default=None, dest="daemon_timeout", help="Seconds to wait for the render daemon before rendering in this process")
+    args = parser.parse_args(argv)
     return args
 
-def main():
-    args = _parse_arguments()
-    source_text = None
-    source_path = Path(args.source)
-    with open(source_path, 'r') as in_file:
-        source_text = in_file.read()
+def _colour_depth(depth):
+    if depth.isdigit():
+        return int(depth)
+    return depth
+
+
+def _codehilite_accepts_formatter():
+    """
+    Return whether the installed codehilite extension has the
+    `pygments_formatter` option, which was added in Markdown 3.4. Earlier
+    releases reject unknown options, and highlight code as spans instead.
+    """
+    from markdown.extensions.codehilite import CodeHiliteExtension
+    return 'pygments_formatter' in CodeHiliteExtension().getConfigs()
+
+
+class _Configuration(object):
+    """
+    The parser, and Markdown converter if required, for a set of command line
+    options. These are created when first needed and then reused, so several
+    documents can be rendered without setting them up again.
+    """
+
+    def __init__(
+        self,
+        theme="iced_gopher",
+        colour_depth="truecolor",
+        gopher_host="my.gopher.com",
+        gopher_port=70,
+    ):
+        self.theme = code_themes.load(theme)
+        self.colour_depth = _colour_depth(str(colour_depth))
+        self.gopher_host = gopher_host
+        self.gopher_port = gopher_port
+        self._config = None
+        self._parser = None
+        self._markdown = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            from . import RenderConfig
+            from .rendering import Box
+            self._config = RenderConfig(
+                output_format="text",
+                gopher_host=self.gopher_host,
+                gopher_port=self.gopher_port,
+                box=Box(
+                    width=67,
+                    margin=[1,0,1,0]
+                ),
+                link_placement='footer',
+                image_placement='inline',
+                renderers=self.theme,
+                minimise_ansi=True,
+                colour_depth=self.colour_depth,
+            )
+        return self._config
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            self._parser = self.config.session()
+        return self._parser
+
+    def markdown_options(self):
+        codehilite_options = {'css_class': 'highlight'}
+        if _codehilite_accepts_formatter():
+            # Pygments is optional, and only needed for Markdown
+            from .highlighting import codehilite_formatter
+            # Render the highlighted code directly rather than producing a
+            # span for every token.
+            codehilite_options['pygments_formatter'] = codehilite_formatter(
+                self.theme,
+                colour_depth=self.colour_depth
+            )
 
-    if source_path.suffix == '.md':
-        md = markdown.Markdown(extensions=['markdown.extensions.codehilite', 'markdown.extensions.extra', 'markdown.extensions.meta'], **{
+        markdown_options = dict(extensions=['markdown.extensions.codehilite', 'markdown.extensions.extra', 'markdown.extensions.meta'], **{
             'extension_configs': {
-                'markdown.extensions.codehilite': {'css_class': 'highlight'},
+                'markdown.extensions.codehilite': codehilite_options,
                 'markdown.extensions.extra': {},
                 'markdown.extensions.meta': {},
             },
@@ -36,37 +103,98 @@ def main():
         })
 
         # This version is for checking that default code blocks work ok
-        # md = markdown.Markdown(extensions=['markdown.extensions.meta'], **{
+        # markdown_options = dict(extensions=['markdown.extensions.meta'], **{
         #     'extension_configs': {
         #         'markdown.extensions.meta': {},
         #     },
         #     'output_format': 'html5',
         # })
 
-        #md = markdown.Markdown()
-        source_text = md.convert(source_text)
+        #markdown_options = dict()
+        return markdown_options
+
+    def to_html(self, source_text):
+        """
+        Convert Markdown to HTML, rather than feeding it to the parser.
+        """
+        import markdown
+        return markdown.Markdown(**self.markdown_options()).convert(source_text)
+
+    def render(self, source_text, is_markdown=False):
+        parser = self.parser
+        parser.reset()
+        if is_markdown:
+            if self._markdown is None:
+                # Markdown is optional, and only needed here
+                from ._markdown import markdown_converter
+                self._markdown = markdown_converter(parser, **self.markdown_options())
+            self._markdown.reset()
+            self._markdown.convert(source_text)
+        else:
+            parser.feed(source_text)
+        parser.close()
+        return parser.parsed
+
+    def render_file(self, path, out):
+        """
+        Render an HTML file, writing the output as the file is read rather
+        than reading and rendering the whole document first.
+        """
+        parser = self.parser
+        parser.reset()
+        parser.stream_to(out)
+        parser.feed_file(path)
+        parser.close()
+
+
+def main():
+    if sys.argv[1:2] == ['daemon']:
+        from .daemon import main as daemon_main
+        daemon_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['serve']:
+        from .server import main as server_main
+        server_main(sys.argv[2:])
+        return
+
+    args = _parse_arguments()
+    source_text = None
+    source_path = Path(args.source)
+    is_markdown = source_path.suffix == '.md'
+    options = dict(theme=args.theme, colour_depth=args.colour_depth)
+
+    if not (args.dump or args.use_daemon or is_markdown):
+        # HTML rendered in this process can be streamed straight out
+        _Configuration(**options).render_file(source_path, sys.stdout)
+        print()
+        return
+
+    with open(source_path, 'r') as in_file:
+        source_text = in_file.read()
 
     if args.dump:
+        configuration = _Configuration(**options)
+        if is_markdown:
+            # The HTML is only produced if it needs to be dumped
+            source_text = configuration.to_html(source_text)
         print(source_text)
-
-    parser = GopherHTMLParser(
-        output_format="text",
-        gopher_host="my.gopher.com",
-        box=Box(
-            width=67,
-            margin=[1,0,1,0]
-        ),
-        link_placement='footer',
-        image_placement='inline',
-        renderers=ansi
-    )
-    parser.feed(source_text)
-    parser.close()
+        parsed = configuration.render(source_text)
+    elif args.use_daemon:
+        from .daemon import render
+        parsed = render(
+            source_text,
+            is_markdown,
+            socket_path=args.socket,
+            timeout=args.daemon_timeout,
+            **options
+        )
+    else:
+        parsed = _Configuration(**options).render(source_text, is_markdown)
 
     #with open(args.destination, 'w') as out_file:
-    #    out_file.write(parser.parsed)
+    #    out_file.write(parsed)
 
-    print(parser.parsed)
+    print(parsed)
 
 
 if __name__ == "__main__":
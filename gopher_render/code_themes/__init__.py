@@ -1 +1,36 @@
-from . import monokai, darkly, github, tomorrow_night, tomorrow
+"""
+Renderer dictionaries for styling code highlighted by Pygments.
+
+Each theme is a module with a `renderers` dictionary. Themes are only imported
+when they are first used.
+"""
+
+import importlib
+
+
+themes = (
+    'autumn',
+    'darkly',
+    'darkly_ansi',
+    'github',
+    'iced_gopher',
+    'monokai',
+    'monokai_ansi',
+    'tomorrow',
+    'tomorrow_night',
+)
+
+
+def load(name):
+    """
+    Return the renderer dictionary for the named theme.
+    """
+    if name not in themes:
+        raise ValueError("Unknown code theme: {}".format(name))
+    return importlib.import_module('.' + name, __name__).renderers
+
+
+def __getattr__(name):
+    if name in themes:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,257 @@
+"""
+A long running process that renders documents sent to it over a Unix socket.
+
+Running the command line interface once per document means paying for
+interpreter startup, imports and the compilation of the renderer maps every
+time. The daemon keeps the parsers for recently used configurations ready, and
+the `render` function here sends documents to it, falling back to rendering in
+the calling process if no daemon is running.
+
+Messages in both directions are a 4 byte big-endian length, followed by that
+many bytes of UTF-8 encoded JSON. A request is an object with the `source`
+text, whether it is `markdown`, and the command line `options` to render it
+with. The response has either the `output` or an `error` message. Several
+requests may be sent over the same connection.
+
+Each connection is handled in its own thread, so one slow render doesn't hold
+up other clients. A client that can't connect to the daemon in time, or that
+waits longer for its response than it was asked to, renders the document itself
+instead.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+_header = struct.Struct('>I')
+
+# Protects the daemon from trying to read absurd lengths.
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Seconds a client waits to connect to the daemon before giving up on it.
+DEFAULT_TIMEOUT = 10.0
+
+
+class DaemonError(Exception):
+    """
+    Raised when the daemon reports that a render failed.
+    """
+    pass
+
+
+def default_socket_path():
+    """
+    Return the path of the socket used if none is specified.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'gopher-render.sock')
+    return os.path.join(
+        tempfile.gettempdir(),
+        'gopher-render-{}.sock'.format(os.getuid())
+    )
+
+
+def _receive_exactly(sock, length):
+    """
+    Read the given number of bytes from the socket. Returns None if the
+    connection is closed before any are read.
+    """
+    chunks = []
+    remaining = length
+    while remaining:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            if remaining == length:
+                return None
+            raise ConnectionError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_header.pack(len(data)) + data)
+
+
+def receive_message(sock):
+    """
+    Read a message from the socket, or return None if the connection has been
+    closed.
+    """
+    header = _receive_exactly(sock, _header.size)
+    if header is None:
+        return None
+    (length,) = _header.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError("Message too large: {} bytes".format(length))
+    data = _receive_exactly(sock, length)
+    if data is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(data.decode('utf-8'))
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            request = receive_message(self.request)
+            if request is None:
+                return
+            try:
+                response = {'output': self.server.render(request)}
+            except Exception as e:
+                response = {'error': "{}: {}".format(type(e).__name__, e)}
+            send_message(self.request, response)
+
+
+class RenderDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server that renders the documents it receives, keeping up to
+    `max_configurations` parsers for the most recently used configurations
+    for reuse.
+
+    Each connection is handled in its own thread. A parser can only render
+    one document at a time, so a configuration that is already in use by
+    another request is set up again, and both may be kept for reuse.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_configurations=16):
+        # The idle configurations for each set of options
+        self._configurations = OrderedDict()
+        self._idle = 0
+        self._max_configurations = max_configurations
+        self._lock = threading.Lock()
+        super().__init__(socket_path, _RequestHandler)
+
+    def _acquire_configuration(self, key, options):
+        with self._lock:
+            idle = self._configurations.get(key)
+            if idle:
+                configuration = idle.pop()
+                self._idle -= 1
+                if not idle:
+                    del self._configurations[key]
+                return configuration
+        from .cli import _Configuration
+        return _Configuration(**options)
+
+    def _release_configuration(self, key, configuration):
+        with self._lock:
+            self._configurations.setdefault(key, []).append(configuration)
+            self._configurations.move_to_end(key)
+            self._idle += 1
+            # Evict from the least recently used configurations first
+            while self._idle > self._max_configurations:
+                oldest, idle = next(iter(self._configurations.items()))
+                idle.pop(0)
+                self._idle -= 1
+                if not idle:
+                    del self._configurations[oldest]
+
+    def render(self, request):
+        options = request.get('options', {})
+        key = json.dumps(options, sort_keys=True)
+        configuration = self._acquire_configuration(key, options)
+        output = configuration.render(
+            request['source'],
+            request.get('markdown', False)
+        )
+        # A configuration whose render failed is not reused
+        self._release_configuration(key, configuration)
+        return output
+
+
+def serve(socket_path=None, max_configurations=16):
+    """
+    Run a daemon listening on the socket until interrupted.
+    """
+    socket_path = socket_path or default_socket_path()
+    if os.path.exists(socket_path):
+        # Only replace the socket if nothing is listening on it any more
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except ConnectionRefusedError:
+                os.unlink(socket_path)
+            else:
+                raise DaemonError("A daemon is already listening on {}".format(socket_path))
+    server = RenderDaemon(socket_path, max_configurations=max_configurations)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def request_render(source_text, markdown=False, socket_path=None,
+                   timeout=None, **options):
+    """
+    Render a document using the daemon, which must be running.
+
+    Raises OSError if the daemon could not be contacted, socket.timeout if it
+    could not be connected to within DEFAULT_TIMEOUT seconds or took longer
+    than `timeout` seconds to respond, and DaemonError if the render failed.
+    By default there is no limit on how long the render may take.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(DEFAULT_TIMEOUT)
+        sock.connect(socket_path or default_socket_path())
+        sock.settimeout(timeout)
+        send_message(sock, dict(
+            source=source_text,
+            markdown=markdown,
+            options=options,
+        ))
+        response = receive_message(sock)
+    if response is None:
+        raise ConnectionError("The daemon closed the connection")
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    return response['output']
+
+
+def render(source_text, markdown=False, socket_path=None, timeout=None,
+           **options):
+    """
+    Render a document using the daemon if it is running, or in this process
+    if it is not, or if it doesn't respond within `timeout` seconds.
+
+    The options are those accepted by the command line interface.
+    """
+    if hasattr(socket, 'AF_UNIX'):
+        try:
+            return request_render(
+                source_text,
+                markdown,
+                socket_path=socket_path,
+                timeout=timeout,
+                **options
+            )
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+            pass
+    from .cli import _Configuration
+    return _Configuration(**options).render(source_text, markdown)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="gopher-render daemon",
+        description="Render documents sent over a Unix socket"
+    )
+    parser.add_argument("-s", "--socket", type=str, default=None, dest="socket", help="socket path to listen on")
+    parser.add_argument("-m", "--max-configurations", type=int, default=16, dest="max_configurations", help="number of configurations to keep ready")
+    args = parser.parse_args(argv)
+    serve(args.socket, max_configurations=args.max_configurations)
@@ -0,0 +1,177 @@
+"""
+A Pygments formatter that renders highlighted code directly to text styled
+with the same renderer dictionaries used for HTML (see `code_themes`).
+
+Highlighting code to HTML produces a span for every token, each of which has to
+be parsed, matched against the selector map, and rendered individually. This
+formatter instead resolves the style for each token type only once, and writes
+the styled text straight from the token stream.
+
+Pygments is an optional dependency, so this module should only be imported if
+it is available.
+"""
+
+import functools
+import html
+
+from pygments.formatter import Formatter
+from pygments.token import STANDARD_TYPES
+
+from ._parser import TagParser, RendererMap
+
+
+# Used to split the output of a renderer into the text that comes before and
+# after its content.
+_SENTINEL = "\x00"
+
+
+def _get_ttype_class(ttype):
+    """
+    Return the CSS class that Pygments' HTML formatter would use for a token
+    type.
+    """
+    fname = STANDARD_TYPES.get(ttype)
+    if fname:
+        return fname
+    aname = ''
+    while fname is None:
+        aname = ttype[-1] + aname
+        ttype = ttype.parent
+        fname = STANDARD_TYPES.get(ttype)
+    return fname + aname
+
+
+class GopherFormatter(Formatter):
+    """
+    Format tokens as text, styled according to a dictionary mapping selectors
+    to renderers, such as those in the `code_themes` package.
+
+    Options accepted in addition to the standard ones:
+
+    `renderers`
+        The renderer dictionary to style tokens with. Without one the output
+        is plain text.
+
+    `colour_depth`
+        The colour depth to use for ANSI escape code renderers.
+
+    `cssclass`
+        The class of the element the code would be contained in as HTML.
+        Selectors that depend on it will still match. Defaults to 'highlight'.
+
+    `html`
+        If True, the styled text is escaped and wrapped in the same elements
+        the HTML formatter would produce, so that it can be embedded in HTML
+        and parsed as a single block of preformatted text.
+
+    `renderer_map`
+        A `RendererMap` already created for the renderers, which is used
+        instead of creating a new one.
+    """
+
+    name = 'Gopher'
+    aliases = ['gopher']
+    filenames = []
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.renderers = options.get('renderers', None) or {}
+        self.cssclass = options.get('cssclass', 'highlight')
+        self.html = options.get('html', False)
+        self._renderer_map = options.get('renderer_map', None)
+        if self._renderer_map is None:
+            self._renderer_map = RendererMap(
+                self.renderers,
+                colour_depth=options.get('colour_depth', None)
+            )
+        self._styles = {}
+
+    def _get_style(self, ttype):
+        """
+        Return the text to output before and after a token of the given type.
+        """
+        try:
+            return self._styles[ttype]
+        except KeyError:
+            pass
+        style = ("", "")
+        css_class = _get_ttype_class(ttype)
+        if css_class:
+            tag = self._token_tag(css_class)
+            renderer = self._renderer_map.get_for_tag(tag)
+            if renderer is not None:
+                if isinstance(renderer[0], type):
+                    rendered = renderer[0](tag, settings=renderer[1]).render(_SENTINEL)
+                else:
+                    rendered = renderer[0].render(tag, renderer[1], None, _SENTINEL)
+                before, _, after = rendered.partition(_SENTINEL)
+                style = (before, after)
+        self._styles[ttype] = style
+        return style
+
+    def _token_tag(self, css_class):
+        """
+        Create a tag equivalent to the span the HTML formatter would produce,
+        including its ancestors, to match selectors against.
+        """
+        div = TagParser('div', None, [('class', self.cssclass)])
+        pre = TagParser('pre', div, None)
+        div.children.append(pre)
+        code = TagParser('code', pre, None)
+        pre.children.append(code)
+        span = TagParser('span', code, [('class', css_class)])
+        code.children.append(span)
+        return span
+
+    def _format_text(self, tokensource):
+        out = []
+        current = ("", "")
+        for ttype, value in tokensource:
+            style = self._get_style(ttype)
+            parts = value.split('\n')
+            for i, part in enumerate(parts):
+                if i > 0:
+                    # Styles are closed at the end of every line, as the
+                    # HTML formatter does with its spans.
+                    out.append(current[1])
+                    out.append('\n')
+                    current = ("", "")
+                if not part:
+                    continue
+                if style != current:
+                    out.append(current[1])
+                    out.append(style[0])
+                    current = style
+                out.append(part)
+        out.append(current[1])
+        return "".join(out)
+
+    def format(self, tokensource, outfile):
+        text = self._format_text(tokensource)
+        if self.html:
+            text = '<div class="{}"><pre><code>{}</code></pre></div>\n'.format(
+                self.cssclass,
+                html.escape(text, quote=False)
+            )
+        outfile.write(text)
+
+
+def codehilite_formatter(renderers=None, **options):
+    """
+    Return a formatter factory suitable for the `pygments_formatter` option of
+    Python-Markdown's codehilite extension.
+
+    Codehilite creates a formatter for every code block, so the renderer map
+    is created here once and shared between them.
+    """
+    renderer_map = RendererMap(
+        renderers or {},
+        colour_depth=options.get('colour_depth', None)
+    )
+    return functools.partial(
+        GopherFormatter,
+        renderers=renderers,
+        renderer_map=renderer_map,
+        html=True,
+        **options
+    )
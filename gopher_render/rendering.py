@@ -1,7 +1,10 @@
+import re
+
 from . import _textwrap as textwrap
-import inspect
+from ._linebreak import optimal_wrap
 
 from ._namedict import namedict
+from ._ansi import normalise_colour_depth, nearest_256, nearest_16, _palette_colour
 
 # TODO: Add additional formatting helper functions
 # TODO: Add the formatting classes/functions here
@@ -10,32 +13,47 @@ def _noop(text, *args, **kwargs):
     return text
 
 
+def _justify_line(line, width):
+    """
+    Pad a single line out to the specified width by widening the gaps between
+    its words.
+    """
+    orig_len = len(line)
+    ls = line.lstrip()
+    indent = ' ' * (orig_len - len(ls))
+    padding_spaces = width - orig_len
+    rs = ls.rstrip()
+    #padding_spaces = len(ls) - len(rs)
+    if padding_spaces == 0:
+        return line
+    words = rs.split(' ')
+    gaps = (len(words) - 1)
+    if gaps == 0:
+        return line
+    n, r = divmod(padding_spaces, gaps)
+    narrow = ' ' * (n + 1)
+    if r == 0:
+        # No remainder
+        return indent + narrow.join(words)
+    wide = ' ' * (n + 2)
+    return indent + wide.join(words[:r]) + wide + narrow.join(words[r:])
+
+
 def full_justify(text, width, *args, **kwargs):
     lines = textwrap.wrap(text, width, *args, **kwargs)
-    out_lines = []
-    for line in lines[:-1]:
-        orig_len = len(line)
-        ls = line.lstrip()
-        indent = ' ' * (orig_len - len(ls))
-        padding_spaces = width - orig_len
-        rs = ls.rstrip()
-        #padding_spaces = len(ls) - len(rs)
-        if padding_spaces == 0:
-            out_lines.append(line)
-            continue
-        words = rs.split(' ')
-        gaps = (len(words) - 1)
-        if gaps == 0:
-            out_lines.append(line)
-            continue
-        n, r = divmod(padding_spaces, gaps)
-        narrow = ' ' * (n + 1)
-        if r == 0:
-            # No remainder
-            out_lines.append(indent + narrow.join(words))
-        else:
-            wide = ' ' * (n + 2)
-            out_lines.append(indent + wide.join(words[:r]) + wide + narrow.join(words[r:]))
+    out_lines = [_justify_line(line, width) for line in lines[:-1]]
+    if len(lines) > 0:
+        out_lines.append(lines[-1])
+    return '\n'.join(out_lines)
+
+
+def optimal_justify(text, width, *args, **kwargs):
+    """
+    Full justification, but with the line breaks chosen to minimise the
+    raggedness of the paragraph as a whole rather than greedily.
+    """
+    lines = optimal_wrap(text, width, *args, **kwargs)
+    out_lines = [_justify_line(line, width) for line in lines[:-1]]
     if len(lines) > 0:
         out_lines.append(lines[-1])
     return '\n'.join(out_lines)
@@ -73,6 +91,7 @@ def right(text, width, *args, **kwargs):
 justifications = {
     'none': _noop,
     'full': full_justify,
+    'optimal': optimal_justify,
     'center': center_justify,
     'left': left_justify,
     'right': right_justify,
@@ -293,13 +312,29 @@ class Renderer(metaclass=_RendererMeta):
     """
     settings = namedict()
 
+    # Renderers that discard the content of their elements set this to True,
+    # so that the parser can skip building and rendering that content
+    # entirely.
+    ignores_content = False
+
     def __new__(cls, *args, **kwargs):
         """
         Combine the base_settings of all base classes into a single settings
         dictionary on the newly created class instance.
         """
+        instance = super().__new__(cls)
+        instance.settings = cls._class_settings()
+
+        return instance
+
+    @classmethod
+    def _class_settings(cls):
+        """
+        Combine the settings of the class and all of its bases into a single
+        new settings dictionary.
+        """
         s = namedict()
-        all_classes = inspect.getmro(cls)
+        all_classes = cls.__mro__
         all_bases = []
         for klass in all_classes[::-1]:
             if hasattr(klass, 'settings'):
@@ -307,11 +342,20 @@ class Renderer(metaclass=_RendererMeta):
                     all_bases.append(klass.settings)
         for base in all_bases:
             s.update(base)
+        return s
 
-        instance = super().__new__(cls)
-        instance.settings = s
+    @classmethod
+    def prepare_settings(cls, settings, **options):
+        """
+        Prepare a resolved settings dictionary for use by this renderer.
 
-        return instance
+        This is called once for each distinct set of settings produced by the
+        renderer map, rather than for every element rendered, so renderers can
+        override it to precompute anything that depends only on the settings.
+        Any options the renderer map was created with are passed through.
+        The base implementation returns the settings unchanged.
+        """
+        return settings
 
     def __init__(self, tag, **kwargs):
         # This will be a TagParser instance
@@ -342,22 +386,222 @@ class Renderer(metaclass=_RendererMeta):
 
     def render(self, content):
         """
-        Render the provided content.
+        Render the provided content, with `render_stateless`.
+        """
+        return self.render_stateless(
+            self.tag,
+            self.settings,
+            self.context.get('parent_box', None),
+            content
+        )
+
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        """
+        Render an element without creating an instance, given the element,
+        its prepared settings, its box and its rendered content.
+
+        Instances render with this too, so classes whose rendering depends on
+        nothing else define it instead of `render`, and `stateless` can adapt
+        them.
+        """
+        return content
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        """
+        Return the (prefix, suffix) pair that `render_stateless` puts around
+        the content of an element, or None if it does anything else with the
+        content. This lets the inline content of a block be flattened into a
+        single list of runs instead of being rendered element by element.
+
+        Classes that define `render_stateless` must define this alongside it
+        for it to be used.
+        """
+        return ("", "")
+
+    @classmethod
+    def stateless(cls):
+        """
+        Return a stateless renderer equivalent to this class, or None if it
+        doesn't have one.
+
+        A class has one if the first class in its hierarchy to change how
+        instances are created or render defines `render_stateless`. So a
+        subclass that only changes the settings is adapted like its base,
+        while one that overrides `render` is not.
+        """
+        try:
+            return _stateless_adapters[cls]
+        except KeyError:
+            pass
+        adapter = None
+        for klass in cls.__mro__:
+            namespace = klass.__dict__
+            if 'render_stateless' in namespace:
+                adapter = _StatelessClassAdapter(
+                    cls,
+                    'inline_affixes' in namespace
+                )
+                break
+            if any(name in namespace for name in _instance_methods):
+                break
+        _stateless_adapters[cls] = adapter
+        return adapter
+
+
+# Methods that make a renderer depend on its instance.
+_instance_methods = ('__new__', '__init__', '_adjust_settings', 'render')
+
+_stateless_adapters = {}
+
+# Stands in for the content of an element, to find what a renderer puts
+# around it.
+_CONTENT_SENTINEL = "\x00"
+
+
+def _affixes(rendered):
+    """
+    Split rendered output around the content sentinel, or return None if
+    the content didn't appear in it exactly once.
+    """
+    if rendered.count(_CONTENT_SENTINEL) != 1:
+        return None
+    prefix, _, suffix = rendered.partition(_CONTENT_SENTINEL)
+    return prefix, suffix
+
+
+class StatelessRenderer(object):
+    """
+    Base for renderers that keep no state for the elements they render.
+
+    A single instance renders every element it is assigned to. It is passed
+    the element, its prepared settings, its box and its rendered content, so
+    rendering an element allocates nothing but the output. Plain functions
+    taking the same arguments as `render` can also be used as renderers.
+
+    The `settings` of the class, updated with any given when the renderer is
+    created, are the defaults that the settings from the renderer map are
+    merged into. Instances must not be changed once they are in use, and
+    copying one returns the same instance.
+    """
+
+    settings = {}
+
+    ignores_content = False
+
+    def __init__(self, **settings):
+        self._defaults = namedict(type(self).settings)
+        self._defaults.update(settings)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def prepare_settings(self, settings, **options):
+        """
+        Merge resolved settings into the defaults. This is called once for
+        each distinct set of settings produced by the renderer map.
         """
+        prepared = namedict(self._defaults)
+        prepared.update(settings)
+        return prepared
+
+    def box(self, node, settings, parent_box):
+        """
+        Return the box that the content of the element is rendered in. By
+        default this is the parent's box.
+        """
+        return parent_box
+
+    def render(self, node, settings, box, content):
         return content
 
+    def inline_affixes(self, node, settings):
+        """
+        Return the (prefix, suffix) pair that `render` puts around the
+        content of an element, or None if it does anything else with it.
+        The base implementation returns None, so the element's content is
+        always rendered separately.
+        """
+        return None
+
+
+class FunctionRenderer(StatelessRenderer):
+    """
+    Renders elements with a plain function, taking the same arguments as
+    `StatelessRenderer.render`.
+    """
+
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    def render(self, node, settings, box, content):
+        return self.function(node, settings, box, content)
+
+
+class _StatelessClassAdapter(StatelessRenderer):
+    """
+    Renders elements with the `render_stateless` method of a renderer class.
+    """
+
+    def __init__(self, renderer_class, has_affixes):
+        super().__init__()
+        self.renderer_class = renderer_class
+        self.ignores_content = renderer_class.ignores_content
+        self.render = renderer_class.render_stateless
+        if has_affixes:
+            self.inline_affixes = renderer_class.inline_affixes
+
+    def prepare_settings(self, settings, **options):
+        return self.complete_settings(
+            self.renderer_class.prepare_settings(settings, **options)
+        )
+
+    def complete_settings(self, prepared):
+        """
+        Combine settings already prepared by the renderer class with the
+        defaults of the class, as its instances would.
+        """
+        settings = self.renderer_class._class_settings()
+        settings.update(prepared)
+        return settings
+
+
+def adapt_renderer(renderer):
+    """
+    Return the renderer to use for a renderer in a renderer map. Classes are
+    replaced with their stateless equivalent if they have one, functions are
+    wrapped in a `FunctionRenderer`, and anything else is assumed to be a
+    stateless renderer already.
+    """
+    if isinstance(renderer, type):
+        if issubclass(renderer, Renderer):
+            return renderer.stateless() or renderer
+        return renderer
+    if hasattr(renderer, 'render'):
+        return renderer
+    return FunctionRenderer(renderer)
+
 
 class NonRenderer(Renderer):
     """
     This Renderer... does not render! The render() method will always return an
     empty string.
     """
-    def render(self, content):
-        """
-        Return an empty string to remove all contents from the output.
-        """
+    ignores_content = True
+
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
         return ""
 
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        return None
+
 
 class InlineRenderer(Renderer):
 
@@ -366,12 +610,17 @@ class InlineRenderer(Renderer):
         capitalized=False,
     )
 
-    def render(self, content):
-        settings = self.settings
-        capitalize_func = capitalize if settings['capitalized'] else _noop
-        return settings.template.format(
-            capitalize_func(super().render(content))
-        )
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        if settings['capitalized']:
+            content = capitalize(content)
+        return settings['template'].format(content)
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        if settings['capitalized']:
+            return None
+        return _affixes(settings['template'].format(_CONTENT_SENTINEL))
 
 
 class BlockRenderer(Renderer):
@@ -653,17 +902,30 @@ class CodeRenderer(InlineRenderer):
         inline_template="`{}`"
     )
 
-    def render(self, content):
-        settings = self.settings
-
-        parent = self.tag.parent
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        parent = node.parent
         if parent and hasattr(parent, 'tag') and parent.tag == 'pre':
-            # The pre will handle the formatting
             return content
         if '\n' in content:
             return settings['block_template'].format(content)
         return settings['inline_template'].format(content)
 
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        parent = node.parent
+        if parent and hasattr(parent, 'tag') and parent.tag == 'pre':
+            return ("", "")
+        # The template depends on the content, which is only known here if
+        # it is all text.
+        if any(c.tag is not None for c in node.children):
+            return None
+        if any('\n' in c.data for c in node.children):
+            template = settings['block_template']
+        else:
+            template = settings['inline_template']
+        return _affixes(template.format(_CONTENT_SENTINEL))
+
 
 class PreRenderer(BlockRenderer):
 
@@ -698,27 +960,34 @@ class LinkRenderer(InlineRenderer):
         capitalized=False,
     )
 
-    # TODO: Seems like this could be improved. Something like the extracted renderer below
-    def render(self, content):
-        settings = self.settings
-        capitalize_func = capitalize if settings.capitalized else _noop
-        if self.context["link_placement"] == "inline":
-            if "title" in self.context and self.context["title"]:
-                return settings.templates["inline"][1].format(
-                    content=capitalize_func(super().render(content)),
-                    href=self.context["href"],
-                    title=self.context["title"],
-                )
-            else:
-                return settings.templates["inline"][0].format(
-                    content=capitalize_func(super().render(content)),
-                    href=self.context["href"],
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        content = InlineRenderer.render_stateless(node, settings, box, content)
+        if settings['capitalized']:
+            content = capitalize(content)
+        templates = settings['templates']
+        context = node._context
+        if context["link_placement"] == "inline":
+            if node.title:
+                return templates["inline"][1].format(
+                    content=content,
+                    href=node.href,
+                    title=node.title,
                 )
-        else:
-            return settings.templates["reference"].format(
-                content=capitalize_func(super().render(content)),
-                link_reference=self.context["link_reference"]
+            return templates["inline"][0].format(
+                content=content,
+                href=node.href,
             )
+        return templates["reference"].format(
+            content=content,
+            link_reference=context["link_reference"]
+        )
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        if settings['capitalized']:
+            return None
+        return _affixes(cls.render_stateless(node, settings, None, _CONTENT_SENTINEL))
 
 
 class ExtractedLinkRenderer(BlockRenderer):
@@ -806,29 +1075,26 @@ class ImageRenderer(InlineRenderer):
         capitalized=False,
     )
 
-    def render(self, content):
-        settings = self.settings
-        capitalize_func = capitalize if settings.capitalized else _noop
-        if self.context["image_placement"] == "inline":
-            if "title" in self.context and self.context["title"]:
-                return settings.templates["inline"].format(
-                    href=self.context["href"],
-                    title=self.context["title"],
-                )
-            else:
-                return settings.templates["inline"].format(
-                    href=self.context["href"],
-                    title="Image",
-                )
-        else:
-            if "title" in self.context and self.context["title"]:
-                title = self.context["title"]
-            else:
-                title = "Image"
-            return settings.templates["reference"].format(
-                title=title,
-                link_reference=self.context["link_reference"]
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        templates = settings['templates']
+        context = node._context
+        if context["image_placement"] == "inline":
+            return templates["inline"].format(
+                href=node.href,
+                title=node.title or "Image",
             )
+        # The alt text is only shown with the extracted link, so the
+        # reference is always to an image.
+        return templates["reference"].format(
+            title="Image",
+            link_reference=context["link_reference"]
+        )
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        # Images have no content, so everything goes before it.
+        return cls.render_stateless(node, settings, None, ""), ""
 
 
 class ExtractedImageLinkRenderer(BlockRenderer):
@@ -934,12 +1200,14 @@ class BreakRenderer(InlineRenderer):
         template="{}",
     )
 
-    def render(self, content):
-        settings = self.settings
-        # These tags should not have content, so it is ignored.
-        return settings.template.format(
-            super().render('\n')
-        )
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        template = settings['template']
+        return template.format(template.format('\n'))
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        return cls.render_stateless(node, settings, None, ""), ""
 
 
 class BlockQuoteRenderer(BlockRenderer):
@@ -1185,6 +1453,209 @@ class DefinitionListItemRenderer(BlockRenderer):
         return "\n".join(out)
 
 
+# Mark the ends of rows and cells in the content of a table, so that the
+# table renderer can lay them out.
+_ROW_END = "\x1e"
+_CELL_END = "\x1f"
+_HEADER_CELL_END = "\x1d"
+
+_table_marks_removal = str.maketrans('', '', _ROW_END + _CELL_END + _HEADER_CELL_END)
+
+
+def _strip_table_marks(text):
+    """
+    Remove the characters used to mark the parts of a table from document
+    text, so that the text can't change how a table is laid out.
+    """
+    if _ROW_END in text or _CELL_END in text or _HEADER_CELL_END in text:
+        return text.translate(_table_marks_removal)
+    return text
+
+
+_table_cell_regex = re.compile(
+    "([^{0}{1}]*)([{0}{1}])".format(_CELL_END, _HEADER_CELL_END)
+)
+
+
+def _fit_columns(widths, available):
+    """
+    Cap the widths of columns so that together they are no more than the
+    available width. Columns narrower than an equal share of the space keep
+    their width, and the others share what is left equally.
+    """
+    if sum(widths) <= available:
+        return widths
+    widths = list(widths)
+    wide = list(range(len(widths)))
+    while wide:
+        share = available // len(wide)
+        narrow = [c for c in wide if widths[c] <= share]
+        if not narrow:
+            break
+        available -= sum(widths[c] for c in narrow)
+        wide = [c for c in wide if widths[c] > share]
+    if wide:
+        share, extra = divmod(max(available, len(wide)), len(wide))
+        for i, c in enumerate(wide):
+            widths[c] = share + (1 if i < extra else 0)
+    return widths
+
+
+def _pad(text, width):
+    # The width of escape sequences doesn't count
+    return text + ' ' * (width - textwrap._len(text))
+
+
+class TableRenderer(BlockRenderer):
+    """
+    Renderer for <table> tags.
+
+    The rows and cells only mark where they end, so the whole table arrives
+    as one string. The widths of the columns are measured in a single pass
+    over the cells, capped so that the table fits in its box, and then each
+    row is wrapped to them in turn. Any text outside the rows, such as a
+    caption, is placed on its own lines.
+    """
+
+    settings = dict(
+        row_template="| {} |",
+        column_separator=" | ",
+        header_rule="-",
+        margin=[1,0,1,0],
+        break_long_words=True,
+    )
+
+    def _inner_render(self, content):
+        rows = []
+        widths = []
+        for piece in content.split(_ROW_END):
+            cells = _table_cell_regex.findall(piece)
+            if not cells:
+                text = piece.strip()
+                if text:
+                    rows.append(text)
+                continue
+            row = []
+            for column, (text, end) in enumerate(cells):
+                lines = [l.strip() for l in text.strip().split('\n')]
+                width = max(textwrap._len(l) for l in lines)
+                if column == len(widths):
+                    widths.append(width)
+                elif width > widths[column]:
+                    widths[column] = width
+                row.append(lines)
+            header = all(end == _HEADER_CELL_END for _, end in cells)
+            rows.append((row, header))
+        return "\n".join(self._lines(rows, widths))
+
+    def _lines(self, rows, widths):
+        """
+        Generate the lines of the table, one row at a time.
+        """
+        settings = self.settings
+        template = settings.row_template
+        separator = settings.column_separator
+        box_width = self.box.inner_width
+        available = (
+            box_width
+            - len(template.format(""))
+            - len(separator) * max(len(widths) - 1, 0)
+        )
+        widths = _fit_columns(widths, max(available, len(widths)))
+        empty = [""]
+        for position, row in enumerate(rows):
+            if isinstance(row, str):
+                yield from textwrap.wrap(row, box_width) or empty
+                continue
+            cells, header = row
+            columns = []
+            for column, width in enumerate(widths):
+                lines = []
+                for line in cells[column] if column < len(cells) else empty:
+                    lines.extend(textwrap.wrap(
+                        line,
+                        width,
+                        break_long_words=settings.break_long_words
+                    ) or empty)
+                columns.append(lines)
+            for i in range(max(len(c) for c in columns)):
+                yield template.format(separator.join(
+                    _pad(c[i] if i < len(c) else "", w)
+                    for c, w in zip(columns, widths)
+                ))
+            if header and settings.header_rule:
+                following = rows[position + 1] if position + 1 < len(rows) else None
+                if not isinstance(following, tuple) or not following[1]:
+                    yield template.format(separator.join(
+                        settings.header_rule * w for w in widths
+                    ))
+
+
+class TablePartRenderer(InlineRenderer):
+    """
+    Base for the renderers of the parts of a table, which are laid out by the
+    `TableRenderer`, so these only mark where each part ends. Parts that are
+    not inside an element rendered by a `TableRenderer` are rendered like
+    any other inline element, since nothing would lay them out.
+    """
+
+    end = ""
+
+    @classmethod
+    def _end(cls, node):
+        parent = getattr(node, 'parent', None)
+        while parent is not None:
+            renderer = getattr(parent, 'renderer', None)
+            if isinstance(renderer, type) and issubclass(renderer, TableRenderer):
+                return cls.end
+            parent = getattr(parent, 'parent', None)
+        return ""
+
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        return super().render_stateless(node, settings, box, content) + cls._end(node)
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        affixes = super().inline_affixes(node, settings)
+        if affixes is None:
+            return None
+        return affixes[0], affixes[1] + cls._end(node)
+
+
+class TableRowRenderer(TablePartRenderer):
+    """
+    Renderer for <tr> tags.
+    """
+
+    end = _ROW_END
+
+
+class TableCaptionRenderer(TablePartRenderer):
+    """
+    Renderer for <caption> tags. The caption ends like a row, but as it has
+    no cells it is placed on its own lines.
+    """
+
+    end = _ROW_END
+
+
+class TableCellRenderer(TablePartRenderer):
+    """
+    Renderer for <td> tags.
+    """
+
+    end = _CELL_END
+
+
+class TableHeaderCellRenderer(TablePartRenderer):
+    """
+    Renderer for <th> tags. A row of only header cells is followed by a rule.
+    """
+
+    end = _HEADER_CELL_END
+
+
 ansi_colours = {
     "black": 30,
     "red": 31,
@@ -1203,6 +1674,8 @@ ansi_colours = {
     "bright_cyan": 96,
     "bright_white": 97,
 }
+# Colour names in the order of their indices in the 256 colour palette.
+ansi_colour_names = list(ansi_colours)
 ANSI_BACKGROUND_COLOUR_OFFSET = 10
 ANSI_FONT_OFFSET = 10
 
@@ -1242,26 +1715,42 @@ def _parse_html_colour(colour):
         int(colour[4:6], base=16),
     )
 
-def _get_sequence_for_colour(colour, is_background=False):
+def _get_sequence_for_colour(colour, is_background=False, colour_depth=None):
     # Colours can be specified in one of four ways
     #    - ANSI 4-bit colour name
     #    - Number of colour in the 8-bit palette
     #    - Tuple containing (r, g, b) values
     #    - HTML #rgb or #rrggbb values
+    # Colours that cannot be displayed at the colour depth are mapped to the
+    # closest colour that can.
+    colour_depth = normalise_colour_depth(colour_depth)
+    offset = 0
+    if is_background:
+        offset = ANSI_BACKGROUND_COLOUR_OFFSET
     if colour in ansi_colours:
-        offset = 0
-        if is_background:
-            offset = ANSI_BACKGROUND_COLOUR_OFFSET
         return "{}".format(ansi_colours[colour] + offset)
 
     control = "48" if is_background else "38"
     if isinstance(colour, int):
-        return "{};5;{}".format(control, colour)
-
-    if isinstance(colour, str):
+        if colour_depth == 16 and colour >= 16:
+            colour = _palette_colour(colour)
+        elif colour_depth != 16:
+            colour_depth = 256
+    elif isinstance(colour, str):
         # Try to parse as an html colour- TODO
         colour = _parse_html_colour(colour)
 
+    if colour_depth == 16:
+        if not isinstance(colour, int):
+            colour = nearest_16(colour)
+        return "{}".format(
+            ansi_colours[ansi_colour_names[colour]] + offset
+        )
+    if colour_depth == 256:
+        if not isinstance(colour, int):
+            colour = nearest_256(colour)
+        return "{};5;{}".format(control, colour)
+
     # Fall back to a tuple
     return "{};2;{};{};{}".format(
         control,
@@ -1271,6 +1760,70 @@ def _get_sequence_for_colour(colour, is_background=False):
     )
 
 
+def _get_escape_sequences(settings, colour_depth=None):
+    """
+    Return the strings required to enable and then disable the effects and
+    colours specified by the settings of an AnsiEscapeCodeRenderer.
+    """
+    normalise = settings['normalise']
+    if colour_depth is None:
+        colour_depth = settings['colour_depth']
+    enable = []
+    disable = []
+
+    for effect in ansi_escape_sequences:
+        if settings[effect]:
+            enable.append(
+                ANSI_ESCAPE_SEQUENCE.format(
+                    ansi_escape_sequences[effect][0]
+                )
+            )
+            if not normalise:
+                disable.append(
+                    ANSI_ESCAPE_SEQUENCE.format(
+                        ansi_escape_sequences[effect][1]
+                    )
+                )
+
+    # Fonts
+    if settings['font'] is not None:
+        enable.append(ANSI_ESCAPE_SEQUENCE.format(settings['font'] + ANSI_FONT_OFFSET))
+        if not normalise:
+            disable.append(ANSI_ESCAPE_SEQUENCE.format(0 + ANSI_FONT_OFFSET))
+
+    # Colours
+    if settings['foreground_colour']:
+        enable.append(
+            ANSI_ESCAPE_SEQUENCE.format(
+                _get_sequence_for_colour(
+                    settings['foreground_colour'],
+                    colour_depth=colour_depth
+                )
+            )
+        )
+        if not normalise:
+            # Default foreground
+            disable.append(ANSI_ESCAPE_SEQUENCE.format(39))
+    if settings['background_colour']:
+        enable.append(
+            ANSI_ESCAPE_SEQUENCE.format(
+                _get_sequence_for_colour(
+                    settings['background_colour'],
+                    is_background=True,
+                    colour_depth=colour_depth
+                )
+            )
+        )
+        if not normalise:
+            # Default background
+            disable.append(ANSI_ESCAPE_SEQUENCE.format(49))
+
+    if normalise:
+        disable.append(ANSI_ESCAPE_SEQUENCE.format(0))
+
+    return "".join(enable), "".join(disable)
+
+
 class AnsiEscapeCodeRenderer(InlineRenderer):
     """
     Inline renderer that can style text using ANSI terminal escape sequences.
@@ -1294,65 +1847,41 @@ class AnsiEscapeCodeRenderer(InlineRenderer):
         encircled=False,
         overlined=False,
         normalise=False,
+        # 'truecolor', 256 or 16. Colours are mapped to the closest available
+        # at the specified depth.
+        colour_depth='truecolor',
+        # The (enable, disable) pair of escape strings, precomputed by
+        # prepare_settings. Calculated at render time if not provided.
+        escape_sequences=None,
     )
 
-    def render(self, content):
-        settings = self.settings
-        inner = super().render(content)
-        normalise = settings.normalise
-        enable = []
-        disable = []
-
-        for effect in ansi_escape_sequences:
-            if settings[effect]:
-                enable.append(
-                    ANSI_ESCAPE_SEQUENCE.format(
-                        ansi_escape_sequences[effect][0]
-                    )
-                )
-                if not normalise:
-                    disable.append(
-                        ANSI_ESCAPE_SEQUENCE.format(
-                            ansi_escape_sequences[effect][1]
-                        )
-                    )
-
-        # Fonts
-        if settings.font is not None:
-            enable.append(ANSI_ESCAPE_SEQUENCE.format(setting.font + ANSI_FONT_OFFSET))
-            if not normalise:
-                disable.append(ANSI_ESCAPE_SEQUENCE.format(0 + ANSI_FONT_OFFSET))
-
-        # Colours
-        if settings.foreground_colour:
-            enable.append(
-                ANSI_ESCAPE_SEQUENCE.format(
-                    _get_sequence_for_colour(
-                        settings.foreground_colour
-                    )
-                )
-            )
-            if not normalise:
-                # Default foreground
-                disable.append(ANSI_ESCAPE_SEQUENCE.format(39))
-        if settings.background_colour:
-            enable.append(
-                ANSI_ESCAPE_SEQUENCE.format(
-                    _get_sequence_for_colour(
-                        settings.background_colour,
-                        is_background=True
-                    )
-                )
-            )
-            if not normalise:
-                # Default background
-                disable.append(ANSI_ESCAPE_SEQUENCE.format(49))
-
-        if normalise:
-            disable.append(ANSI_ESCAPE_SEQUENCE.format(0))
+    @classmethod
+    def prepare_settings(cls, settings, colour_depth=None, **options):
+        """
+        Precompute the escape sequences for the settings, so that rendering
+        a span is just a matter of surrounding its content with them.
 
-        return "{}{}{}".format(
-            "".join(enable),
-            inner,
-            "".join(disable)
-        )
+        A colour_depth option overrides the colour depth in the settings.
+        """
+        merged = cls._class_settings()
+        merged.update(settings)
+        prepared = dict(settings)
+        prepared['escape_sequences'] = _get_escape_sequences(merged, colour_depth)
+        return prepared
+
+    @classmethod
+    def render_stateless(cls, node, settings, box, content):
+        if settings['capitalized']:
+            content = capitalize(content)
+        inner = settings['template'].format(content)
+        escape_sequences = settings['escape_sequences']
+        if escape_sequences is None:
+            escape_sequences = _get_escape_sequences(settings)
+        enable, disable = escape_sequences
+        return enable + inner + disable
+
+    @classmethod
+    def inline_affixes(cls, node, settings):
+        if settings['capitalized']:
+            return None
+        return _affixes(cls.render_stateless(node, settings, None, _CONTENT_SENTINEL))
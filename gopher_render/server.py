@@ -0,0 +1,369 @@
+"""
+A gopher server (RFC 1436) that renders HTML and Markdown documents as they
+are requested.
+
+Selectors map to paths below a root directory. Documents are rendered on an
+executor, so that the event loop is free to handle other connections, and the
+results are kept in a cache until the source file changes. Directories are
+served as menus listing their contents, and any other files are served as
+they are. Hidden files and directories are neither listed nor served.
+
+A simple client is included for fetching from the server.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import stat as stat_module
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from ._parser import _guess_type
+
+
+RENDERED_SUFFIXES = {
+    '.md': True,
+    '.html': False,
+    '.htm': False,
+}
+
+# Requests are a single line, so anything longer is not a valid request.
+MAX_REQUEST_LENGTH = 4096
+
+REQUEST_TIMEOUT = 30
+
+
+class RenderCache(object):
+    """
+    A least recently used cache of rendered documents. Entries are only
+    returned while the modification time and size of the source file are
+    unchanged.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _version(stat):
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, stat):
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == self._version(stat):
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, path, stat, value):
+        self._entries[path] = (self._version(stat), value)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# The configurations used by each worker. Parsers are reused, so every thread
+# has its own.
+_worker_state = threading.local()
+
+
+def _render_file(path, is_markdown, options):
+    """
+    Render a document. This runs on the executor.
+    """
+    from .cli import _Configuration
+    configurations = getattr(_worker_state, 'configurations', None)
+    if configurations is None:
+        configurations = _worker_state.configurations = {}
+    key = tuple(sorted(options.items()))
+    configuration = configurations.get(key)
+    if configuration is None:
+        configuration = configurations[key] = _Configuration(**options)
+    with open(path, 'r', encoding='utf-8') as in_file:
+        source_text = in_file.read()
+    return configuration.render(source_text, is_markdown)
+
+
+def _text_response(text):
+    """
+    Encode text as a gopher text file response.
+    """
+    lines = text.rstrip('\n').split('\n')
+    return "".join(
+        "{}{}\r\n".format('.' if line.startswith('.') else '', line)
+        for line in lines
+    ).encode('utf-8') + b".\r\n"
+
+
+def _menu_line(item_type, display, selector, host, port):
+    return "{}{}\t{}\t{}\t{}\r\n".format(item_type, display, selector, host, port)
+
+
+def _error_response(message):
+    return (_menu_line('3', message, '', 'error.host', 1) + ".\r\n").encode('utf-8')
+
+
+class GopherServer(object):
+    """
+    Serves the contents of a directory, rendering documents on request.
+
+    `hostname` and `port` are those advertised in menus and in the links of
+    rendered documents. The options are those accepted by the command line
+    interface, and are used to render every document. If no executor is
+    provided, a process pool with the given number of workers is created.
+
+    Process pools should not fork workers while the server is running, since
+    they would inherit open connections and keep them from being closed.
+    """
+
+    def __init__(
+        self,
+        root,
+        hostname='localhost',
+        port=70,
+        executor=None,
+        workers=None,
+        cache_size=128,
+        **options
+    ):
+        self.root = Path(root).resolve()
+        self.hostname = hostname
+        self.port = port
+        self.options = options
+        self.cache = RenderCache(cache_size)
+        self._owns_executor = executor is None
+        self._executor = executor
+        self._workers = workers
+        self._pending = {}
+        self._server = None
+
+    async def start(self, host=None):
+        """
+        Start listening. If the port is 0, one is chosen by the system and
+        advertised instead.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            host or self.hostname,
+            self.port,
+        )
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try:
+                line = await asyncio.wait_for(
+                    reader.readuntil(b"\n"),
+                    REQUEST_TIMEOUT
+                )
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            if len(line) > MAX_REQUEST_LENGTH:
+                response = _error_response("Request too long")
+            else:
+                # Anything after a tab is a search string, which is ignored
+                selector = line.decode('utf-8', 'replace').rstrip('\r\n').split('\t')[0]
+                response = await self.respond(selector)
+            writer.write(response)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def _resolve(self, selector):
+        """
+        Return the path a selector refers to, or None if it is outside the
+        root directory or hidden.
+        """
+        relative = Path(selector.lstrip('/'))
+        if any(part.startswith('.') for part in relative.parts):
+            # Hidden files are not listed in menus, and can't be requested
+            # directly either.
+            return None
+        path = (self.root / relative).resolve()
+        if path != self.root and self.root not in path.parents:
+            return None
+        return path
+
+    async def respond(self, selector):
+        """
+        Return the response to a request for the selector.
+        """
+        path = self._resolve(selector)
+        if path is None:
+            return _error_response("Not found")
+        # Reading files and directories happens on the default executor, so
+        # that a slow disk or a large file doesn't hold up other connections.
+        loop = asyncio.get_running_loop()
+        try:
+            stat = await loop.run_in_executor(None, path.stat)
+        except OSError:
+            return _error_response("Not found")
+        if stat_module.S_ISDIR(stat.st_mode):
+            return await loop.run_in_executor(None, self._menu, path)
+        if path.suffix not in RENDERED_SUFFIXES:
+            return await loop.run_in_executor(None, path.read_bytes)
+        return await self._rendered(path, stat)
+
+    async def _rendered(self, path, stat):
+        response = self.cache.get(path, stat)
+        if response is not None:
+            return response
+        # Requests for a document that is already being rendered wait for
+        # that instead of rendering it again.
+        task = self._pending.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._render(path, stat))
+            self._pending[path] = task
+            task.add_done_callback(lambda t: self._finished(path, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, path, task):
+        if self._pending.get(path) is task:
+            del self._pending[path]
+
+    def _render_options(self):
+        # Links in gophermaps point back at this server
+        options = dict(gopher_host=self.hostname, gopher_port=self.port)
+        options.update(self.options)
+        return options
+
+    async def _render(self, path, stat):
+        loop = asyncio.get_running_loop()
+        try:
+            text = await loop.run_in_executor(
+                self._executor,
+                _render_file,
+                str(path),
+                RENDERED_SUFFIXES[path.suffix],
+                self._render_options(),
+            )
+        except Exception as e:
+            return _error_response("Render failed: {}".format(e))
+        response = _text_response(text)
+        self.cache.put(path, stat, response)
+        return response
+
+    def _menu(self, path):
+        """
+        List the contents of a directory. This runs on the default executor.
+        """
+        lines = []
+        for child in sorted(path.iterdir()):
+            if child.name.startswith('.'):
+                continue
+            selector = '/' + child.relative_to(self.root).as_posix()
+            if child.is_dir():
+                item_type = '1'
+            elif child.suffix in RENDERED_SUFFIXES:
+                item_type = '0'
+            else:
+                item_type = str(_guess_type(child.name))
+                if item_type == '1':
+                    # Files without an extension are served as they are
+                    item_type = '9'
+            lines.append(_menu_line(item_type, child.name, selector, self.hostname, self.port))
+        lines.append(".\r\n")
+        return "".join(lines).encode('utf-8')
+
+
+async def fetch(host, port, selector='', timeout=REQUEST_TIMEOUT):
+    """
+    Request a selector from a gopher server, returning the raw response.
+    """
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port),
+        timeout
+    )
+    try:
+        writer.write(selector.encode('utf-8') + b"\r\n")
+        await writer.drain()
+        return await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+
+
+def decode_text(response):
+    """
+    Decode a text file response, removing the terminator and the extra
+    periods at the start of lines.
+    """
+    lines = response.decode('utf-8').split('\r\n')
+    if '.' in lines:
+        lines = lines[:lines.index('.')]
+    return "\n".join(
+        line[1:] if line.startswith('..') else line
+        for line in lines
+    )
+
+
+def serve(root, host='localhost', port=70, workers=None, cache_size=128, **options):
+    """
+    Run a server until interrupted.
+    """
+    async def run():
+        server = GopherServer(
+            root,
+            hostname=host,
+            port=port,
+            workers=workers,
+            cache_size=cache_size,
+            **options
+        )
+        listener = await server.start()
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    from . import code_themes
+    parser = argparse.ArgumentParser(
+        prog="gopher-render serve",
+        description="Serve a directory over gopher, rendering HTML and Markdown on request"
+    )
+    parser.add_argument("root", type=str, action="store", help="directory to serve")
+    parser.add_argument("-H", "--host", type=str, default="localhost", dest="host", help="host name to listen on and advertise")
+    parser.add_argument("-p", "--port", type=int, default=70, dest="port", help="port to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=None, dest="workers", help="number of render worker processes")
+    parser.add_argument("--cache-size", type=int, default=128, dest="cache_size", help="number of rendered documents to cache")
+    parser.add_argument("-c", "--colour-depth", choices=["truecolor", "256", "16"], default="truecolor", dest="colour_depth", help="Colour depth supported by the target clients")
+    parser.add_argument("-t", "--theme", choices=code_themes.themes, default="iced_gopher", dest="theme", help="Theme for highlighted code")
+    args = parser.parse_args(argv)
+    serve(
+        args.root,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        cache_size=args.cache_size,
+        theme=args.theme,
+        colour_depth=args.colour_depth,
+    )
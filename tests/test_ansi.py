@@ -0,0 +1,118 @@
+"""
+Tests for the _ansi module
+"""
+import pytest
+
+from gopher_render import GopherHTMLParser
+from gopher_render._ansi import minimise_escape_sequences, EscapeSequenceMinimiser
+from gopher_render._ansi import nearest_256, nearest_16
+from gopher_render.rendering import AnsiEscapeCodeRenderer
+
+
+def test_adjacent_runs_merged():
+    text = "\x1b[33mfoo\x1b[39m\x1b[33mbar\x1b[39m"
+    assert minimise_escape_sequences(text) == "\x1b[33mfoobar\x1b[0m"
+
+
+def test_foreground_kept_across_whitespace():
+    text = "\x1b[33mfoo\x1b[39m \x1b[33mbar\x1b[39m"
+    assert minimise_escape_sequences(text) == "\x1b[33mfoo bar\x1b[0m"
+
+
+def test_background_not_kept_across_whitespace():
+    text = "\x1b[43mfoo\x1b[49m \x1b[43mbar\x1b[49m"
+    assert minimise_escape_sequences(text) == "\x1b[43mfoo\x1b[49m \x1b[43mbar\x1b[0m"
+
+
+def test_changes_combined():
+    text = "\x1b[1m\x1b[33ma\x1b[39m\x1b[22m\x1b[35mb\x1b[39m"
+    assert minimise_escape_sequences(text) == "\x1b[1;33ma\x1b[0;35mb\x1b[0m"
+
+
+def test_lines_independent():
+    text = "\x1b[33mfoo\x1b[39m\n\x1b[33mbar\x1b[39m"
+    assert minimise_escape_sequences(text) == "\x1b[33mfoo\x1b[0m\n\x1b[33mbar\x1b[0m"
+
+
+def test_redundant_sequences_dropped():
+    assert minimise_escape_sequences("\x1b[39m\x1b[0mplain") == "plain"
+    assert minimise_escape_sequences("\x1b[31m\x1b[32mx") == "\x1b[32mx"
+
+
+def test_unknown_sequences_preserved():
+    # The sequence may have set attributes that are not tracked, so they are
+    # not cleared with a reset afterwards.
+    text = "\x1b[33mfoo\x1b[38;9mbar\x1b[39m"
+    assert minimise_escape_sequences(text) == text
+
+
+def test_partly_understood_sequences_tracked():
+    # Bold still has to be turned off after a sequence that also sets an
+    # underline colour, and only with codes that leave the underline colour.
+    text = "\x1b[1;58;5;3mbold\x1b[22mplain"
+    assert minimise_escape_sequences(text) == text
+    text = "\x1b[1;58;5;3mbold\x1b[0mplain\x1b[1mbold\x1b[0m"
+    assert minimise_escape_sequences(text) == text
+
+
+def test_streaming_split_sequence():
+    minimiser = EscapeSequenceMinimiser()
+    out = minimiser.feed("\x1b[33mfoo\x1b[3")
+    out += minimiser.feed("9m\x1b[33mbar\x1b")
+    out += minimiser.feed("[39m")
+    out += minimiser.close()
+    assert out == "\x1b[33mfoobar\x1b[0m"
+
+
+def test_parser_option():
+    renderers = {
+        '.k': (AnsiEscapeCodeRenderer, dict(foreground_colour='yellow')),
+    }
+    html = '<span class="k">one</span><span class="k">two</span>'
+    parser = GopherHTMLParser(renderers=renderers, minimise_ansi=True)
+    parser.feed(html)
+    parser.close()
+    assert parser.parsed == "\x1b[33monetwo\x1b[0m"
+
+
+def test_nearest_256():
+    # Exact matches in the colour cube and greyscale ramp
+    assert nearest_256((255, 0, 0)) == 196
+    assert nearest_256((95, 135, 175)) == 67
+    assert nearest_256((238, 238, 238)) == 255
+    # Close to grey
+    assert nearest_256((0x49, 0x48, 0x3e)) == 238
+
+
+def test_nearest_16():
+    assert nearest_16((250, 10, 10)) == 9
+    assert nearest_16((0, 0, 0)) == 0
+    assert nearest_16((0x49, 0x48, 0x3e)) == 8
+
+
+@pytest.mark.parametrize("depth,expected", [
+    (None, "\x1b[48;2;73;72;62m"),
+    ('truecolor', "\x1b[48;2;73;72;62m"),
+    (256, "\x1b[48;5;238m"),
+    (16, "\x1b[100m"),
+])
+def test_parser_colour_depth(depth, expected):
+    renderers = {
+        '.hll': (AnsiEscapeCodeRenderer, dict(background_colour='#49483e')),
+    }
+    parser = GopherHTMLParser(renderers=renderers, colour_depth=depth)
+    parser.feed('<span class="hll">x</span>')
+    parser.close()
+    assert parser.parsed == "{}x\x1b[49m".format(expected)
+
+
+def test_palette_colour_to_16():
+    r = AnsiEscapeCodeRenderer(None, settings=dict(foreground_colour=208, colour_depth=16))
+    assert r.render("x") == "\x1b[33mx\x1b[39m"
+    r = AnsiEscapeCodeRenderer(None, settings=dict(foreground_colour=3, colour_depth=16))
+    assert r.render("x") == "\x1b[33mx\x1b[39m"
+
+
+def test_invalid_colour_depth():
+    with pytest.raises(ValueError):
+        GopherHTMLParser(colour_depth=8)
@@ -0,0 +1,155 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import time
+
+import pytest
+
+from gopher_render import GopherHTMLParser, render_async, RenderExecutor
+
+
+HTML = """<h1>Title</h1>
+<p>Some <em>text</em> with <a href="gopher://example.com/">a link</a>.</p>
+"""
+
+CONFIG = dict(link_placement='footer', width=40)
+
+
+def _render(source, **config):
+    parser = GopherHTMLParser(**config)
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+def test_default_executor():
+    assert asyncio.run(render_async(HTML, CONFIG)) == _render(HTML, **CONFIG)
+
+
+def test_thread_executor_reuses_parser():
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        async def run():
+            first = await render_async(HTML, CONFIG, executor)
+            await render_async("<p>Other</p>", CONFIG, executor)
+            second = await render_async(HTML, CONFIG, executor)
+            return first, second
+        first, second = asyncio.run(run())
+    assert first == second == _render(HTML, **CONFIG)
+
+
+def test_markdown():
+    pytest.importorskip('markdown')
+    expected = GopherHTMLParser()
+    expected.feed_markdown("# Title\n\nSome *text*.")
+    expected.close()
+    result = asyncio.run(render_async("# Title\n\nSome *text*.", {}, markdown_options={}))
+    assert result == expected.parsed
+
+
+def test_render_executor():
+    with RenderExecutor(CONFIG, max_workers=1) as executor:
+        async def run():
+            return await asyncio.gather(
+                render_async(HTML, CONFIG, executor),
+                render_async(HTML, dict(CONFIG, width=30), executor),
+            )
+        installed, other = asyncio.run(run())
+    assert installed == _render(HTML, **CONFIG)
+    assert other == _render(HTML, **dict(CONFIG, width=30))
+
+
+def test_timeout_abandons_render():
+    source = "<p>Some text.</p>" * 100000
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(render_async(source, CONFIG, executor, timeout=0.05))
+        # The worker stops soon after, rather than finishing the document
+        start = time.monotonic()
+        executor.submit(lambda: None).result()
+        assert time.monotonic() - start < 1
+
+
+def test_timeout_stops_process_worker():
+    # Parsing takes less time than the timeout, so the worker is stopped
+    # while rendering the parsed document.
+    source = "<p>Some text.</p>" * 20000
+    with concurrent.futures.ProcessPoolExecutor(
+        1,
+        mp_context=multiprocessing.get_context('spawn')
+    ) as executor:
+        async def run():
+            await render_async(HTML, CONFIG, executor)
+            with pytest.raises(asyncio.TimeoutError):
+                await render_async(source, CONFIG, executor, timeout=1.5)
+            start = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(executor, time.monotonic)
+            return time.monotonic() - start
+        assert asyncio.run(run()) < 1
+
+
+def test_timeout_ignores_clock_changes(monkeypatch):
+    expected = _render(HTML, **CONFIG)
+    # As if the system clock were set a day forward as soon as the render
+    # starts
+    wall_clock = time.time
+    calls = []
+
+    def adjusted_clock():
+        calls.append(None)
+        return wall_clock() + (86400 if len(calls) > 1 else 0)
+
+    monkeypatch.setattr(time, 'time', adjusted_clock)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        assert asyncio.run(render_async(HTML, CONFIG, executor, timeout=60)) == expected
+
+
+def test_time_limit_of_config_kept():
+    from gopher_render import RenderConfig, TimeLimitExceeded
+    config = RenderConfig(time_limit=0)
+    with pytest.raises(TimeLimitExceeded):
+        asyncio.run(render_async(HTML * 10, config, timeout=10))
+
+
+def test_cancel():
+    source = "<p>Some text.</p>" * 100000
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        async def run():
+            task = asyncio.ensure_future(render_async(source, CONFIG, executor))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            start = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(executor, lambda: None)
+            return time.monotonic() - start
+        assert asyncio.run(run()) < 1
+
+
+def test_close_incremental():
+    source = HTML * 20
+    parser = GopherHTMLParser(**CONFIG)
+    parser.feed(source)
+    counts = list(parser.close_incremental(10))
+    assert counts == sorted(counts)
+    assert len(counts) > 5
+    assert all(c % 10 == 0 for c in counts)
+    assert parser.parsed == _render(source, **CONFIG)
+
+
+def test_render_cooperative_interleaves():
+    from gopher_render import render_cooperative
+    large = HTML * 200
+    finished = []
+
+    async def render(name, source):
+        result = await render_cooperative(source, CONFIG, max_nodes=20)
+        finished.append(name)
+        return result
+
+    async def run():
+        return await asyncio.gather(render('large', large), render('small', HTML))
+
+    large_result, small_result = asyncio.run(run())
+    assert finished == ['small', 'large']
+    assert large_result == _render(large, **CONFIG)
+    assert small_result == _render(HTML, **CONFIG)
@@ -0,0 +1,88 @@
+import pickle
+import threading
+
+import pytest
+
+from gopher_render import GopherHTMLParser, RenderConfig
+from gopher_render.rendering import Box
+
+
+HTML = """<h1>Title</h1>
+<p>Some <em>text</em> with <a href="gopher://example.com/">a link</a>.</p>
+<ul><li>One</li><li>Two</li></ul>
+"""
+
+
+def _render(parser, source=HTML):
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+def test_immutable():
+    config = RenderConfig()
+    with pytest.raises(AttributeError):
+        config.link_placement = 'inline'
+    with pytest.raises(TypeError):
+        config.renderers['p'] = None
+
+
+def test_copies_arguments():
+    renderers = {'p': (None, dict(margin=[0, 0, 0, 0]))}
+    box = Box(width=40)
+    config = RenderConfig(renderers=renderers, box=box)
+    renderers['p'][1]['margin'] = [2, 2, 2, 2]
+    box.width = 20
+    assert config.renderers['p'][1]['margin'] == [0, 0, 0, 0]
+    assert config.box.width == 40
+
+
+def test_hash_and_equality():
+    box = Box(width=40, margin=[1, 0, 1, 0])
+    a = RenderConfig(box=box, renderers={'p': (None, dict(margin=[0, 0, 0, 0]))})
+    b = RenderConfig(box=Box(width=40, margin=[1, 0, 1, 0]), renderers={'p': (None, dict(margin=[0, 0, 0, 0]))})
+    c = a.replace(link_placement='inline')
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a != c
+    assert c.link_placement == 'inline'
+    assert c.box.width == 40
+
+
+def test_pickle():
+    config = RenderConfig(box=Box(width=40), link_placement='after_block')
+    copy = pickle.loads(pickle.dumps(config))
+    assert copy == config
+    assert _render(copy.session()) == _render(config.session())
+
+
+def test_sessions_share_maps():
+    config = RenderConfig()
+    first = config.session()
+    second = config.session()
+    assert first._renderer_map is second._renderer_map
+    assert _render(first) == _render(second) == _render(GopherHTMLParser())
+
+
+def test_parser_arguments_validated():
+    with pytest.raises(ValueError):
+        GopherHTMLParser(output_format='gophermap', link_placement='inline', gopher_host='example.com')
+    with pytest.raises(ValueError):
+        RenderConfig(output_format='gophermap')
+
+
+def test_threads_share_config():
+    config = RenderConfig(link_placement='after_block')
+    expected = _render(config.session())
+    results = []
+
+    def render():
+        for _ in range(20):
+            results.append(_render(config.session()))
+
+    threads = [threading.Thread(target=render) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 80
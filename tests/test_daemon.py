@@ -0,0 +1,137 @@
+import socket
+import threading
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, 'AF_UNIX'),
+    reason="Unix sockets are not available"
+)
+
+from gopher_render import daemon
+from gopher_render.cli import _Configuration
+
+
+HTML = """<h1>Title</h1>
+<p>Some <em>text</em> with <a href="gopher://example.com/">a link</a>.</p>
+"""
+
+
+@pytest.fixture
+def running_daemon(tmp_path):
+    path = str(tmp_path / 'render.sock')
+    server = daemon.RenderDaemon(path, max_configurations=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server, path
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_render_with_daemon(running_daemon):
+    server, path = running_daemon
+    expected = _Configuration().render(HTML)
+    assert daemon.request_render(HTML, socket_path=path) == expected
+    # The configuration is reused
+    assert daemon.request_render(HTML, socket_path=path) == expected
+    assert len(server._configurations) == 1
+
+
+def test_render_markdown_with_daemon(running_daemon):
+    pytest.importorskip('markdown')
+    pytest.importorskip('pygments')
+    server, path = running_daemon
+    source = "# Title\n\nSome *text*.\n\n    :::python\n    x = 1\n"
+    expected = _Configuration(colour_depth=16).render(source, True)
+    assert daemon.request_render(source, True, socket_path=path, colour_depth=16) == expected
+
+
+def test_configurations_evicted(running_daemon):
+    server, path = running_daemon
+    for theme in ('monokai', 'github', 'autumn'):
+        daemon.request_render(HTML, socket_path=path, theme=theme)
+    assert len(server._configurations) == 2
+
+
+def test_daemon_error(running_daemon):
+    server, path = running_daemon
+    with pytest.raises(daemon.DaemonError):
+        daemon.request_render(HTML, socket_path=path, theme='nothing')
+
+
+def test_fallback_without_daemon(tmp_path):
+    path = str(tmp_path / 'missing.sock')
+    with pytest.raises(FileNotFoundError):
+        daemon.request_render(HTML, socket_path=path)
+    assert daemon.render(HTML, socket_path=path) == _Configuration().render(HTML)
+
+
+SLOW = "<p>Slow</p>"
+
+
+@pytest.fixture
+def slow_render(running_daemon):
+    """
+    Make the daemon hold renders of SLOW until the returned event is set.
+    """
+    server, path = running_daemon
+    release = threading.Event()
+    render = server.render
+
+    def held_render(request):
+        if request['source'] == SLOW:
+            release.wait(10)
+        return render(request)
+
+    server.render = held_render
+    yield release
+    release.set()
+
+
+def test_slow_render_does_not_block(running_daemon, slow_render):
+    server, path = running_daemon
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(daemon.request_render(SLOW, socket_path=path))
+    )
+    thread.start()
+    assert daemon.request_render(HTML, socket_path=path) == _Configuration().render(HTML)
+    assert not results
+    slow_render.set()
+    thread.join()
+    assert results == [_Configuration().render(SLOW)]
+
+
+def test_fallback_on_timeout(running_daemon, slow_render):
+    server, path = running_daemon
+    with pytest.raises(socket.timeout):
+        daemon.request_render(SLOW, socket_path=path, timeout=0.1)
+    assert daemon.render(SLOW, socket_path=path, timeout=0.1) == _Configuration().render(SLOW)
+
+
+def test_idle_configurations_limited(running_daemon):
+    server, path = running_daemon
+    # As if several requests with the same options had arrived at once
+    configurations = [server._acquire_configuration('{}', {}) for i in range(4)]
+    for configuration in configurations:
+        server._release_configuration('{}', configuration)
+    assert server._configurations['{}'] == configurations[2:]
+    server._release_configuration('other', _Configuration())
+    assert server._configurations['{}'] == configurations[3:]
+    assert len(server._configurations['other']) == 1
+
+
+def test_no_timeout_by_default(running_daemon, slow_render):
+    server, path = running_daemon
+    timer = threading.Timer(0.5, slow_render.set)
+    timer.start()
+    assert daemon.request_render(SLOW, socket_path=path) == _Configuration().render(SLOW)
+    timer.join()
+
+
+def test_configuration_reuse():
+    configuration = _Configuration()
+    first = configuration.render(HTML)
+    configuration.render("<p>Something else</p>")
+    assert configuration.render(HTML) == first
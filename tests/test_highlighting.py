@@ -0,0 +1,101 @@
+"""
+Tests for the highlighting module
+"""
+import pytest
+
+pygments = pytest.importorskip("pygments")
+markdown = pytest.importorskip("markdown")
+
+from pygments.lexers import PythonLexer
+
+from gopher_render import GopherHTMLParser
+from gopher_render.highlighting import GopherFormatter, codehilite_formatter
+from gopher_render.rendering import AnsiEscapeCodeRenderer
+from gopher_render.code_themes.iced_gopher import renderers as iced_gopher
+
+
+SOURCE = "\n".join([
+    "# Title",
+    "",
+    "    :::python",
+    "    def foo(x):",
+    "        \"\"\"Doc",
+    "        string\"\"\"",
+    "        return x + 1  # comment & <stuff>",
+    "",
+])
+
+
+def _render_markdown(formatter=None):
+    config = {'css_class': 'highlight'}
+    if formatter is not None:
+        config['pygments_formatter'] = formatter
+    md = markdown.Markdown(
+        extensions=['markdown.extensions.codehilite'],
+        extension_configs={'markdown.extensions.codehilite': config},
+    )
+    html = md.convert(SOURCE)
+    parser = GopherHTMLParser(renderers=iced_gopher)
+    parser.feed(html)
+    parser.close()
+    return html, parser.parsed
+
+
+def test_plain_text():
+    formatter = GopherFormatter()
+    output = pygments.highlight("x = 1\n", PythonLexer(), formatter)
+    assert output == "x = 1\n"
+
+
+def test_ansi_text():
+    formatter = GopherFormatter(renderers=iced_gopher)
+    output = pygments.highlight("def foo():\n", PythonLexer(), formatter)
+    assert output == "\x1b[95mdef\x1b[39m \x1b[96mfoo\x1b[39m():\n"
+
+
+def test_adjacent_tokens_merged():
+    renderers = {
+        '.s2': (AnsiEscapeCodeRenderer, dict(foreground_colour='red')),
+    }
+    formatter = GopherFormatter(renderers=renderers)
+    # The quotes and the string content are separate tokens
+    output = pygments.highlight('"abc"\n', PythonLexer(), formatter)
+    assert output == '\x1b[31m"abc"\x1b[39m\n'
+
+
+def test_selectors_with_container_class():
+    renderers = {
+        '.highlight .k': (AnsiEscapeCodeRenderer, dict(bold=True)),
+    }
+    formatter = GopherFormatter(renderers=renderers)
+    output = pygments.highlight("def\n", PythonLexer(), formatter)
+    assert output == "\x1b[1mdef\x1b[22m\n"
+
+
+def test_matches_html_spans():
+    span_html, span_output = _render_markdown()
+    direct_html, direct_output = _render_markdown(codehilite_formatter(iced_gopher))
+    assert '<span' in span_html
+    assert '<span' not in direct_html
+    assert direct_output == span_output
+
+
+def test_cli_without_formatter_option(monkeypatch):
+    # Markdown releases before 3.4 have no pygments_formatter option, and
+    # reject options they don't know.
+    from markdown.extensions import codehilite
+    from gopher_render.cli import _Configuration
+
+    class OldCodeHiliteExtension(codehilite.CodeHiliteExtension):
+        def __init__(self, **kwargs):
+            super().__init__()
+            del self.config['pygments_formatter']
+            self.setConfigs(kwargs)
+
+    expected = _Configuration().render(SOURCE, is_markdown=True)
+    monkeypatch.setattr(codehilite, 'CodeHiliteExtension', OldCodeHiliteExtension)
+    configuration = _Configuration()
+    options = configuration.markdown_options()
+    assert 'pygments_formatter' not in options['extension_configs']['markdown.extensions.codehilite']
+    assert '<span' in configuration.to_html(SOURCE)
+    assert configuration.render(SOURCE, is_markdown=True) == expected
@@ -598,3 +598,52 @@ class TestDefaults:
             assert len(lines[i]) == 67
         for i in range(1, 7):
             assert len(lines[i]) == 67
+
+
+class TestWhitespace:
+    """
+    Test the handling of whitespace in the source.
+    """
+    def _render(self, html, chunk_size=None):
+        parser = GopherHTMLParser()
+        if chunk_size:
+            for i in range(0, len(html), chunk_size):
+                parser.feed(html[i:i + chunk_size])
+        else:
+            parser.feed(html)
+        parser.close()
+        return parser
+
+    def test_split_text_coalesced(self):
+        """
+        Text reported in several pieces produces a single text node.
+        """
+        html = "<p>Some text &amp; an entity\n   split over lines</p>"
+        parser = self._render(html, chunk_size=3)
+        p = parser.tree.children[0]
+        assert len(p.children) == 1
+        assert p.children[0].data == "Some text & an entity split over lines"
+        assert parser.parsed == self._render(html).parsed
+
+    def test_pretty_printed_lists(self):
+        """
+        Whitespace between list items is dropped, so it does not affect
+        indentation or numbering.
+        """
+        pretty = self._render("<ol>\n    <li>First</li>\n    <li>Second</li>\n</ol>")
+        compact = self._render("<ol><li>First</li><li>Second</li></ol>")
+        assert len(pretty.tree.children[0].children) == 2
+        assert pretty.parsed == compact.parsed
+        assert "1. First" in pretty.parsed
+        assert "2. Second" in pretty.parsed
+
+    def test_whitespace_between_inline_tags_kept(self):
+        """
+        Whitespace separating inline tags is significant.
+        """
+        output = self._render("<p><em>one</em> <strong>two</strong></p>").parsed
+        assert "_one_ **two**" in output
+
+    def test_pre_whitespace_kept(self):
+        output = self._render("<pre>\n  keep   this\n</pre>").parsed
+        assert "  keep   this" in output
@@ -0,0 +1,84 @@
+import pytest
+
+from gopher_render import GopherHTMLParser
+from gopher_render import ResourceLimitExceeded, NodeLimitExceeded, DepthLimitExceeded
+from gopher_render import OutputLimitExceeded, TimeLimitExceeded
+
+
+PARAGRAPHS = "".join("<p>Paragraph {}.</p>".format(i) for i in range(50))
+
+
+def _render(source, **config):
+    parser = GopherHTMLParser(**config)
+    parser.feed(source)
+    parser.close()
+    return parser
+
+
+def test_no_limits_by_default():
+    parser = _render(PARAGRAPHS)
+    assert parser.truncated is None
+    assert "Paragraph 49." in parser.parsed
+
+
+def test_node_limit():
+    with pytest.raises(NodeLimitExceeded) as e:
+        _render(PARAGRAPHS, max_nodes=20)
+    assert e.value.limit == 20
+    assert isinstance(e.value, ResourceLimitExceeded)
+
+
+def test_node_limit_truncates():
+    parser = _render(PARAGRAPHS, max_nodes=20, on_limit='truncate')
+    assert isinstance(parser.truncated, NodeLimitExceeded)
+    assert "Paragraph 9." in parser.parsed
+    assert "Paragraph 10." not in parser.parsed
+
+
+def test_depth_limit():
+    source = "<div>" * 30 + "<p>Deep</p>" + "</div>" * 30 + "<p>After</p>"
+    with pytest.raises(DepthLimitExceeded):
+        _render(source, max_depth=10)
+    parser = _render(source, max_depth=10, on_limit='truncate')
+    assert isinstance(parser.truncated, DepthLimitExceeded)
+    assert "Deep" not in parser.parsed
+    assert "After" not in parser.parsed
+
+
+def test_deep_nesting_renders():
+    # Rendering does not recurse, so deep documents are fine without limits
+    source = "<span>" * 2000 + "Deep" + "</span>" * 2000
+    assert "Deep" in _render(source).parsed
+
+
+def test_output_limit():
+    with pytest.raises(OutputLimitExceeded):
+        _render(PARAGRAPHS, max_output=200)
+    parser = _render(PARAGRAPHS, max_output=200, on_limit='truncate')
+    assert isinstance(parser.truncated, OutputLimitExceeded)
+    assert 0 < len(parser.parsed.encode('utf-8')) <= 200
+    assert parser.parsed.endswith("\n")
+
+
+def test_time_limit(monkeypatch):
+    from gopher_render import _parser
+    clock = iter(range(1000))
+    monkeypatch.setattr(_parser.time, 'monotonic', lambda: next(clock))
+    with pytest.raises(TimeLimitExceeded):
+        _render(PARAGRAPHS, time_limit=40)
+
+
+def test_time_limit_truncates_render(monkeypatch):
+    from gopher_render import _parser
+    clock = iter(range(1000))
+    monkeypatch.setattr(_parser.time, 'monotonic', lambda: next(clock))
+    # Parsing the document takes 100 ticks, so rendering is cut short
+    parser = _render(PARAGRAPHS, time_limit=160, on_limit='truncate')
+    assert isinstance(parser.truncated, TimeLimitExceeded)
+    assert "Paragraph 0." in parser.parsed
+    assert "Paragraph 49." not in parser.parsed
+
+
+def test_invalid_on_limit():
+    with pytest.raises(ValueError):
+        GopherHTMLParser(on_limit='ignore')
@@ -0,0 +1,81 @@
+from gopher_render import RenderConfig, render_targets
+from gopher_render.rendering import NonRenderer, ParagraphRenderer
+
+
+SOURCE = """
+<nav><a href="/home">Home</a> <a href="/about">About</a></nav>
+<p>See <a href="/about">about</a>, <a href="/home">home</a> and
+<a href="http://example.com/">elsewhere</a>.</p>
+<p>Then <a href="/about">about</a> and <a href="/about">about</a> again.</p>
+"""
+
+
+def _render(source=SOURCE, **config):
+    parser = RenderConfig(**config).session()
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+def test_links_not_deduplicated_by_default():
+    parsed = _render()
+    assert "[6] about: /about" in parsed
+    assert parsed.count(": /about") == 4
+
+
+def test_footer_deduplicated():
+    parsed = _render(deduplicate_links=True)
+    assert "[about][2], [home][1] and" in parsed
+    assert "Then [about][2] and [about][2] again." in parsed
+    assert parsed.count(": /about") == 1
+    assert parsed.count(": /home") == 1
+    assert "[3] elsewhere: http://example.com/" in parsed
+
+
+def test_after_block_deduplicated_within_block():
+    parsed = _render(deduplicate_links=True, link_placement='after_block')
+    assert "Then [about][6] and [about][6] again." in parsed
+    # Each block still lists the links it refers to
+    assert parsed.count(": /about") == 3
+
+
+def test_gophermap_deduplicated():
+    parsed = _render(
+        deduplicate_links=True,
+        output_format='gophermap',
+        gopher_host='example.com',
+    )
+    assert parsed.count("\t/about\texample.com\t70") == 1
+
+
+def test_ignored_first_link_still_listed():
+    # The navigation is only ignored while rendering, so the links in it have
+    # already been numbered, and the later links refer to them.
+    renderers = {'nav': NonRenderer, 'p:last-child': ParagraphRenderer}
+    parsed = _render(deduplicate_links=True, renderers=renderers)
+    assert "Home" not in parsed
+    assert "[about][2], [home][1] and" in parsed
+    assert "[1] home: /home\n[2] about: /about\n" in parsed
+
+
+def test_targets_deduplicate_separately():
+    configs = [
+        RenderConfig(deduplicate_links=True),
+        RenderConfig(),
+        RenderConfig(deduplicate_links=True, link_placement='after_block'),
+    ]
+    assert render_targets(SOURCE, configs) == [
+        _render(deduplicate_links=True),
+        _render(),
+        _render(deduplicate_links=True, link_placement='after_block'),
+    ]
+
+
+def test_retarget_resolves_again():
+    source = '<p><a href="/page">Page</a></p>'
+    parser = RenderConfig(output_format='gophermap', gopher_host='one.com').session()
+    parser.feed(source)
+    other = RenderConfig(output_format='gophermap', gopher_host='two.com')
+    assert "\t/page\ttwo.com\t70" in parser.render_as(other)
+    parser.close()
+    assert "\t/page\tone.com\t70" in parser.parsed
@@ -0,0 +1,91 @@
+"""
+Tests for parsing Markdown directly into the parse tree.
+"""
+import pytest
+
+markdown = pytest.importorskip("markdown")
+
+from gopher_render import GopherHTMLParser
+
+
+SOURCE = "\n".join([
+    "# Title & stuff",
+    "",
+    "Some *text* with **bold**, `code`, a [link](http://x.com \"T\") and",
+    "\\*escapes\\* &copy; AT&T <b>inline html</b>.",
+    "Email: <me@example.com> and <http://auto.link>.",
+    "",
+    "<div class=\"x\">",
+    "block <em>html</em>",
+    "</div>",
+    "",
+    "> quote",
+    "> more",
+    "",
+    "1. one",
+    "2. two",
+    "    * nested",
+    "",
+    "Term",
+    ":   Definition",
+    "",
+    "Footnote[^1].",
+    "",
+    "[^1]: The note.",
+    "",
+    "<div markdown=\"1\">",
+    "*inside* md",
+    "</div>",
+    "",
+    "    code block",
+    "    & more",
+    "",
+    "Line with trailing  ",
+    "break.",
+    "",
+])
+
+OPTIONS = dict(
+    extensions=['markdown.extensions.extra'],
+    output_format='html5',
+)
+
+
+def _render_html(**parser_options):
+    html = markdown.Markdown(**OPTIONS).convert(SOURCE)
+    parser = GopherHTMLParser(**parser_options)
+    parser.feed(html)
+    parser.close()
+    return parser.parsed
+
+
+def _render_direct(**parser_options):
+    parser = GopherHTMLParser(**parser_options)
+    md = parser.feed_markdown(SOURCE, **OPTIONS)
+    parser.close()
+    return md, parser.parsed
+
+
+@pytest.mark.parametrize("link_placement", ['footer', 'inline', 'after_block'])
+def test_matches_html_round_trip(link_placement):
+    expected = _render_html(link_placement=link_placement)
+    md, output = _render_direct(link_placement=link_placement)
+    assert output == expected
+
+
+def test_entities_and_escapes():
+    md, output = _render_direct()
+    assert "*escapes*" in output
+    assert "© AT&T" in output
+    assert "me@example.com" in output
+
+
+def test_meta_available():
+    parser = GopherHTMLParser()
+    md = parser.feed_markdown(
+        "Title: Test\n\nText",
+        extensions=['markdown.extensions.meta']
+    )
+    parser.close()
+    assert md.Meta == {'title': ['Test']}
+    assert parser.parsed.strip() == "Text"
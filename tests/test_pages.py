@@ -0,0 +1,120 @@
+import io
+
+import pytest
+
+from gopher_render import RenderConfig
+from gopher_render._pages import Pages
+from gopher_render.rendering import Box
+
+
+SOURCE = "<h1>Title</h1>" + "".join(
+    "<p>Paragraph {} with <a href='/page{}'>a link</a> and enough words to "
+    "wrap it onto another line.</p>".format(i, i)
+    for i in range(20)
+) + "<ul><li>One</li><li>Two</li></ul>"
+
+CONFIG = RenderConfig(box=Box(width=40), link_placement='inline')
+
+
+def _parse(source=SOURCE, config=CONFIG):
+    parser = config.session()
+    parser.feed(source)
+    return parser
+
+
+def _render(source=SOURCE, config=CONFIG):
+    parser = _parse(source, config)
+    parser.close()
+    return parser.parsed
+
+
+def _body(page):
+    # Everything before the navigation
+    return page.rpartition("\n\nPage ")[0]
+
+
+@pytest.mark.parametrize('page_lines', [1, 5, 7, 1000])
+def test_pages_make_up_the_document(page_lines):
+    pages = list(_parse().paginate(page_lines))
+    assert "\n".join(_body(p) for p in pages) + "\n" == _render()
+
+
+def test_count_and_iteration():
+    pages = _parse().paginate(10)
+    lines = _render().count("\n")
+    assert len(pages) == -(-lines // 10)
+    assert len(list(pages)) == len(pages)
+    with pytest.raises(IndexError):
+        pages.page(len(pages) + 1)
+    with pytest.raises(IndexError):
+        pages.page(0)
+
+
+def test_empty_document():
+    pages = _parse("").paginate(10)
+    assert len(pages) == 1
+    assert pages.page(1) == "\n\nPage 1\n"
+
+
+def test_navigation():
+    pages = _parse().paginate(10, selector="/document/{page}")
+    first = pages.page(1)
+    assert first.endswith("Page 1\nNext page: /document/2\n")
+    assert "Previous page" not in first
+    assert pages.page(2).endswith(
+        "Page 2\nPrevious page: /document/1\nNext page: /document/3\n"
+    )
+    assert "Next page" not in pages.page(len(pages))
+
+
+def test_gophermap_navigation():
+    config = RenderConfig(output_format='gophermap', gopher_host='example.com')
+    with pytest.raises(ValueError):
+        _parse(config=config).paginate(10)
+    page = _parse(config=config).paginate(10, selector="/doc/{page}").page(2)
+    assert "\n1Previous page\t/doc/1\texample.com\t70\n" in page
+    assert "\n1Next page\t/doc/3\texample.com\t70\n" in page
+
+
+def test_footer_lists_links_on_page():
+    config = CONFIG.replace(link_placement='footer', deduplicate_links=True)
+    source = "".join(
+        "<p><a href='/page{}'>Link {}</a> <a href='/home'>Home</a></p>".format(i, i)
+        for i in range(10)
+    )
+    pages = _parse(source, config).paginate(4)
+    first = pages.page(1)
+    assert "[1] Link 0: /page0\n[2] Home: /home\n[3] Link 1: /page1\n" in first
+    assert "/page2" not in first
+    third = pages.page(3)
+    assert "[2] Home: /home\n[6] Link 4: /page4\n" in third
+    assert "/page1" not in third
+
+
+def test_index_skips_measuring(monkeypatch):
+    pages = _parse().paginate(5)
+    expected = pages.page(4)
+    len(pages)
+    index = pages.index
+
+    rendered = []
+    original = Pages._render_node
+
+    def counting(self, position):
+        rendered.append(position)
+        return original(self, position)
+
+    monkeypatch.setattr(Pages, '_render_node', counting)
+    pages = _parse().paginate(5, index=index)
+    assert pages.page(4) == expected
+    assert 0 not in rendered
+    assert len(rendered) <= 3
+    with pytest.raises(ValueError):
+        _parse("<p>Short</p>").paginate(5, index=index)
+
+
+def test_streaming_document_cannot_be_paginated():
+    parser = CONFIG.session()
+    parser.stream_to(io.StringIO())
+    with pytest.raises(ValueError):
+        parser.paginate(10)
@@ -0,0 +1,93 @@
+import pytest
+
+from gopher_render import RenderConfig, render_targets
+from gopher_render.rendering import NonRenderer, InlineRenderer
+
+
+SOURCE = """
+<nav><a href="/home">Home</a><div><nav>Inner</nav><br></div>After inner</nav>
+<p>Body with <a href="/page">a link</a></p>
+<script>var html = "<p>Not a paragraph</p>";</script>
+<style>p { color: red; }</style>
+<pre>code</pre>
+"""
+
+IGNORING = {
+    'nav': NonRenderer,
+    'script': NonRenderer,
+    'style': NonRenderer,
+}
+
+
+def _parse(renderers, source=SOURCE):
+    parser = RenderConfig(renderers=renderers).session()
+    parser.feed(source)
+    parser.close()
+    return parser
+
+
+def test_ignored_content_is_not_parsed():
+    parser = _parse(IGNORING)
+    tags = [(t.tag, len(t.children)) for t in parser.tree.tag_children()]
+    assert tags == [('nav', 0), ('p', 2), ('script', 0), ('style', 0), ('pre', 1)]
+
+
+def test_ignored_content_is_not_rendered():
+    parsed = _parse(IGNORING).parsed
+    assert "Body with" in parsed
+    assert "code" in parsed
+    for text in ("Home", "Inner", "After inner", "Not a paragraph", "color"):
+        assert text not in parsed
+    # Links in ignored content are left out of the footer as well
+    assert "/home" not in parsed
+    assert "/page" in parsed
+
+
+def test_ignored_content_without_parse_time_pruning():
+    # The renderers can't be resolved until the document has been parsed,
+    # so the content is only skipped while rendering.
+    renderers = dict(IGNORING, **{'p:last-child': InlineRenderer})
+    parser = _parse(renderers)
+    assert len(parser.tree.tag_children()[0].children) > 0
+    parsed = parser.parsed
+    assert "Body with" in parsed
+    for text in ("Home", "Inner", "After inner", "Not a paragraph"):
+        assert text not in parsed
+    assert "/home" not in parsed
+    assert "/page" in parsed
+
+
+def test_negation_is_not_the_subject():
+    # The rule applies to everything but paragraphs, so the content of the
+    # div is left out, and the paragraph's is kept.
+    parser = _parse({'*:not(p)': NonRenderer}, "<div><span>Div</span></div><p>Para</p>")
+    tags = [(t.tag, len(t.children)) for t in parser.tree.tag_children()]
+    assert tags == [('div', 0), ('p', 1)]
+    assert "Para" in parser.parsed
+    assert "Div" not in parser.parsed
+
+
+def test_more_specific_rule_overrides():
+    renderers = dict(IGNORING, **{'nav.keep': InlineRenderer})
+    parsed = _parse(renderers, '<nav class="keep">Kept</nav><nav>Dropped</nav>').parsed
+    assert "Kept" in parsed
+    assert "Dropped" not in parsed
+
+
+def test_ignored_links_are_still_extracted():
+    parsed = _parse({'a': NonRenderer}, '<p>A <a href="/page">link</a></p>').parsed
+    assert "[1] link: /page" in parsed
+
+
+def test_targets_with_different_renderers():
+    source = "<p>Text</p><nav>Menu</nav>"
+    ignoring = RenderConfig(renderers=IGNORING)
+    rendering = RenderConfig()
+    parsed = render_targets(source, [ignoring, rendering])
+    assert "Menu" not in parsed[0]
+    assert "Menu" in parsed[1]
+
+    parser = ignoring.session()
+    parser.feed(source)
+    with pytest.raises(ValueError):
+        parser.render_as(rendering)
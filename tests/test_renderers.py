@@ -3,10 +3,282 @@ Test the namedict
 """
 import pytest
 
+from gopher_render import GopherHTMLParser
+from gopher_render import _textwrap as textwrap
+from gopher_render._linebreak import optimal_wrap
 from gopher_render.rendering import Renderer, InlineRenderer, BlockRenderer
+from gopher_render.rendering import optimal_justify
+from gopher_render.rendering import AnsiEscapeCodeRenderer
 
 
 def test_create():
     r = Renderer(None)
     i = InlineRenderer(None)
     b = BlockRenderer(None)
+
+
+def test_optimal_justify_widths():
+    text = " ".join(["Paragraph Text"] * 20)
+    output = optimal_justify(text, 40)
+    lines = output.split('\n')
+    assert len(lines) > 1
+    for line in lines[:-1]:
+        assert len(line) == 40
+    assert " ".join(output.split()) == text
+
+
+def test_optimal_wrap_less_ragged_than_greedy():
+    # The greedy wrapper packs "aaa bb" onto the first line, leaving the
+    # second very loose.
+    text = "aaa bb cc ddddd"
+    assert textwrap.wrap(text, 6) == ["aaa bb", "cc", "ddddd"]
+    assert optimal_wrap(text, 6) == ["aaa", "bb cc", "ddddd"]
+
+
+def test_optimal_wrap_long_words():
+    assert optimal_wrap("abcdefghij xy", 4) == ["abcd", "efgh", "ij", "xy"]
+    assert optimal_wrap("abcdefghij", 4, break_long_words=False) == ["abcdefghij"]
+
+
+def test_optimal_wrap_unequal_indents():
+    # The first line has more room than the others, so everything fits on it.
+    assert optimal_wrap("x x x", 6, subsequent_indent="    ") == ["x x x"]
+    assert optimal_wrap("x xxx xxx", 10, subsequent_indent="    ") == ["x xxx xxx"]
+    assert optimal_wrap("aa bb cc", 6, initial_indent="   ") == ["   aa", "bb cc"]
+
+
+def test_optimal_paragraph():
+    html = "<p>{}</p>".format(" ".join(["Paragraph Text"] * 20))
+    parser = GopherHTMLParser(
+        renderers={'p': (None, dict(justification='optimal'))},
+        optimise=False,
+    )
+    parser.feed(html)
+    parser.close()
+    lines = parser.parsed.split('\n')
+    for line in lines[1:-1]:
+        assert len(line) == 67
+
+
+def test_ansi_escape_sequences_precomputed():
+    parser = GopherHTMLParser(renderers={
+        '.k': (AnsiEscapeCodeRenderer, dict(foreground_colour='yellow')),
+    })
+    parser.feed('<span class="k">one</span> <span class="k">two</span>')
+    parser.close()
+    assert parser.parsed == "\x1b[33mone\x1b[39m \x1b[33mtwo\x1b[39m"
+    first, second = parser.tree.tag_children()
+    # Elements matching the same rules share the prepared settings
+    assert first.renderer_settings is second.renderer_settings
+    assert first.renderer_settings['escape_sequences'] == ("\x1b[33m", "\x1b[39m")
+
+
+def test_ansi_font():
+    r = AnsiEscapeCodeRenderer(None, settings=dict(font=2, bold=True))
+    assert r.render("text") == "\x1b[1m\x1b[12mtext\x1b[22m\x1b[10m"
+
+
+def test_class_rules_indexed(monkeypatch):
+    from gopher_render._parser import RendererMap, TagParser
+    from gopher_render.code_themes.darkly_ansi import renderers as darkly_ansi
+
+    renderers = dict(darkly_ansi)
+    renderers.update({
+        'span': InlineRenderer,
+        'span.k': (None, dict(bold=True)),
+        '.k.special': (None, dict(italic=True)),
+    })
+    indexed = RendererMap(renderers)
+    assert 'cm' in indexed._class_index
+    monkeypatch.setattr(RendererMap, '_simple_class_names', staticmethod(lambda s: None))
+    unindexed = RendererMap(renderers)
+    assert not unindexed._class_index
+
+    parent = TagParser('code', None, None)
+    for classes in ['k', 'cm', 'k special', 'special k', 'nothing', 'c1 o', '']:
+        tag = TagParser('span', parent, [('class', classes)])
+        parent.children.append(tag)
+        expected = unindexed.get_for_tag(tag)
+        actual = indexed.get_for_tag(tag)
+        assert actual[0] is expected[0]
+        assert actual[1] == expected[1]
+
+
+class TestStateless:
+
+    def _render(self, renderers, source, **config):
+        parser = GopherHTMLParser(renderers=renderers, **config)
+        parser.feed(source)
+        parser.close()
+        return parser.parsed
+
+    def test_function_renderer(self):
+        def shout(node, settings, box, content):
+            return content.upper() + settings.get('suffix', '')
+
+        renderers = {'em': shout, 'em.loud': (None, dict(suffix='!'))}
+        parsed = self._render(renderers, '<p><em>quiet</em> <em class="loud">loud</em></p>')
+        assert "QUIET LOUD!" in parsed
+
+    def test_stateless_renderer(self):
+        from gopher_render.rendering import Box, StatelessRenderer
+
+        class Indented(StatelessRenderer):
+            settings = dict(indent=2)
+
+            def box(self, node, settings, parent_box):
+                return Box(margin=[0, 0, 0, settings.indent], parent=parent_box)
+
+            def render(self, node, settings, box, content):
+                return "\n".join(
+                    ' ' * box.margin[3] + line for line in content.split('\n')
+                )
+
+        renderers = {'div': Indented(indent=4)}
+        parsed = self._render(renderers, '<div><p>Text</p></div>', box=None)
+        assert "\n    Text\n" in parsed
+
+    def test_classes_adapted(self):
+        from gopher_render.rendering import EmRenderer, CodeRenderer, LinkRenderer
+
+        class Settings(EmRenderer):
+            settings = dict(template="*{}*")
+
+        class Overridden(EmRenderer):
+            def render(self, content):
+                return "!"
+
+        assert EmRenderer.stateless() is not None
+        assert CodeRenderer.stateless() is not None
+        assert AnsiEscapeCodeRenderer.stateless() is not None
+        assert LinkRenderer.stateless() is not None
+        assert Settings.stateless() is not None
+        assert Overridden.stateless() is None
+        assert BlockRenderer.stateless() is None
+
+    def test_map_returns_configured_classes(self):
+        from gopher_render._parser import RendererMap, TagParser
+        from gopher_render.rendering import EmRenderer, ParagraphRenderer
+
+        class Subclass(EmRenderer):
+            pass
+
+        renderer_map = RendererMap({
+            'em': (EmRenderer, dict(template="/{}/")),
+            'p': ParagraphRenderer,
+            'b': Subclass,
+        })
+        em = TagParser('em', None, None)
+        assert renderer_map.get_for_tag(em)[0] is EmRenderer
+        stateless, stateless_settings = renderer_map.get_stateless_for_tag(em)
+        assert stateless is EmRenderer.stateless()
+        assert stateless_settings.template == "/{}/"
+        # The settings are only prepared once
+        assert renderer_map.get_stateless_for_tag(em)[1] is stateless_settings
+        assert renderer_map.get_for_tag(TagParser('b', None, None))[0] is Subclass
+        # Classes without a stateless equivalent are used as they are
+        p = TagParser('p', None, None)
+        assert renderer_map.get_stateless_for_tag(p) is renderer_map.get_for_tag(p)
+
+    def test_adapted_classes_render_the_same(self, monkeypatch):
+        from gopher_render import _parser
+
+        renderers = {
+            'em.caps': (None, dict(capitalized=True)),
+            '.k': (AnsiEscapeCodeRenderer, dict(bold=True, foreground_colour='red')),
+        }
+        source = (
+            '<p><em>em</em> <em class="caps">caps</em> <strong>strong</strong> '
+            '<code>code</code> <span class="k">keyword</span> <q>default</q></p>'
+            '<pre><code>block</code></pre>'
+        )
+        adapted = self._render(renderers, source)
+        monkeypatch.setattr(Renderer, 'stateless', classmethod(lambda cls: None))
+        # Don't reuse the renderer maps compiled with the adapted classes
+        monkeypatch.setattr(_parser, '_renderer_maps', {})
+        assert self._render(renderers, source) == adapted
+
+    def test_no_instances_for_adapted_classes(self, monkeypatch):
+        created = []
+        original = Renderer.__new__
+
+        def counting_new(cls, *args, **kwargs):
+            created.append(cls)
+            return original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(Renderer, '__new__', counting_new)
+        self._render({}, '<p><em>a</em> <strong>b</strong> <code>c</code> <span>d</span></p>')
+        assert [cls.__name__ for cls in created] == ['ParagraphRenderer']
+
+
+class TestInlineRuns:
+
+    SOURCE = (
+        '<p>Some <em>emphasised <strong>and strong</strong></em> text, '
+        '<code>code</code>, <a href="/page" title="Page">a <em>link</em></a>, '
+        '<img src="picture.png" alt="Picture"><br>after a break and '
+        '<span class="k">a keyword</span>.</p>'
+        '<p><em class="caps">capitals</em> <code>multi\nline</code> '
+        '<a href="http://example.com/">another link</a></p>'
+        '<blockquote><p>Quoted <b>text</b></p></blockquote>'
+        '<pre><code>  preformatted\n    code</code></pre>'
+        '<ul><li>An <i>item</i></li></ul>'
+    )
+
+    RENDERERS = {
+        'em.caps': (None, dict(capitalized=True)),
+        '.k': (AnsiEscapeCodeRenderer, dict(bold=True)),
+    }
+
+    def _render(self, **config):
+        parser = GopherHTMLParser(renderers=self.RENDERERS, **config)
+        parser.feed(self.SOURCE)
+        parser.close()
+        return parser.parsed
+
+    @pytest.mark.parametrize('config', [
+        dict(),
+        dict(link_placement='inline', image_placement='inline'),
+        dict(link_placement='after_block'),
+        dict(output_format='gophermap', gopher_host='example.com'),
+    ])
+    def test_flattened_content_renders_the_same(self, monkeypatch, config):
+        from gopher_render import _parser
+
+        flattened = self._render(**config)
+        monkeypatch.setattr(_parser, '_inline_runs', lambda block, out_of_time: None)
+        assert self._render(**config) == flattened
+
+    def test_image_references(self):
+        # The alt text is only used for the extracted link
+        output = self._render(image_placement='footer')
+        assert "[Image][2]" in output
+        assert "[2] Picture: picture.png" in output
+
+    def test_runs(self):
+        from gopher_render._parser import _inline_runs
+
+        parser = GopherHTMLParser()
+        parser.feed('<p>Plain <em>em <strong>strong</strong></em><br></p>')
+        paragraph = parser.tree.tag_children()[0]
+        parser._assign_renderer(paragraph)
+        for node in paragraph.tag_children():
+            parser._assign_renderer(node)
+            for child in node.tag_children():
+                parser._assign_renderer(child)
+        runs, steps, stopped = _inline_runs(paragraph)
+        assert runs == [
+            ("Plain ", "", ""),
+            ("em ", "_", ""),
+            ("strong", "**", "**_"),
+            ("", "\n", ""),
+        ]
+        assert steps == 6
+        assert not stopped
+
+        # Cut short after the text in the em, which is still closed
+        ticks = iter(range(10))
+        runs, steps, stopped = _inline_runs(paragraph, lambda: next(ticks) >= 2)
+        assert runs == [("Plain ", "", ""), ("em ", "_", "_")]
+        assert steps == 3
+        assert stopped
@@ -656,3 +656,29 @@ class TestPseudoClasses:
             ('.last > div:nth-last-child(1)',             (False, False, False, True)),
         )
         _perform_checks(section2.children, section2_checks)
+
+
+def test_renderer_map_by_element():
+    from gopher_render._parser import RendererMap, TagParser
+    from gopher_render.rendering import EmRenderer, StrongRenderer, InlineRenderer
+
+    renderer_map = RendererMap({
+        'em': EmRenderer,
+        '*:not(p)': StrongRenderer,
+        'p > em:first-child': InlineRenderer,
+    })
+    root = DocumentParser()
+    p = TagParser('p', root, [])
+    first = TagParser('em', p, [])
+    second = TagParser('em', p, [])
+    span = TagParser('span', p, [])
+    p.children = [first, second, span]
+
+    def renderer(tag):
+        return renderer_map.get_for_tag(tag)[0]
+
+    assert renderer_map.get_for_tag(p) is None
+    assert renderer(first) is InlineRenderer
+    # The negation is as specific as an element name, and comes later
+    assert renderer(second) is StrongRenderer
+    assert renderer(span) is StrongRenderer
@@ -0,0 +1,199 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from gopher_render import server as gopher_server
+from gopher_render.cli import _Configuration
+
+
+HTML = """<h1>Title</h1>
+<p>Some <em>text</em> with <a href="gopher://example.com/">a link</a>.</p>
+<p>.starts with a period</p>
+"""
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / 'post.html').write_text(HTML)
+    (tmp_path / 'data.bin').write_bytes(b"\x00\x01")
+    (tmp_path / 'posts').mkdir()
+    (tmp_path / 'posts' / 'other.html').write_text("<p>Other</p>")
+    (tmp_path / 'notes.txt').write_text("Notes")
+    (tmp_path / '.hidden').write_text("")
+    (tmp_path / '.git').mkdir()
+    (tmp_path / '.git' / 'config').write_text("[core]")
+    return tmp_path
+
+
+def _run(root, requests, executor=None):
+    """
+    Start a server for the root, make the requests with the bundled client,
+    and return the responses and the server.
+    """
+    async def run():
+        server = gopher_server.GopherServer(
+            root,
+            port=0,
+            executor=executor or concurrent.futures.ThreadPoolExecutor(2),
+        )
+        await server.start()
+        try:
+            responses = []
+            for request in requests:
+                if callable(request):
+                    request()
+                else:
+                    responses.append(await gopher_server.fetch('localhost', server.port, request))
+            return responses, server
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_render_document(root):
+    responses, server = _run(root, ['/post.html'])
+    expected = _Configuration().render(HTML).rstrip('\n')
+    assert responses[0].endswith(b"\r\n.\r\n")
+    assert b"\r\n..starts with a period\r\n" in responses[0]
+    assert gopher_server.decode_text(responses[0]) == expected
+
+
+def test_cached_until_modified(root):
+    path = root / 'post.html'
+
+    def modify():
+        path.write_text("<p>Changed</p>")
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    responses, server = _run(root, ['/post.html', '/post.html', modify, '/post.html'])
+    assert responses[0] == responses[1]
+    assert b"Changed" in responses[2]
+    assert server.cache.hits == 1
+    assert server.cache.misses == 2
+
+
+class _CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+
+    submitted = 0
+    last_args = None
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        self.last_args = args
+        return super().submit(*args, **kwargs)
+
+
+def test_concurrent_requests_render_once(root):
+    executor = _CountingExecutor(2)
+
+    async def run():
+        server = gopher_server.GopherServer(
+            root,
+            port=0,
+            executor=executor,
+        )
+        await server.start()
+        try:
+            responses = await asyncio.gather(*[
+                gopher_server.fetch('localhost', server.port, '/post.html')
+                for _ in range(5)
+            ])
+        finally:
+            await server.close()
+        return responses, server
+    responses, server = asyncio.run(run())
+    assert len(set(responses)) == 1
+    assert executor.submitted == 1
+
+
+def test_documents_link_to_server(root):
+    executor = _CountingExecutor(1)
+    responses, server = _run(root, ['/post.html'], executor=executor)
+    options = executor.last_args[-1]
+    assert options['gopher_host'] == 'localhost'
+    assert options['gopher_port'] == server.port
+
+
+def test_file_reads_do_not_block(root, monkeypatch):
+    release = threading.Event()
+    read_bytes = Path.read_bytes
+
+    def slow_read_bytes(self):
+        release.wait(10)
+        return read_bytes(self)
+
+    monkeypatch.setattr(Path, 'read_bytes', slow_read_bytes)
+
+    async def run():
+        server = gopher_server.GopherServer(
+            root,
+            port=0,
+            executor=concurrent.futures.ThreadPoolExecutor(1),
+        )
+        await server.start()
+        try:
+            slow = asyncio.ensure_future(
+                gopher_server.fetch('localhost', server.port, '/data.bin')
+            )
+            await asyncio.sleep(0.1)
+            menu = await gopher_server.fetch('localhost', server.port, '/posts')
+            waiting = not slow.done()
+            release.set()
+            return await slow, menu, waiting
+        finally:
+            release.set()
+            await server.close()
+    data, menu, waiting = asyncio.run(run())
+    assert waiting
+    assert data == b"\x00\x01"
+    assert b"other.html" in menu
+
+
+def test_menu(root):
+    responses, server = _run(root, ['', '/posts'])
+    port = server.port
+    assert responses[0].decode('utf-8') == (
+        "9data.bin\t/data.bin\tlocalhost\t{0}\r\n"
+        "0notes.txt\t/notes.txt\tlocalhost\t{0}\r\n"
+        "0post.html\t/post.html\tlocalhost\t{0}\r\n"
+        "1posts\t/posts\tlocalhost\t{0}\r\n"
+        ".\r\n"
+    ).format(port)
+    assert b"0other.html\t/posts/other.html\t" in responses[1]
+
+
+def test_other_files_served_unchanged(root):
+    responses, server = _run(root, ['/data.bin'])
+    assert responses[0] == b"\x00\x01"
+
+
+@pytest.mark.parametrize('selector', [
+    '/missing.html',
+    '/../outside.html',
+    '../../etc/passwd',
+    '/.hidden',
+    '/.git/config',
+    '/posts/../.git/config',
+])
+def test_not_found(root, selector):
+    (root.parent / 'outside.html').write_text("<p>Secret</p>")
+    responses, server = _run(root, [selector])
+    assert responses[0].startswith(b"3Not found\t")
+
+
+def test_process_pool(root):
+    responses, server = _run(
+        root,
+        ['/post.html'],
+        executor=concurrent.futures.ProcessPoolExecutor(
+            1,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    )
+    assert gopher_server.decode_text(responses[0]) == _Configuration().render(HTML).rstrip('\n')
@@ -0,0 +1,52 @@
+"""
+Tests that the package imports its optional dependencies only when needed.
+"""
+import subprocess
+import sys
+
+import pytest
+
+
+def _imported_modules(code):
+    """
+    Run the code in a fresh interpreter and return the modules it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', code + '\nimport sys\nprint("\\n".join(sys.modules))'],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    return set(result.stdout.split())
+
+
+@pytest.mark.parametrize('module', [
+    'markdown',
+    'pygments',
+    'cssselect',
+    'gopher_render.cli',
+    'gopher_render.code_themes.monokai',
+])
+def test_import_is_lazy(module):
+    assert module not in _imported_modules('import gopher_render')
+
+
+def test_main_available():
+    import gopher_render
+    from gopher_render.cli import main
+    assert gopher_render.main is main
+
+
+def test_themes_load_on_demand():
+    modules = _imported_modules(
+        'from gopher_render import code_themes\n'
+        'code_themes.load("monokai")'
+    )
+    assert 'gopher_render.code_themes.monokai' in modules
+    assert 'gopher_render.code_themes.github' not in modules
+
+
+def test_unknown_theme():
+    from gopher_render import code_themes
+    with pytest.raises(ValueError):
+        code_themes.load('nothing')
@@ -0,0 +1,192 @@
+import codecs
+import io
+
+from gopher_render import RenderConfig, render_file
+from gopher_render import OutputLimitExceeded
+from gopher_render._stream import sniff_encoding, decode_chunks
+from gopher_render.rendering import Box, BlockRenderer, AnsiEscapeCodeRenderer
+
+
+SOURCE = (
+    "<h1>Title</h1>"
+    + "".join(
+        "<p>Paragraph {} with <a href='/page{}'>a link</a> and café.</p>".format(i, i)
+        for i in range(40)
+    )
+    + "<ul><li>One</li><li>Two</li></ul>"
+)
+
+CONFIG = RenderConfig(
+    output_format='text',
+    box=Box(width=40, margin=[1, 0, 2, 3]),
+    link_placement='footer',
+)
+
+
+def _batch(source, config=CONFIG):
+    parser = config.session()
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+class TestSniffing:
+
+    def test_bom(self):
+        assert sniff_encoding(codecs.BOM_UTF8 + b"<p>") == 'utf-8-sig'
+        assert sniff_encoding(codecs.BOM_UTF16_LE + b"<") == 'utf-16'
+        assert sniff_encoding(codecs.BOM_UTF32_LE + b"<") == 'utf-32'
+
+    def test_meta(self):
+        assert sniff_encoding(b'<meta charset="latin-1"><p>') == 'iso8859-1'
+        assert sniff_encoding(
+            b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">'
+        ) == 'cp1252'
+
+    def test_default(self):
+        assert sniff_encoding(b"<p>Hello</p>") == 'utf-8'
+        assert sniff_encoding(b'<meta charset="nonsense">') == 'utf-8'
+
+    def test_split_characters_are_decoded(self):
+        data = "café ☃".encode('utf-8')
+        chunks = [data[i:i + 1] for i in range(len(data))]
+        assert "".join(decode_chunks(chunks)) == "café ☃"
+
+
+class TestFeeding:
+
+    def test_feed_stream_text(self):
+        parser = CONFIG.session()
+        parser.feed_stream(io.StringIO(SOURCE), chunk_size=7)
+        parser.close()
+        assert parser.parsed == _batch(SOURCE)
+
+    def test_feed_stream_bytes(self):
+        parser = CONFIG.session()
+        parser.feed_stream(io.BytesIO(SOURCE.encode('utf-16')), chunk_size=7)
+        parser.close()
+        assert parser.parsed == _batch(SOURCE)
+
+    def test_feed_file(self, tmp_path):
+        path = tmp_path / "page.html"
+        path.write_bytes(SOURCE.encode('utf-8'))
+        parser = CONFIG.session()
+        parser.feed_file(path, chunk_size=100)
+        parser.close()
+        assert parser.parsed == _batch(SOURCE)
+
+    def test_feed_empty_file(self, tmp_path):
+        path = tmp_path / "empty.html"
+        path.write_bytes(b"")
+        parser = CONFIG.session()
+        parser.feed_file(path)
+        parser.close()
+        assert parser.parsed == _batch("")
+
+
+class TestStreaming:
+
+    def test_streamed_output_matches(self):
+        out = io.StringIO()
+        parser = CONFIG.session()
+        parser.stream_to(out)
+        parser.feed(SOURCE)
+        parser.close()
+        assert parser.parsed == ""
+        assert out.getvalue() == _batch(SOURCE)
+
+    def test_output_is_written_while_parsing(self):
+        out = io.StringIO()
+        parser = CONFIG.session()
+        parser.stream_to(out)
+        parser.feed("<p>First</p><p>Second</p>")
+        assert "First" in out.getvalue()
+        assert "Second" not in out.getvalue()
+        parser.close()
+        assert "Second" in out.getvalue()
+
+    def test_wrapped_document_is_streamed(self):
+        source = "<html><head><title>Page</title></head><body>" + SOURCE + "</body></html>"
+        out = io.StringIO()
+        parser = CONFIG.session()
+        parser.stream_to(out)
+        parser.feed(source[:len(source) // 2])
+        assert "Paragraph 1 " in out.getvalue()
+        parser.feed(source[len(source) // 2:])
+        parser.close()
+        assert out.getvalue() == _batch(source)
+
+    def test_wrapped_document_with_body_renderer(self):
+        # The body's renderer changes its content, so it is only written once
+        # it is complete.
+        config = CONFIG.replace(renderers={
+            'body': (BlockRenderer, dict(margin=[0, 0, 0, 2])),
+        })
+        source = "<html><body>" + SOURCE + "</body></html>"
+        out = io.StringIO()
+        parser = config.session()
+        parser.stream_to(out)
+        parser.feed(source[:len(source) // 2])
+        assert "Title" not in out.getvalue()
+        parser.feed(source[len(source) // 2:])
+        parser.close()
+        assert out.getvalue() == _batch(source, config)
+
+    def test_completed_nodes_are_discarded(self):
+        parser = CONFIG.session()
+        parser.stream_to(io.StringIO())
+        parser.feed("<div><p>First</p></div><div>")
+        assert parser.tree.children[0].children == []
+        parser = CONFIG.session()
+        parser.stream_to(io.StringIO())
+        parser.feed("<html><body><div><p>First</p></div><div>")
+        assert parser.tree.children[0].children[0].children[0].children == []
+
+    def test_output_limit(self):
+        config = CONFIG.replace(max_output=300, on_limit='truncate')
+        out = io.StringIO()
+        parser = config.session()
+        parser.stream_to(out)
+        parser.feed(SOURCE)
+        parser.close()
+        assert isinstance(parser.truncated, OutputLimitExceeded)
+        assert 0 < len(out.getvalue().encode('utf-8')) <= 300
+        assert out.getvalue() == _batch(SOURCE, config)
+
+    def test_output_limit_ends_styles(self):
+        config = CONFIG.replace(
+            renderers={'.k': (AnsiEscapeCodeRenderer, dict(foreground_colour='yellow'))},
+            max_output=200,
+            on_limit='truncate',
+        )
+        source = '<p><span class="k">' + 'word ' * 100 + '</span></p>'
+        for minimise_ansi in (False, True):
+            config = config.replace(minimise_ansi=minimise_ansi)
+            out = io.StringIO()
+            parser = config.session()
+            parser.stream_to(out)
+            parser.feed(source)
+            parser.close()
+            assert out.getvalue().endswith("word\n\x1b[0m")
+            assert len(out.getvalue().encode('utf-8')) <= 200
+            assert out.getvalue() == _batch(source, config)
+
+    def test_reset_stops_streaming(self):
+        out = io.StringIO()
+        parser = CONFIG.session()
+        parser.stream_to(out)
+        parser.reset()
+        parser.feed(SOURCE)
+        parser.close()
+        assert "Title" not in out.getvalue()
+        assert parser.parsed == _batch(SOURCE)
+
+
+def test_render_file(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text('<meta charset="latin-1">' + SOURCE, encoding='latin-1')
+    expected = _batch('<meta charset="latin-1">' + SOURCE)
+    assert render_file(path, CONFIG) == expected
+    out = io.StringIO()
+    assert render_file(path, CONFIG, out=out) is None
+    assert out.getvalue() == expected
@@ -0,0 +1,124 @@
+import pytest
+
+from gopher_render import GopherHTMLParser
+from gopher_render.rendering import Box, AnsiEscapeCodeRenderer, BlockRenderer
+from gopher_render.rendering import TableRenderer
+from gopher_render.rendering import _fit_columns
+
+
+TABLE = """
+<table>
+<caption>Numbers</caption>
+<thead><tr><th>Name</th><th>Description</th><th>Value</th></tr></thead>
+<tbody>
+<tr><td>One</td><td>The first <em>number</em></td><td>1</td></tr>
+<tr><td>Two</td><td>Second</td></tr>
+</tbody>
+</table>
+"""
+
+
+def _render(source, **config):
+    parser = GopherHTMLParser(**config)
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+def test_table():
+    assert _render(TABLE) == (
+        "\n"
+        "Numbers\n"
+        "| Name | Description        | Value |\n"
+        "| ---- | ------------------ | ----- |\n"
+        "| One  | The first _number_ | 1     |\n"
+        "| Two  | Second             |       |\n"
+    )
+
+
+def test_columns_wrapped_to_box():
+    source = (
+        "<table><tr><td>Short</td>"
+        "<td>A much longer cell that will not fit in the narrow box at all</td>"
+        "</tr></table>"
+    )
+    lines = _render(source, box=Box(width=30)).strip('\n').split('\n')
+    assert lines[0] == "| Short | A much longer cell |"
+    assert all(len(l) == 30 for l in lines)
+    assert " ".join(l[10:-2].strip() for l in lines) == (
+        "A much longer cell that will not fit in the narrow box at all"
+    )
+
+
+def test_cells_with_escape_sequences():
+    renderers = {'.k': (AnsiEscapeCodeRenderer, dict(bold=True))}
+    source = (
+        "<table><tr><td><span class='k'>Bold</span></td><td>x</td></tr>"
+        "<tr><td>Plain</td><td>y</td></tr></table>"
+    )
+    lines = _render(source, renderers=renderers).strip('\n').split('\n')
+    assert lines[0] == "| \x1b[1mBold\x1b[22m  | x |"
+    assert lines[1] == "| Plain | y |"
+
+
+def test_custom_layout():
+    renderers = {
+        'table': (TableRenderer, dict(
+            row_template="{}",
+            column_separator="  ",
+            header_rule="",
+        )),
+    }
+    assert _render(TABLE, renderers=renderers) == (
+        "\n"
+        "Numbers\n"
+        "Name  Description         Value\n"
+        "One   The first _number_  1\n"
+        "Two   Second\n"
+    )
+
+
+def test_rows_outside_a_table():
+    parsed = _render("<p><tr><td>a</td><td>b</td></tr></p><tr><th>c</th></tr>")
+    assert parsed == "\nab\nc"
+    # Nor are the parts marked when the table has another renderer
+    renderers = {'table': BlockRenderer}
+    parsed = _render("<table><tr><td>a</td><td>b</td></tr></table>", renderers=renderers)
+    assert parsed == "ab"
+
+
+def test_table_marks_in_text():
+    # The characters marking the parts of a table are removed from the text,
+    # so they can't add cells or leak into the output
+    source = "<table><tr><td>a\x1fb</td><td>c</td></tr></table>"
+    assert "| ab | c |" in _render(source)
+    assert _render("<p>a\x1eb</p>") == "\nab\n"
+    source = "<table><tr><td><a href='/pa\x1dge' title='T\x1eitle'>Page</a></td></tr></table>"
+    parsed = _render(source, link_placement='inline')
+    assert '| [Page](/page "Title") |' in parsed
+    assert not set(parsed) & set("\x1d\x1e\x1f")
+
+
+def test_links_in_cells():
+    source = "<table><tr><td><a href='/page'>Page</a></td></tr></table>"
+    assert "| [Page][1] |" in _render(source)
+    assert "| [Page](/page) |" in _render(source, link_placement='inline')
+
+
+def test_large_table():
+    rows = "".join(
+        "<tr><td>{}</td><td>Row {}</td></tr>".format(i, i) for i in range(10000)
+    )
+    lines = _render("<table>" + rows + "</table>").strip('\n').split('\n')
+    assert len(lines) == 10000
+    assert lines[-1] == "| 9999 | Row 9999 |"
+
+
+@pytest.mark.parametrize('widths, available, expected', [
+    ([3, 4], 10, [3, 4]),
+    ([3, 40], 20, [3, 17]),
+    ([30, 40], 20, [10, 10]),
+    ([2, 30, 40], 21, [2, 10, 9]),
+])
+def test_fit_columns(widths, available, expected):
+    assert _fit_columns(widths, available) == expected
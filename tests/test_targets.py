@@ -0,0 +1,92 @@
+from gopher_render import RenderConfig, render_targets, render_widths
+from gopher_render.rendering import Box, AnsiEscapeCodeRenderer
+
+
+SOURCE = """
+<h1>Title</h1>
+<p>Some text with <a href="/one">a link</a> and
+<a href="http://example.com/two">another</a>.</p>
+<div><p>An <img src="picture.png" alt="Picture"> in a block.</p></div>
+<ul><li><a href="gopher://example.org/three.txt">Three</a></li></ul>
+"""
+
+TARGETS = [
+    RenderConfig(output_format='gophermap', gopher_host='example.com', link_placement='after_block'),
+    RenderConfig(box=Box(width=67, margin=[1, 0, 1, 0])),
+    RenderConfig(box=Box(width=40), link_placement='inline', gopher_host='other.com', gopher_port=7070),
+    RenderConfig(output_format='gophermap', gopher_host='example.com', image_placement='footer'),
+]
+
+
+def _render(config, source=SOURCE):
+    parser = config.session()
+    parser.feed(source)
+    parser.close()
+    return parser.parsed
+
+
+def test_targets_match_separate_renders():
+    assert render_targets(SOURCE, TARGETS) == [_render(c) for c in TARGETS]
+
+
+def test_no_targets():
+    assert render_targets(SOURCE, []) == []
+
+
+def test_parser_renders_itself_after_other_targets():
+    parser = TARGETS[0].session()
+    parser.feed(SOURCE)
+    others = [parser.render_as(c) for c in TARGETS[1:]]
+    parser.close()
+    assert [parser.parsed] + others == [_render(c) for c in TARGETS]
+
+
+def test_identical_renderers_share_maps():
+    first = RenderConfig(box=Box(width=40))
+    second = RenderConfig(output_format='gophermap', gopher_host='example.com')
+    assert first.renderer_maps is second.renderer_maps
+    third = RenderConfig(renderers={'p': (None, dict(margin=[0, 0, 0, 0]))})
+    assert third.renderer_maps is not first.renderer_maps
+
+
+def test_widths_match_separate_renders():
+    config = RenderConfig(link_placement='after_block')
+    widths = [40, 67, 80]
+    expected = [
+        _render(config.replace(box=Box(width=width))) for width in widths
+    ]
+    assert render_widths(SOURCE, widths, config) == expected
+
+
+def test_widths_share_layouts(monkeypatch):
+    from gopher_render import _textwrap, _linebreak
+
+    source = (
+        "<p>A paragraph long enough to be wrapped at every one of the widths "
+        "it is rendered at.</p>"
+        "<p style='x'><span class='k'>Escaped</span> text, wrapped optimally.</p>"
+        "<p><span class='k'>Escaped</span> text, wrapped greedily.</p>"
+    )
+    renderers = {
+        '.k': (AnsiEscapeCodeRenderer, dict(bold=True)),
+        'p[style]': (None, dict(justification='optimal')),
+    }
+    split = []
+    original_chunks = _textwrap._chunks
+    original_words = _linebreak._measure_words
+    monkeypatch.setattr(
+        _textwrap, '_chunks',
+        lambda wrapper, text: split.append(text) or original_chunks(wrapper, text)
+    )
+    monkeypatch.setattr(
+        _linebreak, '_measure_words',
+        lambda text: split.append(text) or original_words(text)
+    )
+    config = RenderConfig(renderers=renderers)
+    results = render_widths(source, [20, 30, 40], config)
+    assert len(split) == 3
+    monkeypatch.setattr(_textwrap, '_chunks', original_chunks)
+    monkeypatch.setattr(_linebreak, '_measure_words', original_words)
+    assert results == [
+        _render(config.replace(box=Box(width=width)), source) for width in [20, 30, 40]
+    ]
@@ -0,0 +1,75 @@
+import pytest
+
+from gopher_render import RenderConfig
+from gopher_render.rendering import Box
+
+
+SOURCE = """
+<h1 id="top" class="title main">Title</h1>
+<p>Some <em>emphasised</em> text with <a href="/page" title="Page">a link</a>
+and an <img src="picture.png" alt="Picture">.</p>
+<ul>
+    <li>One</li>
+    <li>Two<br>lines</li>
+</ul>
+<pre>  Preformatted
+    text  </pre>
+<blockquote><p>Quoted &amp; escaped</p></blockquote>
+<p>Unclosed <b>tags
+"""
+
+CONFIGS = [
+    RenderConfig(),
+    RenderConfig(box=Box(width=30, margin=[0, 0, 0, 2]), link_placement='inline'),
+    RenderConfig(output_format='gophermap', gopher_host='example.com', link_placement='after_block', image_placement='footer'),
+]
+
+
+def _render(config, source=None, tree=None):
+    parser = config.session()
+    if tree is None:
+        parser.feed(source)
+    else:
+        parser.feed_tree(tree)
+    parser.close()
+    return parser.parsed
+
+
+def _dump(source):
+    parser = RenderConfig().session()
+    parser.feed(source)
+    return parser.dump_tree()
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+def test_tree_renders_the_same(config):
+    assert _render(config, tree=_dump(SOURCE)) == _render(config, SOURCE)
+
+
+def test_tree_can_be_dumped_after_rendering():
+    parser = RenderConfig().session()
+    parser.feed(SOURCE)
+    parser.close()
+    assert parser.dump_tree() == _dump(SOURCE)
+
+
+def test_parser_renders_after_dumping():
+    parser = RenderConfig().session()
+    parser.feed(SOURCE)
+    parser.dump_tree()
+    parser.close()
+    assert parser.parsed == _render(RenderConfig(), SOURCE)
+
+
+def test_deep_tree():
+    source = "<span>" * 3000 + "Deep" + "</span>" * 3000
+    assert "Deep" in _render(RenderConfig(), tree=_dump(source))
+
+
+def test_invalid_data():
+    with pytest.raises(ValueError):
+        RenderConfig().session().feed_tree(b"<p>Not a tree</p>")
+    tree = bytearray(_dump(SOURCE))
+    tree[4] = 0
+    with pytest.raises(ValueError):
+        RenderConfig().session().feed_tree(bytes(tree))